@@ -0,0 +1,265 @@
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any
+import config
+import routes
+from utils import logger
+
+class TokenBucket:
+    """A token bucket refilled lazily on each call, so checking it is O(1)."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now):
+        """
+        Take one token if the bucket has one.
+
+        Args:
+            now (float): The current time.monotonic() value
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+def parse_endpoint_limits(spec):
+    """
+    Parse RATE_LIMIT_ENDPOINTS.
+
+    Args:
+        spec (str): Comma-separated endpoint=rate[:burst] pairs
+
+    Returns:
+        dict: (rate, burst) keyed by route endpoint; the burst defaults to the rate
+    """
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        try:
+            endpoint, limit = item.split("=", 1)
+            rate, _, burst = limit.partition(":")
+            if float(rate) <= 0:
+                raise ValueError(rate)
+            limits[endpoint.strip().strip('/')] = (float(rate), float(burst or rate))
+        except ValueError:
+            logger.warning(f"Ignoring malformed RATE_LIMIT_ENDPOINTS entry: {item}")
+    return limits
+
+_endpoint_limits = parse_endpoint_limits(config.RATE_LIMIT_ENDPOINTS)
+_endpoint_buckets: Dict[str, TokenBucket] = {
+    endpoint: TokenBucket(rate, burst) for endpoint, (rate, burst) in _endpoint_limits.items()
+}
+# Client buckets, least recently seen first
+_client_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+_in_flight = 0
+# Futures of requests waiting for an in-flight slot, oldest first
+_waiters: deque = deque()
+
+admission_stats = {
+    "admitted": 0,
+    "queued": 0,
+    "rejected_client_rate": 0,
+    "rejected_endpoint_rate": 0,
+    "rejected_queue_full": 0,
+    "rejected_queue_timeout": 0
+}
+
+def is_enabled():
+    """
+    Check whether any admission limit is configured.
+
+    Returns:
+        bool: True if an in-flight cap or a rate limit is set
+    """
+    return bool(config.ADMISSION_MAX_IN_FLIGHT > 0 or config.RATE_LIMIT_CLIENT_RATE > 0 or _endpoint_buckets)
+
+def client_id(scope):
+    """
+    Identify the client of a request.
+
+    Args:
+        scope (dict): The ASGI connection scope
+
+    Returns:
+        str: The first X-Forwarded-For address, or the peer address
+    """
+    for name, value in scope["headers"]:
+        if name == b"x-forwarded-for":
+            return value.decode("latin-1").split(",", 1)[0].strip()
+    client = scope.get("client")
+    return client[0] if client else ""
+
+def check_rate(client, endpoint):
+    """
+    Charge a request to its client's and its endpoint's token buckets.
+
+    Args:
+        client (str): The client identity
+        endpoint (str): The route endpoint
+
+    Returns:
+        tuple: (None, 0) if the request is within its limits, otherwise the
+            exceeded limit ("client_rate" or "endpoint_rate") and the seconds to wait
+    """
+    now = time.monotonic()
+    if config.RATE_LIMIT_CLIENT_RATE > 0:
+        bucket = _client_buckets.get(client)
+        if bucket is None:
+            bucket = _client_buckets[client] = TokenBucket(
+                config.RATE_LIMIT_CLIENT_RATE, config.RATE_LIMIT_CLIENT_BURST, now
+            )
+            # Forgetting the least recently seen client gives it a full bucket next time
+            if len(_client_buckets) > config.RATE_LIMIT_MAX_CLIENTS:
+                _client_buckets.popitem(last=False)
+        else:
+            _client_buckets.move_to_end(client)
+        wait = bucket.take(now)
+        if wait:
+            return "client_rate", wait
+    bucket = _endpoint_buckets.get(endpoint)
+    if bucket is not None:
+        wait = bucket.take(now)
+        if wait:
+            return "endpoint_rate", wait
+    return None, 0.0
+
+async def acquire():
+    """
+    Take an in-flight slot, waiting in the queue if all are taken.
+
+    Returns:
+        str: None once a slot is taken, or "queue_full" / "queue_timeout" if the request is shed
+    """
+    global _in_flight
+    if config.ADMISSION_MAX_IN_FLIGHT <= 0:
+        return None
+    if _in_flight < config.ADMISSION_MAX_IN_FLIGHT and not _waiters:
+        _in_flight += 1
+        return None
+    if len(_waiters) >= config.ADMISSION_QUEUE_SIZE:
+        return "queue_full"
+    waiter = asyncio.get_running_loop().create_future()
+    _waiters.append(waiter)
+    admission_stats["queued"] += 1
+    try:
+        # release() hands its slot straight to the waiter, so _in_flight is not touched here
+        await asyncio.wait_for(asyncio.shield(waiter), config.ADMISSION_QUEUE_TIMEOUT)
+        return None
+    except asyncio.TimeoutError:
+        return _abandon(waiter, "queue_timeout")
+    except BaseException:
+        _abandon(waiter, None)
+        raise
+
+def _abandon(waiter, reason):
+    """Leave the queue, giving back the slot if it was handed over meanwhile."""
+    if waiter.done():
+        release()
+        return reason
+    waiter.cancel()
+    try:
+        _waiters.remove(waiter)
+    except ValueError:
+        pass
+    return reason
+
+def release():
+    """Free an in-flight slot, handing it to the oldest waiting request if there is one."""
+    global _in_flight
+    while _waiters:
+        waiter = _waiters.popleft()
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+    _in_flight -= 1
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that sheds proxied MLflow calls over the configured limits.
+
+    A slot is held until the whole response has been sent, so streamed
+    artifact downloads count against the in-flight cap for as long as they
+    run. Shed requests get a 429 (rate limits) or 503 (in-flight cap) with
+    a Retry-After header and never reach the proxy handler.
+    """
+
+    def __init__(self, app, on_shed=None):
+        self.app = app
+        # Called with (method, path, request type, status code) for every shed request
+        self.on_shed = on_shed
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        # The dashboard and health checks keep working while MLflow traffic is shed
+        if scope["type"] != "http" or not is_enabled() or routes.is_proxy_endpoint(path):
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = routes.classify(path.lstrip('/'), method)
+        limit, wait = check_rate(client_id(scope), route.endpoint)
+        if limit is not None:
+            admission_stats[f"rejected_{limit}"] += 1
+            await self._shed(scope, send, route, 429, f"Rate limit exceeded ({limit.replace('_', ' ')})", wait)
+            return
+
+        rejected = await acquire()
+        if rejected is not None:
+            admission_stats[f"rejected_{rejected}"] += 1
+            await self._shed(scope, send, route, 503, "Too many requests in flight", 1.0)
+            return
+        admission_stats["admitted"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if config.ADMISSION_MAX_IN_FLIGHT > 0:
+                release()
+
+    async def _shed(self, scope, send, route, status_code, error, retry_after):
+        """Send a small JSON error with a Retry-After header."""
+        if self.on_shed is not None:
+            self.on_shed(scope["method"], scope["path"].lstrip('/'), route.name, status_code)
+        body = json.dumps({"error": error}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+def get_admission_stats() -> Dict[str, Any]:
+    """
+    Get admission control statistics for /api/stats.
+
+    Returns:
+        dict: Admitted, queued and rejected counts, and the current in-flight and queue sizes
+    """
+    return {
+        **admission_stats,
+        "in_flight": _in_flight,
+        "queue_depth": len(_waiters),
+        "max_in_flight": config.ADMISSION_MAX_IN_FLIGHT,
+        "tracked_clients": len(_client_buckets),
+        "endpoint_tokens": {
+            endpoint: round(bucket.tokens, 2) for endpoint, bucket in _endpoint_buckets.items()
+        }
+    }
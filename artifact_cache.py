@@ -0,0 +1,477 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from utils import logger
+
+# Artifact download endpoints whose responses are kept on disk
+CACHEABLE_ENDPOINTS = {"artifacts", "get-artifact", "model-versions/get-artifact"}
+
+# Upstream headers that describe the connection or the transfer rather than
+# the artifact; the cached file provides its own length and ETag
+UNCACHED_HEADERS = {"content-length", "etag", "date", "server", "set-cookie", "accept-ranges"}
+
+# Names of the files the cache creates: blobs/<first 2 digits>/<SHA-256> and tmp/<UUID>
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+_BLOB_PREFIX = re.compile(r"[0-9a-f]{2}")
+_TMP_NAME = re.compile(r"[0-9a-f]{32}")
+
+class ArtifactEntry:
+    """A cached artifact: its content hash, size, response headers and freshness."""
+
+    __slots__ = ("digest", "size", "headers", "stored", "validators")
+
+    def __init__(self, digest, size, headers, stored, validators):
+        self.digest = digest
+        self.size = size
+        self.headers = headers
+        # Wall-clock time the upstream last confirmed this version
+        self.stored = stored
+        # The upstream ETag and Last-Modified headers, for conditional revalidation
+        self.validators = validators
+
+    def to_record(self, key):
+        """Encode the entry as an index journal record."""
+        return {
+            "key": list(key), "digest": self.digest, "size": self.size,
+            "headers": self.headers, "stored": self.stored, "validators": self.validators
+        }
+
+    def conditional_headers(self):
+        """
+        Get the headers that ask the upstream whether this version is still current.
+
+        Returns:
+            dict: If-None-Match and/or If-Modified-Since, empty if the upstream sent no validators
+        """
+        headers = {}
+        if "etag" in self.validators:
+            headers["if-none-match"] = self.validators["etag"]
+        if "last-modified" in self.validators:
+            headers["if-modified-since"] = self.validators["last-modified"]
+        return headers
+
+    @property
+    def etag(self):
+        """Strong ETag derived from the content hash."""
+        return f'"{self.digest[:32]}"'
+
+class ArtifactFill:
+    """
+    An artifact being written to the cache while it streams to the client.
+
+    Every method does file I/O or hashing, so callers run them in a worker thread.
+    """
+
+    __slots__ = ("path", "file", "hasher", "size")
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        """Append a chunk to the temporary file."""
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def abort(self):
+        """Discard the partial file."""
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def finish(self, blob_path):
+        """
+        Move the complete file to its blob path, unless that blob already exists.
+
+        Args:
+            blob_path (callable): Maps a digest to its blob file
+
+        Returns:
+            str: The content digest
+        """
+        self.file.close()
+        digest = self.hasher.hexdigest()
+        path = blob_path(digest)
+        if os.path.exists(path):
+            os.unlink(self.path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.path, path)
+        return digest
+
+class ArtifactCache:
+    """
+    Content-addressed on-disk cache for artifact downloads.
+
+    Artifacts are stored once per SHA-256 digest under blobs/, so the same
+    model downloaded through different URLs takes the space of one copy.
+    An in-memory LRU index maps request keys to blobs and evicts the least
+    recently used artifacts once the cache holds more than max_bytes.
+
+    Every change to the index is appended to index.jsonl as it happens, so
+    a proxy that crashed keeps its cache; the journal is compacted on load,
+    on shutdown and when it grows well past the index. Entries older than
+    ttl seconds are revalidated with the upstream before they are served.
+    File I/O and hashing run in worker threads, and changes to the disk
+    are applied one at a time, in the order the index changed.
+    """
+
+    def __init__(self, directory, max_bytes, max_entry_bytes, ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[tuple, ArtifactEntry]" = OrderedDict()
+        # Number of keys referencing each blob
+        self._blobs: Dict[str, int] = {}
+        self._journal_path = os.path.join(directory, "index.jsonl")
+        self._journal_records = 0
+        # Serializes disk changes, so blob moves, deletes and journal records keep their order
+        self._lock = asyncio.Lock()
+        self._background: set = set()
+        self.counters = {
+            "hits": 0, "misses": 0, "not_modified": 0, "stale": 0, "revalidated": 0,
+            "fills": 0, "aborted_fills": 0, "evictions": 0
+        }
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "tmp"), exist_ok=True)
+
+    @staticmethod
+    def make_key(path, params, origin, authorization=None):
+        """
+        Build the cache key of a download.
+
+        Args:
+            path (str): The request path
+            params (list): Query parameters as (key, value) pairs
+            origin (str): The upstream origin the request is sent to
+            authorization (str, optional): The Authorization header, so users never share entries
+
+        Returns:
+            tuple: The cache key
+        """
+        return (path.strip('/'), tuple(sorted(params)), origin, authorization)
+
+    def is_cacheable(self, method, route):
+        """
+        Check whether a request is an artifact download the cache can answer.
+
+        Args:
+            method (str): The HTTP method
+            route (routes.Route): The classified MLflow route
+
+        Returns:
+            bool: True for GETs and HEADs of artifact downloads
+        """
+        return method in ("GET", "HEAD") and route.read_only and route.endpoint in CACHEABLE_ENDPOINTS
+
+    def blob_path(self, digest):
+        """Get the file holding a blob."""
+        return os.path.join(self.directory, "blobs", digest[:2], digest)
+
+    def get(self, key) -> Optional[ArtifactEntry]:
+        """
+        Look up a cached artifact.
+
+        Args:
+            key (tuple): The cache key
+
+        Returns:
+            ArtifactEntry: The entry, fresh or not (see is_fresh), or None on a miss
+        """
+        entry = self._entries.get(key)
+        if entry is not None and not os.path.exists(self.blob_path(entry.digest)):
+            # Removed from disk behind our back
+            self._spawn(self._apply(self._remove(key)))
+            entry = None
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        Check whether an entry can be served without asking the upstream.
+
+        Args:
+            entry (ArtifactEntry): A cached artifact
+
+        Returns:
+            bool: True if the upstream confirmed the version less than ttl seconds ago
+        """
+        if time.time() - entry.stored < self.ttl:
+            return True
+        self.counters["stale"] += 1
+        return False
+
+    async def refresh(self, key, entry):
+        """
+        Mark an entry as current after the upstream answered its revalidation with a 304.
+
+        Args:
+            key (tuple): The cache key
+            entry (ArtifactEntry): The revalidated entry
+        """
+        entry.stored = time.time()
+        self.counters["revalidated"] += 1
+        if self._entries.get(key) is entry:
+            await self._apply([entry.to_record(key)])
+
+    async def tee(self, stream, key, headers):
+        """
+        Pass a download through to the client while writing it to the cache.
+
+        The artifact is only added once the whole body has streamed; a
+        client that disconnects early or a body larger than
+        max_entry_bytes leaves nothing behind.
+
+        Args:
+            stream: The upstream body chunks
+            key (tuple): The cache key
+            headers (dict): The filtered upstream response headers
+
+        Yields:
+            bytes: The body chunks, unchanged
+        """
+        try:
+            fill = await asyncio.to_thread(ArtifactFill, os.path.join(self.directory, "tmp", uuid.uuid4().hex))
+        except OSError as e:
+            logger.warning(f"Artifact cache fill failed: {str(e)}")
+            fill = None
+        completed = False
+        try:
+            async for chunk in stream:
+                if fill is not None:
+                    try:
+                        await asyncio.to_thread(fill.write, chunk)
+                    except OSError as e:
+                        logger.warning(f"Artifact cache fill failed: {str(e)}")
+                        await asyncio.to_thread(fill.abort)
+                        fill = None
+                    if fill is not None and fill.size > self.max_entry_bytes:
+                        await asyncio.to_thread(fill.abort)
+                        fill = None
+                yield chunk
+            completed = True
+        finally:
+            if fill is not None:
+                if completed:
+                    await self._store(fill, key, headers)
+                else:
+                    # The client went away; the generator may be closing outside the request
+                    self._spawn(asyncio.to_thread(fill.abort))
+                    self.counters["aborted_fills"] += 1
+
+    async def _store(self, fill, key, headers):
+        """Move a complete fill into blobs/ and index it."""
+        async with self._lock:
+            try:
+                digest = await asyncio.to_thread(fill.finish, self.blob_path)
+            except OSError as e:
+                logger.warning(f"Artifact cache fill failed: {str(e)}")
+                await asyncio.to_thread(fill.abort)
+                return
+            changes = self._remove(key) if key in self._entries else []
+            # The upstream's own validators are kept to revalidate with; clients get ours
+            validators = {
+                name.lower(): value for name, value in headers.items()
+                if name.lower() in ("etag", "last-modified")
+            }
+            entry = ArtifactEntry(digest, fill.size, {
+                name: value for name, value in headers.items() if name.lower() not in UNCACHED_HEADERS
+            }, time.time(), validators)
+            self._add(key, entry)
+            changes.append(entry.to_record(key))
+            self.counters["fills"] += 1
+            changes.extend(self._evict())
+            await self._write_changes(changes)
+
+    def _add(self, key, entry):
+        """Index an entry whose blob is on disk."""
+        self._entries[key] = entry
+        if entry.digest not in self._blobs:
+            self._blobs[entry.digest] = 0
+            self.size += entry.size
+        self._blobs[entry.digest] += 1
+
+    def _remove(self, key):
+        """
+        Drop an entry from the index.
+
+        Returns:
+            list: The disk changes to apply: a journal record and, once no
+                other entry uses the blob, the blob's digest
+        """
+        entry = self._entries.pop(key)
+        changes = [{"key": list(key), "deleted": True}]
+        self._blobs[entry.digest] -= 1
+        if self._blobs[entry.digest] == 0:
+            del self._blobs[entry.digest]
+            self.size -= entry.size
+            changes.append(entry.digest)
+        return changes
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes, returning the disk changes."""
+        changes = []
+        while self._entries and self.size > self.max_bytes:
+            changes.extend(self._remove(next(iter(self._entries))))
+            self.counters["evictions"] += 1
+        return changes
+
+    async def invalidate(self, path):
+        """
+        Drop the cached downloads of an artifact path after it was uploaded or deleted.
+
+        Args:
+            path (str): The request path of the write
+        """
+        path = path.strip('/')
+        changes = []
+        for key in [key for key in self._entries if key[0] == path]:
+            changes.extend(self._remove(key))
+        if changes:
+            await self._apply(changes)
+
+    def _spawn(self, coroutine):
+        """Apply disk changes in the background, for callers that cannot wait."""
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _apply(self, changes):
+        """Apply disk changes after those already waiting."""
+        async with self._lock:
+            await self._write_changes(changes)
+
+    async def _write_changes(self, changes):
+        """
+        Append journal records and delete unused blobs in a worker thread. Called with the lock held.
+
+        Args:
+            changes (list): Journal records (dicts) and blob digests to delete
+        """
+        records = [change for change in changes if isinstance(change, dict)]
+        # A blob dropped earlier may have been stored again since
+        digests = [change for change in changes if isinstance(change, str) and change not in self._blobs]
+        self._journal_records += len(records)
+        snapshot = None
+        if self._journal_records > 2 * len(self._entries) + 1000:
+            snapshot = self._snapshot()
+            self._journal_records = len(snapshot)
+        try:
+            await asyncio.to_thread(self._write_disk, records, digests, snapshot)
+        except OSError as e:
+            logger.warning(f"Artifact cache index update failed: {str(e)}")
+
+    def _snapshot(self):
+        """Encode every entry as a journal record, least recently used first."""
+        return [entry.to_record(key) for key, entry in self._entries.items()]
+
+    def _write_disk(self, records, digests, snapshot=None):
+        """Delete blobs and write journal records, or the whole journal if a snapshot is given. Runs in a worker thread."""
+        for digest in digests:
+            try:
+                os.unlink(self.blob_path(digest))
+            except OSError:
+                pass
+        if snapshot is not None:
+            temporary = f"{self._journal_path}.tmp"
+            with open(temporary, "w", encoding="utf-8") as journal:
+                journal.write("".join(json.dumps(record) + "\n" for record in snapshot))
+            os.replace(temporary, self._journal_path)
+        elif records:
+            with open(self._journal_path, "a", encoding="utf-8") as journal:
+                journal.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def load(self):
+        """
+        Rebuild the index from the journal, dropping entries without a blob and orphaned files.
+
+        Runs before the cache is used, so callers run it in a worker thread.
+        """
+        entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        try:
+            with open(self._journal_path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A record cut short by a crash
+                        continue
+                    raw = record["key"]
+                    key = (raw[0], tuple(tuple(param) for param in raw[1]), raw[2], raw[3])
+                    entries.pop(key, None)
+                    if not record.get("deleted"):
+                        entries[key] = record
+        except OSError:
+            pass
+        for key, record in entries.items():
+            if os.path.exists(self.blob_path(record["digest"])):
+                self._add(key, ArtifactEntry(
+                    record["digest"], record["size"], record["headers"],
+                    record.get("stored", 0.0), record.get("validators", {})
+                ))
+        self._sweep()
+        digests = [change for change in self._evict() if isinstance(change, str)]
+        snapshot = self._snapshot()
+        self._journal_records = len(snapshot)
+        self._write_disk([], digests, snapshot)
+
+    def _sweep(self):
+        """
+        Delete fills left by a crash and blobs no entry refers to.
+
+        Only names the cache itself creates are touched, so nothing else
+        stored under the cache directory is ever deleted.
+        """
+        tmp = os.path.join(self.directory, "tmp")
+        for name in os.listdir(tmp):
+            if _TMP_NAME.fullmatch(name):
+                os.unlink(os.path.join(tmp, name))
+        blobs = os.path.join(self.directory, "blobs")
+        for prefix in os.listdir(blobs):
+            directory = os.path.join(blobs, prefix)
+            if not _BLOB_PREFIX.fullmatch(prefix) or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if _DIGEST.fullmatch(name) and name.startswith(prefix) and name not in self._blobs:
+                    os.unlink(os.path.join(directory, name))
+
+    async def save(self):
+        """Rewrite the journal in LRU order, so the next load() restores the access order too."""
+        if self._background:
+            await asyncio.wait(list(self._background))
+        async with self._lock:
+            snapshot = self._snapshot()
+            self._journal_records = len(snapshot)
+            await asyncio.to_thread(self._write_disk, [], [], snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get cache statistics for /api/stats.
+
+        Returns:
+            dict: Hit/miss/fill/eviction counters, entry and blob counts and size in bytes
+        """
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "blobs": len(self._blobs),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes
+        }
@@ -4,6 +4,7 @@ from utils import logger
 
 # This file exposes the ASGI application for Gunicorn
 # Use with: gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+# or, for HTTP/2: hypercorn --bind localhost:6150 asgi:application
 
 # Log startup information
 logger.info(f"MLflow Proxy Server configured on {config.FASTAPI_HOST}:{config.FASTAPI_PORT}")
@@ -0,0 +1,198 @@
+import asyncio
+import random
+import time
+from typing import Dict, Any, List, Optional
+import config
+import upstream
+from utils import get_target_url, logger
+
+class Upstream:
+    """One MLflow tracking server the proxy can send requests to."""
+
+    __slots__ = (
+        "url", "origin", "primary", "healthy", "ewma", "consecutive_failures",
+        "ejected_until", "ejections", "requests", "failures"
+    )
+
+    def __init__(self, url, primary):
+        self.url = url
+        self.origin = upstream.get_origin(url)
+        self.primary = primary
+        # Result of the last active health probe
+        self.healthy = True
+        # Moving average of the time to response headers, in seconds
+        self.ewma = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def outstanding(self):
+        """The number of requests to this upstream still in flight."""
+        return upstream.get_active(self.url)
+
+    def is_available(self, now):
+        """Check whether the upstream passes its health probe and is not ejected."""
+        return self.healthy and now >= self.ejected_until
+
+_primary: Optional[Upstream] = None
+# Upstreams that serve read-only calls
+_readers: List[Upstream] = []
+_prober: Optional[asyncio.Task] = None
+
+balancer_stats = {
+    "panics": 0,
+    "ejections": 0
+}
+
+def is_enabled():
+    """
+    Check whether requests are spread over several upstreams.
+
+    Returns:
+        bool: True if MLFLOW_REPLICA_URLS lists at least one replica
+    """
+    return bool(config.MLFLOW_REPLICA_URLS)
+
+def _score(candidate):
+    """Rank an upstream under LOAD_BALANCING_POLICY; lower is better."""
+    if config.LOAD_BALANCING_POLICY == "ewma":
+        # Requests queued behind the ones in flight each wait about one average response time
+        return candidate.ewma * (candidate.outstanding + 1)
+    return candidate.outstanding
+
+def choose(read_only) -> Upstream:
+    """
+    Pick the upstream to send a request to.
+
+    Writes always go to the primary. Reads go to the best available
+    reader; when every reader is unhealthy or ejected, they fall back to
+    the primary and then to any reader, since a possibly failing upstream
+    is better than none.
+
+    Args:
+        read_only (bool): Whether the MLflow route only reads
+
+    Returns:
+        Upstream: The chosen upstream
+    """
+    if not read_only:
+        return _primary
+    now = time.monotonic()
+    candidates = [candidate for candidate in _readers if candidate.is_available(now)]
+    if not candidates:
+        balancer_stats["panics"] += 1
+        candidates = [_primary] if _primary.is_available(now) else _readers
+    if len(candidates) == 1:
+        return candidates[0]
+    # Ties are broken at random so idle upstreams share the load evenly
+    scored = [(_score(candidate), random.random(), candidate) for candidate in candidates]
+    return min(scored, key=lambda item: item[:2])[2]
+
+def find(url):
+    """
+    Get the upstream a URL points at.
+
+    Args:
+        url (str): A URL on one of the upstreams
+
+    Returns:
+        Upstream: The upstream with the URL's origin, or None if it is not one of them
+    """
+    origin = upstream.get_origin(url)
+    for candidate in (_primary, *_readers):
+        if candidate is not None and candidate.origin == origin:
+            return candidate
+    return None
+
+def observe(target, duration, status_code=None):
+    """
+    Record the outcome of a request for latency tracking and outlier ejection.
+
+    Args:
+        target (Upstream): The upstream the request was sent to
+        duration (float): Seconds until the response headers arrived or the request failed
+        status_code (int, optional): The response status, None if no response arrived
+    """
+    target.requests += 1
+    if status_code is not None and status_code < 500:
+        alpha = config.LOAD_BALANCING_EWMA_ALPHA
+        target.ewma = duration if target.ewma == 0.0 else alpha * duration + (1 - alpha) * target.ewma
+        target.consecutive_failures = 0
+        return
+    target.failures += 1
+    target.consecutive_failures += 1
+    if target.consecutive_failures >= config.OUTLIER_CONSECUTIVE_FAILURES:
+        target.ejections += 1
+        target.consecutive_failures = 0
+        ejection_time = min(config.OUTLIER_EJECTION_TIME * target.ejections, config.OUTLIER_MAX_EJECTION_TIME)
+        target.ejected_until = time.monotonic() + ejection_time
+        balancer_stats["ejections"] += 1
+        logger.warning(f"Ejected upstream {target.url} for {ejection_time:.0f}s after repeated failures")
+
+async def _probe(target):
+    """Run one health probe against an upstream."""
+    url = get_target_url(config.HEALTH_CHECK_PATH, target.url)
+    try:
+        response = await asyncio.wait_for(upstream.send("GET", url), config.HEALTH_CHECK_TIMEOUT)
+        await upstream.read_response(response)
+        healthy = response.status_code == 200
+    except Exception:
+        healthy = False
+    if healthy != target.healthy:
+        logger.warning(f"Upstream {target.url} is {'healthy' if healthy else 'unhealthy'}")
+    target.healthy = healthy
+
+async def _probe_periodically():
+    """Probe every upstream each HEALTH_CHECK_INTERVAL seconds until cancelled."""
+    targets = list({target.url: target for target in [_primary, *_readers]}.values())
+    while True:
+        await asyncio.gather(*(_probe(target) for target in targets))
+        await asyncio.sleep(config.HEALTH_CHECK_INTERVAL)
+
+async def startup():
+    """Build the upstream set from config.py and start the health prober."""
+    global _primary, _readers, _prober
+    _primary = Upstream(config.MLFLOW_SERVER_URL, primary=True)
+    _readers = [Upstream(url, primary=False) for url in config.MLFLOW_REPLICA_URLS]
+    if config.READ_FROM_PRIMARY:
+        _readers.insert(0, _primary)
+    if is_enabled():
+        _prober = asyncio.get_running_loop().create_task(_probe_periodically())
+
+async def shutdown():
+    """Stop the health prober."""
+    global _prober
+    if _prober is not None:
+        _prober.cancel()
+        _prober = None
+
+def get_balancer_stats() -> Dict[str, Any]:
+    """
+    Get load balancing statistics for /api/stats.
+
+    Returns:
+        dict: The policy, panic and ejection counts, and the state of each upstream
+    """
+    now = time.monotonic()
+    targets = list({target.url: target for target in [_primary, *_readers]}.values())
+    return {
+        **balancer_stats,
+        "policy": config.LOAD_BALANCING_POLICY,
+        "upstreams": {
+            target.url: {
+                "primary": target.primary,
+                "reads": target in _readers,
+                "healthy": target.healthy,
+                "ejected_for": round(max(target.ejected_until - now, 0.0), 1),
+                "outstanding": target.outstanding,
+                "ewma_ms": round(target.ewma * 1000, 2),
+                "requests": target.requests,
+                "failures": target.failures,
+                "ejections": target.ejections
+            }
+            for target in targets
+        }
+    }
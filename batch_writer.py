@@ -0,0 +1,117 @@
+import asyncio
+from typing import Optional
+from utils import logger
+
+class BatchWriter:
+    """
+    A bounded record queue written in batches by a background task.
+
+    Submitting never blocks: when the queue is full a record is dropped
+    and counted. The writer takes whatever is queued, up to `batch_size`
+    records, and hands it to `write_batch` in a worker thread, so the
+    event loop never waits on the disk. Stopping lets a batch that is
+    being written finish, then writes everything still queued.
+    """
+
+    def __init__(self, name, write_batch, stats, queue_size, batch_size,
+                 drop_oldest=False, queued_stat="queued_records"):
+        # What the records are, for error messages
+        self.name = name
+        # Called with a list of records in a worker thread
+        self.write_batch = write_batch
+        # Counters updated: queued_stat, written_records, dropped_records and batches if present
+        self.stats = stats
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        # When the queue is full, drop the oldest queued record rather than the new one
+        self.drop_oldest = drop_oldest
+        self.queued_stat = queued_stat
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Set while a batch is in a worker thread, which cancelling would not stop
+        self._writing = False
+        self._stopping = False
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        """The record queue, created on first use so records can be submitted before start()."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        return self._queue
+
+    def submit(self, record):
+        """
+        Queue a record for the writer, dropping one if the queue is full.
+
+        Args:
+            record: The record to write
+        """
+        queue = self.queue
+        if queue.full():
+            self.stats["dropped_records"] += 1
+            if not self.drop_oldest:
+                return
+            queue.get_nowait()
+        queue.put_nowait(record)
+        self.stats[self.queued_stat] += 1
+
+    def _drain(self, batch):
+        """Add already queued records to a batch, up to batch_size."""
+        queue = self.queue
+        while len(batch) < self.batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+    async def _write(self, batch):
+        """Write one batch in a worker thread and count the outcome."""
+        try:
+            await asyncio.to_thread(self.write_batch, batch)
+        except Exception as e:
+            self.stats["dropped_records"] += len(batch)
+            logger.error(f"Failed to write {self.name} batch: {str(e)}")
+            return
+        self.stats["written_records"] += len(batch)
+        if "batches" in self.stats:
+            self.stats["batches"] += 1
+
+    async def _run(self):
+        """Write queued records in batches until stopped."""
+        queue = self.queue
+        while not self._stopping:
+            batch = self._drain([await queue.get()])
+            self._writing = True
+            try:
+                await self._write(batch)
+            finally:
+                self._writing = False
+
+    def start(self):
+        """Start the background writer."""
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer once its current batch is written, then write everything still queued."""
+        task = self._task
+        if task is None:
+            return
+        self._task = None
+        self._stopping = True
+        # Waiting on the queue is safe to interrupt; a write in progress is not
+        if not self._writing:
+            task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        while not self.queue.empty():
+            await self._write(self._drain([]))
+
+    def qsize(self) -> int:
+        """
+        Get the number of records waiting to be written.
+
+        Returns:
+            int: The queue depth
+        """
+        return self.queue.qsize()
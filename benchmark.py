@@ -0,0 +1,1054 @@
+"""
+Load benchmark for MLflow Proxy.
+
+Starts a local stub MLflow server and the proxy in subprocesses, then drives
+the proxy with concurrent tracking calls and reports throughput and latency.
+No real MLflow server is needed.
+
+Usage:
+    python benchmark.py throughput --concurrency 10 --duration 10
+    python benchmark.py streaming --size-mb 2048 --max-rss-mb 256
+    python benchmark.py stats --iterations 200000
+    python benchmark.py routes --iterations 200000
+    python benchmark.py coalesce --clients 200
+    python benchmark.py batching --concurrency 10 --duration 10
+    python benchmark.py spool --records 20000
+    python benchmark.py compression --points 5000
+    python benchmark.py http2 --concurrency 200 --duration 10
+    python benchmark.py replay --capture capture.jsonl --speed 2
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import functools
+import base64
+import random
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+
+STUB_PORT = 5099
+PROXY_PORT = 6199
+
+# Delay applied by the stub to slow endpoints (seconds)
+STUB_SLOW_DELAY = float(os.environ.get("BENCH_STUB_SLOW_DELAY", 0.2))
+SLOW_PATH = "api/2.0/mlflow/runs/search"
+LATEST_VERSIONS_PATH = "api/2.0/mlflow/registered-models/get-latest-versions"
+FAST_PATH = "api/2.0/mlflow/runs/log-metric"
+ARTIFACT_PATH = "api/2.0/mlflow-artifacts/artifacts/bench/model.bin"
+HISTORY_PATH = "api/2.0/mlflow/metrics/get-history"
+ARTIFACT_CHUNK = b"\0" * 1048576
+# Filler for replayed responses of a recorded size
+REPLAY_CHUNK = b" " * 1048576
+# Path the stub answers with the number of requests it has served
+STUB_HITS_PATH = "/__stub__/hits"
+
+stub_hits = 0
+
+async def stub_app(scope, receive, send):
+    """
+    Minimal ASGI app standing in for an MLflow tracking server.
+
+    Every request gets a small JSON body back. Requests to runs/search
+    and get-latest-versions are delayed by STUB_SLOW_DELAY to simulate a
+    slow query, and GETs of mlflow-artifacts stream back ?size= bytes
+    after ?delay= seconds. metrics/get-history returns ?points= metric
+    values as JSON. Replayed requests carry X-Stub-Status, X-Stub-Bytes and
+    X-Stub-Delay headers and get a response of that status and size after
+    that delay. STUB_HITS_PATH reports how many requests the stub has
+    served.
+    """
+    global stub_hits
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == STUB_HITS_PATH:
+        body = json.dumps({"hits": stub_hits}).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+        return
+    stub_hits += 1
+
+    received = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        received += len(message.get("body", b""))
+        more_body = message.get("more_body", False)
+
+    headers = dict(scope["headers"])
+    if b"x-stub-status" in headers:
+        await asyncio.sleep(float(headers.get(b"x-stub-delay", b"0")))
+        remaining = int(headers.get(b"x-stub-bytes", b"0"))
+        await send({
+            "type": "http.response.start",
+            "status": int(headers[b"x-stub-status"]),
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(remaining).encode())
+            ]
+        })
+        while True:
+            chunk = REPLAY_CHUNK[:remaining]
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining <= 0:
+                return
+
+    if "mlflow-artifacts" in scope["path"] and scope["method"] == "GET":
+        query = dict(part.split("=", 1) for part in scope["query_string"].decode().split("&") if "=" in part)
+        remaining = int(query.get("size", 0))
+        await asyncio.sleep(float(query.get("delay", 0)))
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/octet-stream"),
+                (b"content-length", str(remaining).encode())
+            ]
+        })
+        while remaining > 0:
+            chunk = ARTIFACT_CHUNK[:remaining]
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        return
+
+    if scope["path"].endswith("metrics/get-history"):
+        query = dict(part.split("=", 1) for part in scope["query_string"].decode().split("&") if "=" in part)
+        body = metric_history(int(query.get("points", 1000)))
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    if scope["path"].endswith(("runs/search", "get-latest-versions")):
+        await asyncio.sleep(STUB_SLOW_DELAY)
+
+    body = json.dumps({"runs": [], "received_bytes": received}).encode() if received > 1024 else b'{"runs": []}'
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode())
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+@functools.lru_cache(maxsize=8)
+def metric_history(points):
+    """Build a metrics/get-history response body with the given number of points."""
+    return json.dumps({"metrics": [
+        {"key": "loss", "value": 1.0 / (step + 1), "timestamp": 1700000000000 + step * 1000, "step": step}
+        for step in range(points)
+    ]}).encode()
+
+def start_server(app_path, port, env=None, server="uvicorn"):
+    """
+    Start a server for the given app in a subprocess.
+
+    Args:
+        app_path (str): The app in module:attribute form
+        port (int): The port to listen on
+        env (dict, optional): Extra environment variables
+        server (str, optional): "uvicorn", or "hypercorn" to also accept HTTP/2 (h2c)
+
+    Returns:
+        subprocess.Popen: The server process
+    """
+    process_env = dict(os.environ)
+    process_env.update(env or {})
+    if server == "hypercorn":
+        command = [sys.executable, "-m", "hypercorn", app_path,
+                   "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", app_path,
+                   "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(
+        command,
+        env=process_env,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Server {app_path} did not start on port {port}")
+
+def get_stub_hits():
+    """Ask the stub how many requests it has served."""
+    return httpx.get(f"http://127.0.0.1:{STUB_PORT}{STUB_HITS_PATH}").json()["hits"]
+
+def cpu_seconds(pid):
+    """
+    Read the CPU time a process has used from /proc.
+
+    Args:
+        pid (int): The process ID
+
+    Returns:
+        float: User plus system CPU time in seconds
+    """
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def percentile(values, pct):
+    """Return the pct-th percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run_load(base_url, concurrency, duration, slow_every, http2=False):
+    """
+    Drive the proxy with concurrent log-metric calls mixed with slow searches.
+
+    Args:
+        base_url (str): The proxy URL
+        concurrency (int): Number of concurrent workers
+        duration (float): How long to run, in seconds
+        slow_every (int): Send a runs/search call every N requests per worker (0 disables)
+        http2 (bool, optional): Multiplex every worker over one HTTP/2 (h2c) connection
+
+    Returns:
+        dict: Throughput and latency results
+    """
+    latencies = []
+    errors = 0
+    payload = json.dumps({"run_id": "bench", "key": "loss", "value": 0.5, "timestamp": 0, "step": 0})
+    connections = 1 if http2 else concurrency
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    # Route explicitly to the stub the same way test_client.py does
+    headers = {"X-Original-Host": f"http://127.0.0.1:{STUB_PORT}"}
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, headers=headers, timeout=30, http1=not http2, http2=http2
+    ) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            count = 0
+            while time.perf_counter() < deadline:
+                count += 1
+                try:
+                    if slow_every and count % slow_every == 0:
+                        await client.post(f"/{SLOW_PATH}", content=b"{}")
+                        continue
+                    start = time.perf_counter()
+                    response = await client.post(
+                        f"/{FAST_PATH}", content=payload,
+                        headers={"content-type": "application/json"}
+                    )
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2)
+    }
+
+def throughput_benchmark(args):
+    """Run the throughput benchmark against a stub MLflow server."""
+    stub = start_server("benchmark:stub_app", STUB_PORT)
+    proxy = start_server("mlflow_proxy:app", PROXY_PORT, env={
+        "MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}",
+        "LOG_LEVEL": "WARNING"
+    })
+    try:
+        results = asyncio.run(run_load(
+            f"http://127.0.0.1:{PROXY_PORT}",
+            args.concurrency,
+            args.duration,
+            args.slow_every
+        ))
+    finally:
+        proxy.terminate()
+        stub.terminate()
+        proxy.wait()
+        stub.wait()
+
+    print(json.dumps(results, indent=2))
+
+def peak_rss_mb(pid):
+    """
+    Read the peak resident set size of a process from /proc.
+
+    Args:
+        pid (int): The process ID
+
+    Returns:
+        float: Peak RSS in MiB
+    """
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+async def run_streaming(base_url, size):
+    """
+    Upload and download one artifact of the given size through the proxy.
+
+    Args:
+        base_url (str): The proxy URL
+        size (int): Artifact size in bytes
+
+    Returns:
+        dict: Upload and download throughput in MiB/s
+    """
+    headers = {"X-Original-Host": f"http://127.0.0.1:{STUB_PORT}"}
+
+    async def upload_body():
+        remaining = size
+        while remaining > 0:
+            chunk = ARTIFACT_CHUNK[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=300) as client:
+        start = time.perf_counter()
+        response = await client.put(
+            f"/{ARTIFACT_PATH}", content=upload_body(),
+            headers={"content-type": "application/octet-stream", "content-length": str(size)}
+        )
+        upload_time = time.perf_counter() - start
+        if response.json().get("received_bytes") != size:
+            raise RuntimeError(f"Upload was truncated: {response.text}")
+
+        start = time.perf_counter()
+        downloaded = 0
+        async with client.stream("GET", f"/{ARTIFACT_PATH}", params={"size": size}) as response:
+            async for chunk in response.aiter_raw():
+                downloaded += len(chunk)
+        download_time = time.perf_counter() - start
+        if downloaded != size:
+            raise RuntimeError(f"Download was truncated: {downloaded} of {size} bytes")
+
+    size_mb = size / 1048576
+    return {
+        "size_mb": round(size_mb, 1),
+        "upload_mb_per_second": round(size_mb / upload_time, 1),
+        "download_mb_per_second": round(size_mb / download_time, 1)
+    }
+
+def streaming_benchmark(args):
+    """Proxy a large artifact both ways and check the proxy's peak RSS."""
+    stub = start_server("benchmark:stub_app", STUB_PORT)
+    proxy = start_server("mlflow_proxy:app", PROXY_PORT, env={
+        "MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}",
+        "LOG_LEVEL": "WARNING",
+        "STREAM_CHUNK_SIZE": str(args.chunk_size)
+    })
+    try:
+        results = asyncio.run(run_streaming(
+            f"http://127.0.0.1:{PROXY_PORT}",
+            args.size_mb * 1048576
+        ))
+        results["proxy_peak_rss_mb"] = round(peak_rss_mb(proxy.pid), 1)
+    finally:
+        proxy.terminate()
+        stub.terminate()
+        proxy.wait()
+        stub.wait()
+
+    print(json.dumps(results, indent=2))
+    if results["proxy_peak_rss_mb"] > args.max_rss_mb:
+        sys.exit(f"Proxy peak RSS {results['proxy_peak_rss_mb']} MiB exceeds {args.max_rss_mb} MiB")
+
+def legacy_stats_update(stats, method, path, request_type, status_code, duration):
+    """The dict-based stats update the proxy used before ProxyStats, for comparison."""
+    stats["requests"] += 1
+    stats["request_types"][request_type] = stats["request_types"].get(request_type, 0) + 1
+    stats["total_request_time"] += duration
+    status = str(status_code)
+    stats["status_codes"][status] = stats["status_codes"].get(status, 0) + 1
+    stats["last_requests"].insert(0, {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "method": method,
+        "path": path,
+        "type": request_type,
+        "status_code": status_code,
+        "duration": round(duration, 3)
+    })
+    stats["last_requests"] = stats["last_requests"][:100]
+
+def stats_benchmark(args):
+    """Measure the per-request cost of updating proxy statistics."""
+    from stats import ProxyStats
+
+    proxy_stats = ProxyStats()
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        proxy_stats.record_request("MLflow Tracking: Log Metric")
+        proxy_stats.record_response("POST", FAST_PATH, "MLflow Tracking: Log Metric", 200, 0.0123)
+    proxy_stats_ns = (time.perf_counter() - start) / args.iterations * 1e9
+
+    legacy = {"requests": 0, "total_request_time": 0, "request_types": {}, "status_codes": {}, "last_requests": []}
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        legacy_stats_update(legacy, "POST", FAST_PATH, "MLflow Tracking: Log Metric", 200, 0.0123)
+    legacy_ns = (time.perf_counter() - start) / args.iterations * 1e9
+
+    print(json.dumps({
+        "iterations": args.iterations,
+        "proxy_stats_ns_per_request": round(proxy_stats_ns),
+        "legacy_dict_ns_per_request": round(legacy_ns)
+    }, indent=2))
+
+def legacy_request_type(path, method):
+    """The substring-chain classifier the proxy used before routes.py, for comparison."""
+    # Tracking API endpoints
+    if '/api/2.0/mlflow' in path:
+        if '/runs/' in path:
+            if method == 'POST':
+                return "MLflow Tracking: Create Run"
+            elif method == 'GET':
+                return "MLflow Tracking: Get Run"
+            elif method == 'PATCH':
+                return "MLflow Tracking: Update Run"
+        elif '/metrics/' in path:
+            return "MLflow Tracking: Log Metrics"
+        elif '/params/' in path:
+            return "MLflow Tracking: Log Parameters"
+        elif '/tags/' in path:
+            return "MLflow Tracking: Log Tags"
+        elif '/artifacts/' in path:
+            if method == 'POST':
+                return "MLflow Tracking: Log Artifact"
+            else:
+                return "MLflow Tracking: Get Artifact"
+        elif '/experiments/' in path:
+            if method == 'POST':
+                return "MLflow Tracking: Create Experiment"
+            elif method == 'GET':
+                return "MLflow Tracking: Get Experiment"
+            elif method == 'PATCH':
+                return "MLflow Tracking: Update Experiment"
+        return "MLflow Tracking API"
+    
+    # Registry API endpoints
+    elif '/api/2.0/preview/mlflow/registered-models' in path:
+        if method == 'POST':
+            return "MLflow Registry: Create Model"
+        elif method == 'GET':
+            return "MLflow Registry: Get Model"
+        return "MLflow Registry API"
+    elif '/api/2.0/preview/mlflow/model-versions' in path:
+        return "MLflow Registry: Model Versions"
+    
+    # Fallback
+    return f"MLflow API: {method} {path}"
+
+def routes_benchmark(args):
+    """Time route classification against the legacy classifier."""
+    import routes
+
+    paths = [
+        ("POST", f"api/2.0/mlflow/{endpoint}")
+        for method, endpoint, name, read_only in routes.MLFLOW_ROUTES
+    ]
+
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        method, path = paths[i % len(paths)]
+        routes.classify(path, method)
+    memoized_ns = (time.perf_counter() - start) / args.iterations * 1e9
+
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        method, path = paths[i % len(paths)]
+        routes.classify.__wrapped__(path, method)
+    uncached_ns = (time.perf_counter() - start) / args.iterations * 1e9
+
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        method, path = paths[i % len(paths)]
+        legacy_request_type(path, method)
+    legacy_ns = (time.perf_counter() - start) / args.iterations * 1e9
+
+    print(json.dumps({
+        "iterations": args.iterations,
+        "memoized_ns_per_call": round(memoized_ns),
+        "uncached_ns_per_call": round(uncached_ns),
+        "legacy_ns_per_call": round(legacy_ns)
+    }, indent=2))
+
+async def run_coalesce(base_url, clients, artifact_size):
+    """
+    Start many clients at once, all fetching the same model the way scoring pods do.
+
+    Args:
+        base_url (str): The proxy URL
+        clients (int): Number of concurrent clients
+        artifact_size (int): Size of the model artifact in bytes
+
+    Returns:
+        dict: Upstream requests made and client latencies
+    """
+    stub_url = f"http://127.0.0.1:{STUB_PORT}"
+    headers = {"X-Original-Host": stub_url}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=120) as client:
+        hits_before = get_stub_hits()
+        latencies = []
+        errors = 0
+
+        async def scoring_pod():
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"/{LATEST_VERSIONS_PATH}", params={"name": "model"})
+                downloaded = 0
+                async with client.stream(
+                    "GET", f"/{ARTIFACT_PATH}", params={"size": artifact_size, "delay": STUB_SLOW_DELAY}
+                ) as artifact:
+                    async for chunk in artifact.aiter_raw():
+                        downloaded += len(chunk)
+            except httpx.HTTPError:
+                errors += 1
+                return
+            if response.status_code != 200 or artifact.status_code != 200 or downloaded != artifact_size:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(scoring_pod() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+        hits = get_stub_hits() - hits_before
+
+    return {
+        "client_requests": clients * 2,
+        "upstream_requests": hits,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1)
+    }
+
+def coalesce_benchmark(args):
+    """Compare upstream load with and without single-flight request coalescing."""
+    results = {}
+    for enabled in ("false", "true"):
+        stub = start_server("benchmark:stub_app", STUB_PORT)
+        proxy = start_server("mlflow_proxy:app", PROXY_PORT, env={
+            "MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}",
+            "LOG_LEVEL": "WARNING",
+            "SINGLE_FLIGHT_ENABLED": enabled
+        })
+        try:
+            results["single_flight" if enabled == "true" else "direct"] = asyncio.run(run_coalesce(
+                f"http://127.0.0.1:{PROXY_PORT}", args.clients, args.artifact_mb * 1048576
+            ))
+            results["single_flight" if enabled == "true" else "direct"]["proxy_peak_rss_mb"] = round(
+                peak_rss_mb(proxy.pid), 1
+            )
+        finally:
+            proxy.terminate()
+            stub.terminate()
+            proxy.wait()
+            stub.wait()
+
+    print(json.dumps(results, indent=2))
+
+def batching_benchmark(args):
+    """Compare upstream requests and client latency with and without write batching."""
+    results = {}
+    for enabled in ("false", "true"):
+        stub = start_server("benchmark:stub_app", STUB_PORT)
+        proxy = start_server("mlflow_proxy:app", PROXY_PORT, env={
+            "MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}",
+            "LOG_LEVEL": "WARNING",
+            "WRITE_BATCHING_ENABLED": enabled
+        })
+        try:
+            result = asyncio.run(run_load(
+                f"http://127.0.0.1:{PROXY_PORT}", args.concurrency, args.duration, 0
+            ))
+            # Stopping the proxy flushes whatever is still batched
+            proxy.terminate()
+            proxy.wait()
+            result["upstream_requests"] = get_stub_hits()
+            results["batched" if enabled == "true" else "direct"] = result
+        finally:
+            proxy.terminate()
+            stub.terminate()
+            proxy.wait()
+            stub.wait()
+
+    print(json.dumps(results, indent=2))
+
+async def spool_writes(base_url, records, concurrency):
+    """
+    Send log-metric calls for a few runs while the MLflow server is down.
+
+    Args:
+        base_url (str): The proxy URL
+        records (int): Number of calls to send
+        concurrency (int): Number of concurrent clients
+
+    Returns:
+        int: The number of calls the proxy acknowledged as spooled
+    """
+    headers = {"X-Original-Host": f"http://127.0.0.1:{STUB_PORT}"}
+    spooled = 0
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=30) as client:
+        async def worker(offset):
+            nonlocal spooled
+            for step in range(offset, records, concurrency):
+                payload = {"run_id": f"run-{step % 4}", "key": "loss", "value": 0.5, "timestamp": 0, "step": step}
+                response = await client.post(f"/{FAST_PATH}", json=payload)
+                if response.headers.get("x-mlflow-proxy-deferred") == "spooled":
+                    spooled += 1
+
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    return spooled
+
+def spool_benchmark(args):
+    """Spool writes while the MLflow server is down, then time their replay."""
+    spool_file = os.path.join(tempfile.mkdtemp(), "spool.bin")
+    proxy = start_server("mlflow_proxy:app", PROXY_PORT, env={
+        "MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}",
+        "LOG_LEVEL": "ERROR",
+        "SPOOL_FILE": spool_file,
+        "SPOOL_FSYNC": "true" if args.fsync else "false"
+    })
+    stub = None
+    try:
+        start = time.perf_counter()
+        spooled = asyncio.run(spool_writes(f"http://127.0.0.1:{PROXY_PORT}", args.records, args.concurrency))
+        spool_elapsed = time.perf_counter() - start
+
+        stub = start_server("benchmark:stub_app", STUB_PORT)
+        start = time.perf_counter()
+        while True:
+            spool_stats = httpx.get(f"http://127.0.0.1:{PROXY_PORT}/api/stats").json()["spool"]
+            if spool_stats["backlog_records"] == 0 or time.perf_counter() - start > 300:
+                break
+            time.sleep(0.05)
+        replay_elapsed = time.perf_counter() - start
+        hits = get_stub_hits()
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+
+    print(json.dumps({
+        "records": args.records,
+        "spooled": spooled,
+        "spool_records_per_second": round(spooled / spool_elapsed, 1),
+        "replayed": spool_stats["replayed_records"],
+        "upstream_requests": hits,
+        "backlog_left": spool_stats["backlog_records"],
+        # Includes up to SPOOL_RETRY_INTERVAL before the proxy notices the server is back
+        "replay_seconds": round(replay_elapsed, 2),
+        "replay_records_per_second": spool_stats["replay_records_per_second"],
+        "compactions": spool_stats["compactions"]
+    }, indent=2))
+
+async def fetch_history(base_url, accept_encoding, points, requests, concurrency):
+    """
+    Fetch a large metric history repeatedly, counting the bytes on the wire.
+
+    Args:
+        base_url (str): The proxy URL
+        accept_encoding (str): The Accept-Encoding header to send
+        points (int): Metric values per response
+        requests (int): Number of requests to send
+        concurrency (int): Number of concurrent clients
+
+    Returns:
+        dict: Wire bytes per response, throughput and latency
+    """
+    headers = {"X-Original-Host": f"http://127.0.0.1:{STUB_PORT}", "Accept-Encoding": accept_encoding}
+    latencies = []
+    wire_bytes = 0
+    encodings = set()
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=60) as client:
+        async def worker(offset):
+            nonlocal wire_bytes
+            for _ in range(offset, requests, concurrency):
+                start = time.perf_counter()
+                async with client.stream("GET", f"/{HISTORY_PATH}", params={"points": points}) as response:
+                    async for chunk in response.aiter_raw():
+                        wire_bytes += len(chunk)
+                latencies.append(time.perf_counter() - start)
+                encodings.add(response.headers.get("content-encoding", "identity"))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "content_encoding": ",".join(sorted(encodings)),
+        "wire_bytes_per_response": wire_bytes // requests,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2)
+    }
+
+def compression_benchmark(args):
+    """Compare bytes on the wire and proxy CPU time per encoding for large JSON responses."""
+    import compression
+
+    available = compression.supported_encodings()
+    encodings = ["identity"] + [encoding for encoding in ("gzip", "br", "zstd") if encoding in available]
+    results = {}
+    stub = start_server("benchmark:stub_app", STUB_PORT)
+    try:
+        for encoding in encodings:
+            proxy = start_server("mlflow_proxy:app", PROXY_PORT, env={
+                "MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}",
+                "LOG_LEVEL": "WARNING",
+                "COMPRESSION_ENABLED": "true",
+                "COMPRESSION_ENCODINGS": encoding if encoding != "identity" else "gzip"
+            })
+            try:
+                cpu_before = cpu_seconds(proxy.pid)
+                result = asyncio.run(fetch_history(
+                    f"http://127.0.0.1:{PROXY_PORT}", encoding, args.points, args.requests, args.concurrency
+                ))
+                result["proxy_cpu_ms_per_response"] = round(
+                    (cpu_seconds(proxy.pid) - cpu_before) / args.requests * 1000, 2
+                )
+                results[encoding] = result
+            finally:
+                proxy.terminate()
+                proxy.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print(json.dumps(results, indent=2))
+
+def http2_benchmark(args):
+    """Compare log-metric throughput over HTTP/1.1 and HTTP/2 on each leg."""
+    try:
+        import hypercorn  # noqa: F401
+        import h2  # noqa: F401
+    except ImportError:
+        sys.exit("The http2 benchmark needs the hypercorn and h2 packages")
+
+    # (client leg, proxy server, upstream leg, stub server)
+    setups = {
+        "http1": (False, "uvicorn", "1.1", "uvicorn"),
+        "h2c_client": (True, "hypercorn", "1.1", "uvicorn"),
+        "h2c_both": (True, "hypercorn", "h2c", "hypercorn")
+    }
+    results = {}
+    for name, (client_http2, proxy_server, upstream_version, stub_server) in setups.items():
+        stub = start_server("benchmark:stub_app", STUB_PORT, server=stub_server)
+        proxy = start_server("mlflow_proxy:app", PROXY_PORT, env={
+            "MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}",
+            "LOG_LEVEL": "WARNING",
+            "UPSTREAM_HTTP_VERSION": upstream_version
+        }, server=proxy_server)
+        try:
+            result = asyncio.run(run_load(
+                f"http://127.0.0.1:{PROXY_PORT}", args.concurrency, args.duration, 0, http2=client_http2
+            ))
+            result["upstream_requests"] = get_stub_hits()
+            results[name] = result
+        finally:
+            proxy.terminate()
+            stub.terminate()
+            proxy.wait()
+            stub.wait()
+
+    print(json.dumps(results, indent=2))
+
+# Synthetic workload for replay without a capture file:
+# (weight, method, path, query, request body, response bytes, upstream ms)
+SYNTHETIC_MIX = [
+    (50, "POST", f"/{FAST_PATH}", "", b'{"run_id":"r1","key":"loss","value":0.5,"timestamp":0,"step":0}', 2, 5),
+    (15, "POST", "/api/2.0/mlflow/runs/log-batch", "", b'{"run_id":"r1","metrics":[]}' + b" " * 2000, 2, 15),
+    (15, "GET", "/api/2.0/mlflow/runs/get", "run_id=r1", b"", 3000, 8),
+    (10, "POST", f"/{SLOW_PATH}", "", b'{"experiment_ids":["1"]}', 30000, 80),
+    (5, "GET", f"/{HISTORY_PATH}", "run_id=r1&metric_key=loss", b"", 100000, 30),
+    (5, "GET", f"/{ARTIFACT_PATH}", "", b"", 1048576, 20)
+]
+
+def synthetic_capture(requests, rate, seed=42):
+    """
+    Build a capture of a typical tracking workload with Poisson arrivals.
+
+    Args:
+        requests (int): Number of records
+        rate (float): Mean arrival rate in requests per second
+        seed (int, optional): Random seed, so every run replays the same traffic
+
+    Returns:
+        list: Capture records in the CAPTURE_FILE format
+    """
+    rng = random.Random(seed)
+    weights = [item[0] for item in SYNTHETIC_MIX]
+    records = []
+    now = 0.0
+    for _ in range(requests):
+        now += rng.expovariate(rate)
+        _, method, path, query, body, response_bytes, upstream_ms = rng.choices(SYNTHETIC_MIX, weights)[0]
+        record = {
+            "t": now, "method": method, "path": path, "query": query, "status": 200,
+            "req_bytes": len(body), "resp_bytes": response_bytes, "upstream_ms": upstream_ms
+        }
+        if body:
+            record["body"] = base64.b64encode(body).decode("ascii")
+            record["content_type"] = "application/json"
+        records.append(record)
+    return records
+
+def load_capture(path):
+    """Read a CAPTURE_FILE, oldest record first."""
+    with open(path, encoding="utf-8") as capture_file:
+        records = [json.loads(line) for line in capture_file if line.strip()]
+    return sorted(records, key=lambda record: record["t"])
+
+def replay_request(record):
+    """
+    Rebuild a request from a capture record.
+
+    The body is the recorded one if it was captured, or filler of the
+    recorded size. The X-Stub-* headers make the stub answer with the
+    recorded status and size after the recorded upstream latency.
+
+    Returns:
+        tuple: (method, URL, headers, body)
+    """
+    headers = {
+        "X-Original-Host": f"http://127.0.0.1:{STUB_PORT}",
+        "X-Stub-Status": str(record.get("status") or 200),
+        "X-Stub-Bytes": str(record.get("resp_bytes", 0)),
+        "X-Stub-Delay": str((record.get("upstream_ms") or 0) / 1000)
+    }
+    for field, name in (("content_type", "Content-Type"), ("accept_encoding", "Accept-Encoding")):
+        if record.get(field):
+            headers[name] = record[field]
+    if "body" in record:
+        body = base64.b64decode(record["body"])
+    else:
+        body = b" " * record.get("req_bytes", 0)
+    url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    return record["method"], url, headers, body
+
+async def run_replay(base_url, records, speed, rate, max_concurrency):
+    """
+    Replay captured requests against the proxy on their recorded schedule.
+
+    Requests are sent open-loop: each one starts at its scheduled time
+    whether or not earlier ones have finished, and its latency is counted
+    from that time, so a proxy that falls behind shows up in the tail.
+
+    Args:
+        base_url (str): The proxy URL
+        records (list): Capture records, oldest first
+        speed (float): Replay speed; 2 sends the traffic twice as fast as recorded
+        rate (float): Fixed requests per second instead of the recorded timing (0 to keep it)
+        max_concurrency (int): Most requests in flight at once
+
+    Returns:
+        dict: Throughput, latency percentiles, errors and how many requests started late
+    """
+    first = records[0]["t"]
+    schedule = [
+        index / rate if rate else (record["t"] - first) / speed
+        for index, record in enumerate(records)
+    ]
+    latencies = []
+    errors = 0
+    late = 0
+    status_mismatches = 0
+    semaphore = asyncio.Semaphore(max_concurrency)
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+
+        async def send(record, offset):
+            nonlocal errors, late, status_mismatches
+            await asyncio.sleep(max(0.0, offset - (time.perf_counter() - started)))
+            method, url, headers, body = replay_request(record)
+            async with semaphore:
+                if time.perf_counter() - started - offset > 0.01:
+                    late += 1
+                try:
+                    async with client.stream(method, url, headers=headers, content=body or None) as response:
+                        async for _ in response.aiter_raw():
+                            pass
+                    if response.status_code >= 500:
+                        errors += 1
+                    elif record.get("status") and response.status_code != record["status"]:
+                        status_mismatches += 1
+                except httpx.HTTPError:
+                    errors += 1
+            latencies.append(time.perf_counter() - started - offset)
+
+        await asyncio.gather(*(send(record, offset) for record, offset in zip(records, schedule)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(records),
+        "errors": errors,
+        "status_mismatches": status_mismatches,
+        "late_starts": late,
+        "offered_requests_per_second": round(len(records) / max(schedule[-1], 1e-9), 1),
+        "achieved_requests_per_second": round(len(records) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2)
+    }
+
+def replay_benchmark(args):
+    """Replay a captured (or synthetic) workload through the proxy against the stub."""
+    if args.capture:
+        records = load_capture(args.capture)
+    else:
+        records = synthetic_capture(args.requests, args.synthetic_rate)
+    if not records:
+        sys.exit("The capture is empty")
+
+    env = {"MLFLOW_SERVER_URL": f"http://127.0.0.1:{STUB_PORT}", "LOG_LEVEL": "WARNING"}
+    env.update(item.split("=", 1) for item in args.proxy_env)
+    stub = start_server("benchmark:stub_app", STUB_PORT)
+    proxy = start_server("mlflow_proxy:app", PROXY_PORT, env=env)
+    try:
+        cpu_before = cpu_seconds(proxy.pid)
+        results = asyncio.run(run_replay(
+            f"http://127.0.0.1:{PROXY_PORT}", records, args.speed, args.rate, args.max_concurrency
+        ))
+        results["proxy_cpu_seconds"] = round(cpu_seconds(proxy.pid) - cpu_before, 2)
+        results["upstream_requests"] = get_stub_hits()
+        latency = httpx.get(f"http://127.0.0.1:{PROXY_PORT}/api/stats").json()["latency"]["by_status_class"]
+        # Time spent in the proxy itself, excluding the wait for the stub
+        results["proxy_overhead"] = {
+            status_class: histograms["overhead"] for status_class, histograms in latency.items()
+        }
+    finally:
+        proxy.terminate()
+        stub.terminate()
+        proxy.wait()
+        stub.wait()
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MLflow Proxy")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    throughput_parser = subparsers.add_parser(
+        "throughput", help="Requests/sec and latency of log-metric calls"
+    )
+    throughput_parser.add_argument("--concurrency", type=int, default=10)
+    throughput_parser.add_argument("--duration", type=float, default=10)
+    throughput_parser.add_argument(
+        "--slow-every", type=int, default=10,
+        help="Send a slow runs/search call every N requests per worker (0 disables)"
+    )
+    throughput_parser.set_defaults(func=throughput_benchmark)
+
+    streaming_parser = subparsers.add_parser(
+        "streaming", help="Artifact upload/download throughput and proxy peak RSS"
+    )
+    streaming_parser.add_argument("--size-mb", type=int, default=2048)
+    streaming_parser.add_argument("--max-rss-mb", type=float, default=256)
+    streaming_parser.add_argument("--chunk-size", type=int, default=65536)
+    streaming_parser.set_defaults(func=streaming_benchmark)
+
+    stats_parser = subparsers.add_parser(
+        "stats", help="Per-request overhead of statistics recording"
+    )
+    stats_parser.add_argument("--iterations", type=int, default=200000)
+    stats_parser.set_defaults(func=stats_benchmark)
+
+    routes_parser = subparsers.add_parser(
+        "routes", help="Time MLflow route classification (tests/test_routes.py checks it)"
+    )
+    routes_parser.add_argument("--iterations", type=int, default=200000)
+    routes_parser.set_defaults(func=routes_benchmark)
+
+    coalesce_parser = subparsers.add_parser(
+        "coalesce", help="Upstream requests made when many clients fetch the same model"
+    )
+    coalesce_parser.add_argument("--clients", type=int, default=200)
+    coalesce_parser.add_argument("--artifact-mb", type=int, default=16)
+    coalesce_parser.set_defaults(func=coalesce_benchmark)
+
+    batching_parser = subparsers.add_parser(
+        "batching", help="Upstream requests made for a stream of log-metric calls"
+    )
+    batching_parser.add_argument("--concurrency", type=int, default=10)
+    batching_parser.add_argument("--duration", type=float, default=10)
+    batching_parser.set_defaults(func=batching_benchmark)
+
+    spool_parser = subparsers.add_parser(
+        "spool", help="Spool writes during an outage and time their replay"
+    )
+    spool_parser.add_argument("--records", type=int, default=20000)
+    spool_parser.add_argument("--concurrency", type=int, default=10)
+    spool_parser.add_argument("--fsync", action="store_true", help="Sync every spooled write to disk")
+    spool_parser.set_defaults(func=spool_benchmark)
+
+    compression_parser = subparsers.add_parser(
+        "compression", help="Bytes on the wire and proxy CPU per response encoding"
+    )
+    compression_parser.add_argument("--points", type=int, default=5000)
+    compression_parser.add_argument("--requests", type=int, default=500)
+    compression_parser.add_argument("--concurrency", type=int, default=10)
+    compression_parser.set_defaults(func=compression_benchmark)
+
+    http2_parser = subparsers.add_parser(
+        "http2", help="log-metric throughput over HTTP/1.1 and HTTP/2 (needs hypercorn)"
+    )
+    http2_parser.add_argument("--concurrency", type=int, default=200)
+    http2_parser.add_argument("--duration", type=float, default=10)
+    http2_parser.set_defaults(func=http2_benchmark)
+
+    replay_parser = subparsers.add_parser(
+        "replay", help="Replay captured traffic (CAPTURE_FILE) through the proxy against the stub"
+    )
+    replay_parser.add_argument("--capture", help="Capture file; a synthetic workload is used if omitted")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Replay speed relative to the recording")
+    replay_parser.add_argument("--rate", type=float, default=0, help="Fixed requests/sec instead of the recorded timing")
+    replay_parser.add_argument("--max-concurrency", type=int, default=256)
+    replay_parser.add_argument("--requests", type=int, default=5000, help="Synthetic workload size")
+    replay_parser.add_argument("--synthetic-rate", type=float, default=500, help="Synthetic arrival rate")
+    replay_parser.add_argument(
+        "--proxy-env", action="append", default=[], metavar="KEY=VALUE",
+        help="Extra proxy configuration, e.g. RESPONSE_CACHE_ENABLED=true"
+    )
+    replay_parser.set_defaults(func=replay_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,156 @@
+import base64
+import json
+import time
+from typing import Dict
+from urllib.parse import parse_qsl, urlencode
+import config
+import routes
+from batch_writer import BatchWriter
+
+# The only request headers kept; credentials, cookies and client
+# addresses never reach the capture file
+CAPTURED_HEADERS = {b"content-type": "content_type", b"accept-encoding": "accept_encoding"}
+
+# Query parameters of the MLflow REST API, kept with their values; any other
+# parameter, such as an access token or a signed-URL signature, is kept by
+# name only
+CAPTURED_QUERY_PARAMS = {
+    "run_id", "run_uuid", "run_ids", "experiment_id", "experiment_ids", "experiment_name",
+    "name", "version", "alias", "stages", "path", "metric_key", "start_step", "end_step",
+    "max_results", "page_token", "filter", "order_by", "view_type"
+}
+
+capture_stats: Dict[str, int] = {
+    "captured_records": 0,
+    "written_records": 0,
+    "dropped_records": 0
+}
+
+def is_enabled():
+    """
+    Check whether traffic is being captured.
+
+    Returns:
+        bool: True if CAPTURE_FILE is set
+    """
+    return bool(config.CAPTURE_FILE)
+
+def _write_batch(batch):
+    """Append a batch of records to CAPTURE_FILE as JSONL. Runs in a worker thread."""
+    with open(config.CAPTURE_FILE, "a", encoding="utf-8") as capture_file:
+        capture_file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in batch))
+
+_writer = BatchWriter(
+    "capture", _write_batch, capture_stats, config.EXCHANGE_LOG_QUEUE_SIZE,
+    config.EXCHANGE_LOG_BATCH_SIZE, queued_stat="captured_records"
+)
+
+class CaptureMiddleware:
+    """
+    ASGI middleware that records each proxied MLflow call for later replay.
+
+    One compact JSON line per request: arrival time, method, path, query,
+    content type, status, body sizes, total latency and, when the request
+    reached the MLflow server, the upstream latency the proxy stored in
+    the request state. Request bodies up to CAPTURE_MAX_BODY_SIZE bytes
+    are kept (base64) only with CAPTURE_BODIES.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not is_enabled() or routes.is_proxy_endpoint(path):
+            await self.app(scope, receive, send)
+            return
+
+        record = {
+            "t": round(time.time(), 6),
+            "method": scope["method"],
+            "path": path,
+            "query": sanitize_query(scope.get("query_string", b"").decode("latin-1"))
+        }
+        for name, value in scope["headers"]:
+            field = CAPTURED_HEADERS.get(name)
+            if field is not None:
+                record[field] = value.decode("latin-1")
+        request_bytes = 0
+        response_bytes = 0
+        status = None
+        body_chunks = []
+        keep_body = config.CAPTURE_BODIES
+
+        async def capture_receive():
+            nonlocal request_bytes, keep_body
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                request_bytes += len(chunk)
+                if keep_body:
+                    if request_bytes > config.CAPTURE_MAX_BODY_SIZE:
+                        keep_body = False
+                        body_chunks.clear()
+                    else:
+                        body_chunks.append(chunk)
+            return message
+
+        async def capture_send(message):
+            nonlocal response_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        # The proxy stores its upstream latency in the request state
+        state = scope.setdefault("state", {})
+        start = time.perf_counter()
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            record["status"] = status
+            record["req_bytes"] = request_bytes
+            record["resp_bytes"] = response_bytes
+            record["ms"] = round((time.perf_counter() - start) * 1000, 3)
+            upstream_duration = state.get("upstream_duration")
+            if upstream_duration is not None:
+                record["upstream_ms"] = round(upstream_duration * 1000, 3)
+            if keep_body and request_bytes:
+                record["body"] = base64.b64encode(b"".join(body_chunks)).decode("ascii")
+            _writer.submit(record)
+
+def sanitize_query(query_string):
+    """
+    Drop the values of query parameters that are not part of the MLflow API.
+
+    Args:
+        query_string (str): The raw query string
+
+    Returns:
+        str: The query string with only CAPTURED_QUERY_PARAMS values left
+    """
+    if not query_string:
+        return ""
+    return urlencode([
+        (name, value if name in CAPTURED_QUERY_PARAMS else "")
+        for name, value in parse_qsl(query_string, keep_blank_values=True)
+    ])
+
+async def startup():
+    """Start the background capture writer."""
+    if is_enabled():
+        _writer.start()
+
+async def shutdown():
+    """Stop the writer and write any records still queued."""
+    await _writer.stop()
+
+def get_capture_stats():
+    """
+    Get traffic capture statistics for /api/stats.
+
+    Returns:
+        dict: Captured, written and dropped record counts
+    """
+    return {**capture_stats, "file": config.CAPTURE_FILE}
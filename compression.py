@@ -0,0 +1,246 @@
+import time
+import zlib
+from typing import Dict, Any, AsyncIterator
+import config
+
+# brotli and zstandard are optional; without them only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content types worth compressing; artifacts and anything already
+# compressed (archives, images, pickles) pass through unchanged
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript",
+    "application/xml", "text/"
+)
+
+compression_stats: Dict[str, Any] = {
+    "responses": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "seconds": 0.0,
+    "encodings": {}
+}
+
+def supported_encodings():
+    """
+    Get the encodings the proxy can produce, in COMPRESSION_ENCODINGS order.
+
+    Returns:
+        list: Encoding names whose codec is installed
+    """
+    installed = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    return [
+        encoding.strip() for encoding in config.COMPRESSION_ENCODINGS.split(",")
+        if installed.get(encoding.strip())
+    ]
+
+_supported = supported_encodings()
+
+def is_enabled():
+    """
+    Check whether responses are compressed for clients.
+
+    Returns:
+        bool: True if COMPRESSION_ENABLED is set and an encoding is available
+    """
+    return config.COMPRESSION_ENABLED and bool(_supported)
+
+def negotiate(accept_encoding):
+    """
+    Pick the encoding for a client's Accept-Encoding header.
+
+    The proxy's preference order wins among the encodings the client
+    accepts with a non-zero q-value.
+
+    Args:
+        accept_encoding (str): The Accept-Encoding request header
+
+    Returns:
+        str: The encoding to use, or None to send the body as is
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in _supported:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def is_compressible(method, status_code, headers):
+    """
+    Check whether a response body should be compressed.
+
+    Args:
+        method (str): The HTTP method
+        status_code (int): The response status
+        headers: The response headers (any case-insensitive mapping)
+
+    Returns:
+        bool: True for uncompressed text and JSON bodies of at least COMPRESSION_MIN_SIZE bytes
+    """
+    if method == "HEAD" or status_code in (204, 206, 304) or 'content-encoding' in headers:
+        return False
+    content_type = headers.get('content-type', '').lower()
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return False
+    if 'no-transform' in headers.get('cache-control', '').lower():
+        return False
+    try:
+        # Streams of unknown length are compressed; they are usually large
+        return int(headers.get('content-length', config.COMPRESSION_MIN_SIZE)) >= config.COMPRESSION_MIN_SIZE
+    except ValueError:
+        return False
+
+def encoded_headers(headers, encoding):
+    """
+    Adjust response headers for a body compressed with an encoding.
+
+    Args:
+        headers (dict): The response headers
+        encoding (str): The content encoding
+
+    Returns:
+        dict: A copy without Content-Length, with Content-Encoding and Vary set
+    """
+    adjusted = {name: value for name, value in headers.items() if name.lower() not in ('content-length', 'etag')}
+    adjusted['content-encoding'] = encoding
+    vary = headers.get('vary') or headers.get('Vary')
+    adjusted['vary'] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+    return adjusted
+
+class _Encoder:
+    """A streaming compressor that flushes after every chunk, so output is never held back."""
+
+    __slots__ = ("compress", "finish")
+
+    def __init__(self, encoding):
+        if encoding == "gzip":
+            compressor = zlib.compressobj(config.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress = lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = compressor.flush
+        elif encoding == "br":
+            compressor = brotli.Compressor(quality=config.COMPRESSION_BROTLI_QUALITY)
+            self.compress = lambda data: compressor.process(data) + compressor.flush()
+            self.finish = compressor.finish
+        else:
+            compressor = zstandard.ZstdCompressor(level=config.COMPRESSION_ZSTD_LEVEL).compressobj()
+            self.compress = lambda data: compressor.compress(data) + compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+            self.finish = compressor.flush
+
+def _record(encoding, bytes_in, bytes_out, seconds):
+    """Add one compressed response to the statistics."""
+    compression_stats["responses"] += 1
+    compression_stats["bytes_in"] += bytes_in
+    compression_stats["bytes_out"] += bytes_out
+    compression_stats["seconds"] += seconds
+    compression_stats["encodings"][encoding] = compression_stats["encodings"].get(encoding, 0) + 1
+
+async def compress_stream(stream, encoding) -> AsyncIterator[bytes]:
+    """
+    Compress a body as it streams.
+
+    Args:
+        stream: The body chunks
+        encoding (str): The content encoding, from negotiate()
+
+    Yields:
+        bytes: Compressed chunks
+    """
+    encoder = _Encoder(encoding)
+    bytes_in = bytes_out = 0
+    seconds = 0.0
+    try:
+        async for chunk in stream:
+            start = time.perf_counter()
+            compressed = encoder.compress(chunk)
+            seconds += time.perf_counter() - start
+            bytes_in += len(chunk)
+            bytes_out += len(compressed)
+            if compressed:
+                yield compressed
+        start = time.perf_counter()
+        tail = encoder.finish()
+        seconds += time.perf_counter() - start
+        bytes_out += len(tail)
+        if tail:
+            yield tail
+    finally:
+        _record(encoding, bytes_in, bytes_out, seconds)
+
+def compress_body(body, encoding):
+    """
+    Compress a whole body held in memory.
+
+    Args:
+        body (bytes): The body
+        encoding (str): The content encoding, from negotiate()
+
+    Returns:
+        bytes: The compressed body
+    """
+    start = time.perf_counter()
+    encoder = _Encoder(encoding)
+    compressed = encoder.compress(body) + encoder.finish()
+    _record(encoding, len(body), len(compressed), time.perf_counter() - start)
+    return compressed
+
+def decode_prefix(body, encoding, limit):
+    """
+    Decode the start of a compressed body for logging.
+
+    Works on a truncated prefix, so captured bodies can be logged without
+    holding the whole response.
+
+    Args:
+        body (bytes): The captured prefix of the encoded body
+        encoding (str): The Content-Encoding it was sent with
+        limit (int): The maximum number of decoded bytes to return
+
+    Returns:
+        bytes: The decoded prefix, or None if the encoding is unknown or the data is corrupt
+    """
+    encoding = encoding.strip().lower()
+    try:
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # 47 accepts both gzip and zlib headers
+            return zlib.decompressobj(47 if encoding != "deflate" else 15).decompress(body, limit)
+        if encoding == "br" and brotli is not None:
+            return brotli.Decompressor().process(body)[:limit]
+        if encoding == "zstd" and zstandard is not None:
+            return zstandard.ZstdDecompressor().decompressobj().decompress(body)[:limit]
+    except Exception:
+        return None
+    return None
+
+def get_compression_stats() -> Dict[str, Any]:
+    """
+    Get response compression statistics for /api/stats.
+
+    Returns:
+        dict: Compressed response count, bytes before and after, time spent and the available encodings
+    """
+    bytes_in = compression_stats["bytes_in"]
+    return {
+        **compression_stats,
+        "seconds": round(compression_stats["seconds"], 3),
+        "ratio": round(compression_stats["bytes_out"] / bytes_in, 3) if bytes_in else None,
+        "available": _supported
+    }
@@ -13,16 +13,283 @@ LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG")
 FASTAPI_HOST = "http://localhost"
 FASTAPI_PORT = 6150
 
+# HTTP/2 listener: run_with_fastapi.py serves through hypercorn instead of
+# uvicorn, which only speaks HTTP/1.1. Clients get h2 over TLS when
+# TLS_CERTFILE and TLS_KEYFILE are set, and h2c (prior knowledge or
+# Upgrade) otherwise; HTTP/1.1 clients keep working either way. Needs the
+# http2 extra (hypercorn).
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "false").lower() == "true"
+TLS_CERTFILE = os.environ.get("TLS_CERTFILE", "")
+TLS_KEYFILE = os.environ.get("TLS_KEYFILE", "")
+
 # Dashboard configuration
 ENABLE_DASHBOARD = os.environ.get("ENABLE_DASHBOARD", "true").lower() == "true"
 
+# Prometheus/OpenMetrics endpoint at /metrics
+ENABLE_METRICS = os.environ.get("ENABLE_METRICS", "true").lower() == "true"
+
 # Configuration for logging of requests/responses
 # Set to false to disable logging of specific request or response parts
-LOG_REQUEST_HEADERS = True
-LOG_REQUEST_BODY = True
-LOG_RESPONSE_HEADERS = True
-LOG_RESPONSE_BODY = True
+LOG_REQUEST_HEADERS = os.environ.get("LOG_REQUEST_HEADERS", "true").lower() == "true"
+LOG_REQUEST_BODY = os.environ.get("LOG_REQUEST_BODY", "true").lower() == "true"
+LOG_RESPONSE_HEADERS = os.environ.get("LOG_RESPONSE_HEADERS", "true").lower() == "true"
+LOG_RESPONSE_BODY = os.environ.get("LOG_RESPONSE_BODY", "true").lower() == "true"
 
 # Maximum size of response body to log (in bytes)
 # Useful to prevent huge responses from flooding logs
 MAX_LOG_BODY_SIZE = int(os.environ.get("MAX_LOG_BODY_SIZE", 10000))
+
+# Upstream HTTP client configuration
+# Timeouts are in seconds and apply to every request forwarded to MLflow
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 5.0))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 60.0))
+UPSTREAM_WRITE_TIMEOUT = float(os.environ.get("UPSTREAM_WRITE_TIMEOUT", 60.0))
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get("UPSTREAM_POOL_TIMEOUT", 5.0))
+
+# Connection pool limits, applied separately to each upstream host
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 20))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", 30.0))
+
+# HTTP version spoken to the MLflow server: "1.1"; "2" to offer HTTP/2 to
+# https upstreams through ALPN (plain http stays on HTTP/1.1); or "h2c" to
+# speak HTTP/2 with prior knowledge, for cleartext upstreams known to
+# support it. HTTP/2 multiplexes requests over few connections, so
+# UPSTREAM_MAX_CONNECTIONS limits connections rather than requests.
+# "2" and "h2c" need the http2 extra (httpx[http2]); startup fails without it.
+UPSTREAM_HTTP_VERSION = os.environ.get("UPSTREAM_HTTP_VERSION", "1.1")
+
+# Upstream pool registry: at most this many hosts keep an open pool.
+# Pools with no traffic for UPSTREAM_IDLE_TIMEOUT seconds are closed.
+UPSTREAM_MAX_HOSTS = int(os.environ.get("UPSTREAM_MAX_HOSTS", 16))
+UPSTREAM_IDLE_TIMEOUT = float(os.environ.get("UPSTREAM_IDLE_TIMEOUT", 300.0))
+
+# Size of the chunks response bodies are streamed back to clients in (bytes).
+# Larger chunks mean fewer writes for big artifact downloads.
+STREAM_CHUNK_SIZE = min(max(int(os.environ.get("STREAM_CHUNK_SIZE", 65536)), 65536), 1048576)
+
+# Structured exchange logging: one JSON record per proxied request, written
+# in batches by a background task. Records go to EXCHANGE_LOG_FILE as JSONL,
+# or to the application logger when no file is set.
+EXCHANGE_LOG_FILE = os.environ.get("EXCHANGE_LOG_FILE", "")
+EXCHANGE_LOG_QUEUE_SIZE = int(os.environ.get("EXCHANGE_LOG_QUEUE_SIZE", 10000))
+EXCHANGE_LOG_BATCH_SIZE = int(os.environ.get("EXCHANGE_LOG_BATCH_SIZE", 500))
+# What to do when the queue is full: "drop_newest" or "drop_oldest"
+EXCHANGE_LOG_DROP_POLICY = os.environ.get("EXCHANGE_LOG_DROP_POLICY", "drop_newest")
+
+# Statistics limits: size of the recent requests history and the maximum
+# number of distinct request types and status codes counted separately
+STATS_HISTORY_SIZE = int(os.environ.get("STATS_HISTORY_SIZE", 100))
+STATS_MAX_REQUEST_TYPES = int(os.environ.get("STATS_MAX_REQUEST_TYPES", 64))
+STATS_MAX_STATUS_CODES = int(os.environ.get("STATS_MAX_STATUS_CODES", 32))
+
+# Dashboard updates pushed over Server-Sent Events from /api/stats/stream.
+# One broadcaster computes a delta at most every STATS_STREAM_INTERVAL
+# seconds and sends it to every open dashboard. Streams end after
+# STATS_STREAM_MAX_AGE seconds and the browser reconnects: servers wait for
+# open responses on graceful shutdown, so this bounds how long a dashboard
+# can hold a worker up. Subscribers that fall STATS_STREAM_QUEUE_SIZE
+# events behind are disconnected and resynchronize the same way.
+STATS_STREAM_INTERVAL = float(os.environ.get("STATS_STREAM_INTERVAL", 1.0))
+STATS_STREAM_MAX_AGE = float(os.environ.get("STATS_STREAM_MAX_AGE", 30.0))
+STATS_STREAM_MAX_SUBSCRIBERS = int(os.environ.get("STATS_STREAM_MAX_SUBSCRIBERS", 100))
+STATS_STREAM_QUEUE_SIZE = int(os.environ.get("STATS_STREAM_QUEUE_SIZE", 16))
+STATS_STREAM_HEARTBEAT = float(os.environ.get("STATS_STREAM_HEARTBEAT", 15.0))
+
+# Statistics shared across gunicorn workers through a memory-mapped file.
+# Defaults to a file in the temp directory named after the master process pid,
+# removed when the last worker exits. When a new worker takes over the slot
+# of an exited one, the old counts are kept in a retired row, so cluster
+# totals (and the /metrics counters) never go down while any worker runs.
+SHARED_STATS_ENABLED = os.environ.get("SHARED_STATS_ENABLED", "true").lower() == "true"
+SHARED_STATS_FILE = os.environ.get("SHARED_STATS_FILE", "")
+SHARED_STATS_MAX_WORKERS = int(os.environ.get("SHARED_STATS_MAX_WORKERS", 64))
+
+# Number of (path, method) pairs whose MLflow route classification is memoized
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", 4096))
+
+# Read-through cache for idempotent MLflow GETs (get experiment, run, model,
+# model version). Entries live for RESPONSE_CACHE_TTL seconds and are dropped
+# when the proxy forwards a write to the same run, experiment or model.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 5.0))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+
+# Single-flight: identical read-only GETs that arrive while one is already
+# waiting on the MLflow server share its response instead of being sent again.
+# Each joined request buffers at most SINGLE_FLIGHT_QUEUE_SIZE body chunks;
+# one that reads nothing for UPSTREAM_READ_TIMEOUT seconds is dropped.
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_QUEUE_SIZE = int(os.environ.get("SINGLE_FLIGHT_QUEUE_SIZE", 16))
+
+# Write batching: runs/log-metric, runs/log-parameter and runs/set-tag calls
+# are answered right away and sent to MLflow as one runs/log-batch call per
+# run every WRITE_BATCH_WINDOW seconds, or as soon as a batch holds
+# WRITE_BATCH_MAX_ITEMS writes. Off by default, since a failed flush can no
+# longer be reported to the client that made the call.
+WRITE_BATCHING_ENABLED = os.environ.get("WRITE_BATCHING_ENABLED", "false").lower() == "true"
+WRITE_BATCH_WINDOW = float(os.environ.get("WRITE_BATCH_WINDOW", 0.5))
+WRITE_BATCH_MAX_ITEMS = int(os.environ.get("WRITE_BATCH_MAX_ITEMS", 1000))
+
+# Write-ahead spool: when the MLflow server cannot be reached, tracking writes
+# MLflow answers with an empty object (log-metric, log-batch, set-tag, ...)
+# are acknowledged and queued in SPOOL_FILE, then replayed in order once the
+# server is back. Disabled when SPOOL_FILE is empty. The file never grows
+# past SPOOL_MAX_BYTES; with SPOOL_FSYNC every write is synced to disk
+# before it is acknowledged. A spool file is locked by the process using it,
+# so gunicorn workers each take the first free one of SPOOL_FILE,
+# SPOOL_FILE.1, SPOOL_FILE.2, ...; a restarted worker replays the backlog of
+# the worker it replaces.
+SPOOL_FILE = os.environ.get("SPOOL_FILE", "")
+SPOOL_MAX_BYTES = int(os.environ.get("SPOOL_MAX_BYTES", 64 * 1024 * 1024))
+SPOOL_FSYNC = os.environ.get("SPOOL_FSYNC", "true").lower() == "true"
+# Replay reads SPOOL_REPLAY_BATCH records at a time and replays up to
+# SPOOL_REPLAY_CONCURRENCY runs in parallel; each run's writes stay in order
+SPOOL_REPLAY_BATCH = int(os.environ.get("SPOOL_REPLAY_BATCH", 512))
+SPOOL_REPLAY_CONCURRENCY = int(os.environ.get("SPOOL_REPLAY_CONCURRENCY", 8))
+SPOOL_RETRY_INTERVAL = float(os.environ.get("SPOOL_RETRY_INTERVAL", 1.0))
+
+# On-disk artifact cache: artifact downloads are stored in ARTIFACT_CACHE_DIR
+# by content hash while they stream to the client, and later downloads are
+# served from disk with ETag and Range support. Least recently used artifacts
+# are evicted once the cache holds more than ARTIFACT_CACHE_MAX_BYTES.
+# Disabled when ARTIFACT_CACHE_DIR is empty. The index is kept per process,
+# so gunicorn workers should not share a directory.
+ARTIFACT_CACHE_DIR = os.environ.get("ARTIFACT_CACHE_DIR", "")
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+ARTIFACT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_ENTRY_BYTES", 2 * 1024 * 1024 * 1024))
+# Cached artifacts are served without asking the MLflow server for
+# ARTIFACT_CACHE_TTL seconds. After that they are revalidated with the
+# upstream ETag or Last-Modified: a 304 keeps the cached copy, and entries
+# without either header are downloaded again.
+ARTIFACT_CACHE_TTL = float(os.environ.get("ARTIFACT_CACHE_TTL", 300.0))
+
+# Upstream load balancing: read-only MLflow calls are spread over
+# MLFLOW_REPLICA_URLS (comma-separated), plus MLFLOW_SERVER_URL itself when
+# READ_FROM_PRIMARY is set; writes always go to MLFLOW_SERVER_URL. Disabled
+# when no replicas are listed. Requests carrying x-original-host still go
+# where the header says.
+MLFLOW_REPLICA_URLS = [url.strip() for url in os.environ.get("MLFLOW_REPLICA_URLS", "").split(",") if url.strip()]
+READ_FROM_PRIMARY = os.environ.get("READ_FROM_PRIMARY", "true").lower() == "true"
+# "least_outstanding" picks the upstream with the fewest requests in flight;
+# "ewma" also weighs each upstream by its moving average response time
+LOAD_BALANCING_POLICY = os.environ.get("LOAD_BALANCING_POLICY", "least_outstanding")
+LOAD_BALANCING_EWMA_ALPHA = float(os.environ.get("LOAD_BALANCING_EWMA_ALPHA", 0.3))
+
+# Active health checks: every upstream is probed with a GET of
+# HEALTH_CHECK_PATH each HEALTH_CHECK_INTERVAL seconds and takes no traffic
+# while the probe fails
+HEALTH_CHECK_PATH = os.environ.get("HEALTH_CHECK_PATH", "/health")
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", 5.0))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", 2.0))
+
+# Outlier ejection: an upstream that fails OUTLIER_CONSECUTIVE_FAILURES
+# requests in a row (5xx, timeouts, refused connections) is taken out of
+# rotation for OUTLIER_EJECTION_TIME seconds, longer each time it happens again
+OUTLIER_CONSECUTIVE_FAILURES = int(os.environ.get("OUTLIER_CONSECUTIVE_FAILURES", 5))
+OUTLIER_EJECTION_TIME = float(os.environ.get("OUTLIER_EJECTION_TIME", 30.0))
+OUTLIER_MAX_EJECTION_TIME = float(os.environ.get("OUTLIER_MAX_EJECTION_TIME", 300.0))
+
+# Upstream retries: read-only MLflow calls, and the endpoints listed in
+# RETRY_SAFE_ENDPOINTS (comma-separated, e.g. "runs/set-tag"), are sent
+# again up to RETRY_MAX_RETRIES times after a connection failure, a timeout
+# or a RETRY_STATUS_CODES response. Before retry n the proxy waits a random
+# time up to RETRY_BASE_BACKOFF * 2^(n-1) seconds, at most RETRY_MAX_BACKOFF.
+# Any other write is sent exactly once.
+RETRY_MAX_RETRIES = int(os.environ.get("RETRY_MAX_RETRIES", 0))
+RETRY_BASE_BACKOFF = float(os.environ.get("RETRY_BASE_BACKOFF", 0.05))
+RETRY_MAX_BACKOFF = float(os.environ.get("RETRY_MAX_BACKOFF", 1.0))
+RETRY_STATUS_CODES = [int(code) for code in os.environ.get("RETRY_STATUS_CODES", "502,503,504").split(",") if code.strip()]
+RETRY_SAFE_ENDPOINTS = [endpoint.strip().strip('/') for endpoint in os.environ.get("RETRY_SAFE_ENDPOINTS", "").split(",") if endpoint.strip()]
+
+# Retry budget shared by retries and hedges, so they cannot multiply the
+# load on a failing MLflow server: every request earns RETRY_BUDGET_RATIO
+# tokens, plus RETRY_BUDGET_MIN_PER_SECOND tokens a second for quiet
+# periods, and each retry or hedge spends one. At most RETRY_BUDGET_BURST
+# tokens are saved up.
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", 0.1))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", 1.0))
+RETRY_BUDGET_BURST = float(os.environ.get("RETRY_BUDGET_BURST", 10.0))
+
+# Hedged reads: a read-only GET whose response headers have not arrived
+# after the HEDGE_PERCENTILE upstream latency of its request type (kept
+# between HEDGE_MIN_DELAY and HEDGE_MAX_DELAY seconds) is sent a second
+# time, to another replica when load balancing is on, and the first answer
+# wins. Request types with fewer than HEDGE_MIN_SAMPLES recorded responses
+# are not hedged.
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 50))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.01))
+HEDGE_MAX_DELAY = float(os.environ.get("HEDGE_MAX_DELAY", 1.0))
+
+# Admission control, applied to proxied MLflow calls only. Limits are kept
+# per process, so with gunicorn each worker enforces them on its own share.
+# At most ADMISSION_MAX_IN_FLIGHT requests are proxied at once (0 for no
+# cap); up to ADMISSION_QUEUE_SIZE more wait up to ADMISSION_QUEUE_TIMEOUT
+# seconds for a slot, and anything beyond that gets a 503.
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 0))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 100))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 5.0))
+
+# Token-bucket rate limits; requests over a limit get a 429. Clients are
+# identified by the first X-Forwarded-For address, or the peer address.
+# RATE_LIMIT_CLIENT_RATE is in requests per second per client (0 for no
+# limit), and at most RATE_LIMIT_MAX_CLIENTS clients are tracked at a time.
+RATE_LIMIT_CLIENT_RATE = float(os.environ.get("RATE_LIMIT_CLIENT_RATE", 0))
+RATE_LIMIT_CLIENT_BURST = float(os.environ.get("RATE_LIMIT_CLIENT_BURST", 50))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", 10000))
+# Limits shared by all clients per MLflow endpoint, as comma-separated
+# endpoint=rate[:burst] pairs, e.g. "runs/search=20:40,runs/log-metric=500"
+RATE_LIMIT_ENDPOINTS = os.environ.get("RATE_LIMIT_ENDPOINTS", "")
+
+# Response compression: JSON and text responses of at least
+# COMPRESSION_MIN_SIZE bytes are compressed as they stream, with the first
+# encoding in COMPRESSION_ENCODINGS the client accepts. "br" and "zstd" need
+# the brotli and zstandard packages. Bodies the MLflow server already
+# encoded and binary artifacts are passed through unchanged.
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "false").lower() == "true"
+COMPRESSION_ENCODINGS = os.environ.get("COMPRESSION_ENCODINGS", "zstd,br,gzip")
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get("COMPRESSION_ZSTD_LEVEL", 3))
+
+# Traffic capture for benchmark.py replay: every proxied MLflow call is
+# appended to CAPTURE_FILE as one JSON line of method, path, query, sizes,
+# status and latencies. Only Content-Type and Accept-Encoding are kept from
+# the request headers, and only MLflow API parameters keep their values in
+# the query string. Request bodies up to CAPTURE_MAX_BODY_SIZE bytes are
+# recorded too with CAPTURE_BODIES. Disabled when CAPTURE_FILE is empty.
+CAPTURE_FILE = os.environ.get("CAPTURE_FILE", "")
+CAPTURE_BODIES = os.environ.get("CAPTURE_BODIES", "false").lower() == "true"
+CAPTURE_MAX_BODY_SIZE = int(os.environ.get("CAPTURE_MAX_BODY_SIZE", 65536))
+
+# On-demand profiling: GET /api/profile?seconds=N samples the stacks of the
+# worker that answers for up to PROFILING_MAX_SECONDS seconds and returns
+# collapsed stacks (flamegraph.pl / speedscope input). Only one profile
+# runs per worker at a time. Disabled unless PROFILING_ENABLED is set.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_MAX_SECONDS = float(os.environ.get("PROFILING_MAX_SECONDS", 60.0))
+# Per-stage timers for every proxied request (request body read, route
+# classification, upstream connect, TLS and time to first byte, response
+# streaming and exchange logging), shown under "profiling" in /api/stats
+STAGE_TIMERS_ENABLED = os.environ.get("STAGE_TIMERS_ENABLED", "false").lower() == "true"
+
+# Persistent request history: a summary of every proxied MLflow call (time,
+# method, path, request type, status, latencies, client, run and experiment
+# ID, sizes) is written to the SQLite database HISTORY_DB in WAL mode by a
+# background task, in batches of up to HISTORY_BATCH_SIZE rows. gunicorn
+# workers can share one file. Rows older than HISTORY_RETENTION_DAYS, and
+# the oldest beyond HISTORY_MAX_ROWS (0 for no limit), are deleted every
+# HISTORY_COMPACT_INTERVAL seconds. /api/history queries the rows, at most
+# HISTORY_MAX_PAGE_SIZE per page. Disabled when HISTORY_DB is empty.
+HISTORY_DB = os.environ.get("HISTORY_DB", "")
+HISTORY_QUEUE_SIZE = int(os.environ.get("HISTORY_QUEUE_SIZE", 10000))
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", 1000))
+HISTORY_RETENTION_DAYS = float(os.environ.get("HISTORY_RETENTION_DAYS", 30))
+HISTORY_MAX_ROWS = int(os.environ.get("HISTORY_MAX_ROWS", 50000000))
+HISTORY_COMPACT_INTERVAL = float(os.environ.get("HISTORY_COMPACT_INTERVAL", 3600.0))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", 1000))
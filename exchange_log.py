@@ -0,0 +1,75 @@
+import json
+from typing import Dict
+import config
+from batch_writer import BatchWriter
+from utils import render_log_record, logger
+
+log_stats: Dict[str, int] = {
+    "queued_records": 0,
+    "written_records": 0,
+    "dropped_records": 0,
+    "batches": 0
+}
+
+def is_enabled():
+    """
+    Check whether any part of the exchange should be logged.
+
+    Returns:
+        bool: True if at least one LOG_* switch is on
+    """
+    return (config.LOG_REQUEST_HEADERS or config.LOG_REQUEST_BODY
+            or config.LOG_RESPONSE_HEADERS or config.LOG_RESPONSE_BODY)
+
+def _write_batch(batch):
+    """
+    Format and write a batch of records. Runs in a worker thread.
+
+    Args:
+        batch (list): The records to write
+    """
+    lines = [
+        json.dumps(render_log_record(record), separators=(",", ":"), default=str)
+        for record in batch
+    ]
+    if config.EXCHANGE_LOG_FILE:
+        with open(config.EXCHANGE_LOG_FILE, "a", encoding="utf-8") as log_file:
+            log_file.write("\n".join(lines) + "\n")
+    else:
+        for line in lines:
+            logger.info(line)
+
+# Records waiting to be written by the background writer
+_writer = BatchWriter(
+    "exchange log", _write_batch, log_stats, config.EXCHANGE_LOG_QUEUE_SIZE,
+    config.EXCHANGE_LOG_BATCH_SIZE, drop_oldest=config.EXCHANGE_LOG_DROP_POLICY == "drop_oldest"
+)
+
+def submit(record):
+    """
+    Queue a finished exchange record for the background writer.
+
+    Never blocks: when the queue is full the record is dropped according
+    to EXCHANGE_LOG_DROP_POLICY and counted in dropped_records.
+
+    Args:
+        record (dict): The log record
+    """
+    _writer.submit(record)
+
+async def startup():
+    """Start the background log writer."""
+    _writer.start()
+
+async def shutdown():
+    """Stop the writer and flush any records still queued."""
+    await _writer.stop()
+
+def get_log_stats():
+    """
+    Get exchange log statistics for /api/stats.
+
+    Returns:
+        dict: Queue depth and written/dropped record counts
+    """
+    return {**log_stats, "queue_depth": _writer.qsize()}
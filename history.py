@@ -0,0 +1,365 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Any, Optional
+from urllib.parse import parse_qsl
+import config
+import routes
+from admission import client_id
+from batch_writer import BatchWriter
+from utils import logger
+
+# Request bodies are scanned for run and experiment IDs within this prefix
+BODY_PREFIX_SIZE = 4096
+ID_PARAMS = {"run_id": "run_id", "run_uuid": "run_id", "experiment_id": "experiment_id"}
+# Works on truncated JSON, so only the body prefix is needed
+_BODY_ID = re.compile(rb'"(run_id|run_uuid|experiment_id|experiment_ids)"\s*:\s*\[?\s*"([^"]{1,64})"')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    type TEXT NOT NULL,
+    status INTEGER,
+    duration_ms REAL,
+    upstream_ms REAL,
+    client TEXT,
+    run_id TEXT,
+    experiment_id TEXT,
+    req_bytes INTEGER,
+    resp_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS requests_ts ON requests (ts);
+CREATE INDEX IF NOT EXISTS requests_type ON requests (type, ts);
+CREATE INDEX IF NOT EXISTS requests_status ON requests (status, ts);
+CREATE INDEX IF NOT EXISTS requests_client ON requests (client, ts);
+CREATE INDEX IF NOT EXISTS requests_run ON requests (run_id, ts) WHERE run_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS requests_experiment ON requests (experiment_id, ts) WHERE experiment_id IS NOT NULL;
+"""
+
+COLUMNS = (
+    "ts", "method", "path", "type", "status", "duration_ms", "upstream_ms",
+    "client", "run_id", "experiment_id", "req_bytes", "resp_bytes"
+)
+_INSERT = f"INSERT INTO requests ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+# Filters accepted by query(), as the SQL condition each one adds
+FILTERS = {
+    "type": "type = ?",
+    "status": "status = ?",
+    "min_status": "status >= ?",
+    "method": "method = ?",
+    "client": "client = ?",
+    "run_id": "run_id = ?",
+    "experiment_id": "experiment_id = ?",
+    "since": "ts >= ?",
+    "until": "ts < ?"
+}
+
+_compactor: Optional[asyncio.Task] = None
+# A compaction running in a worker thread, which cancelling _compactor does not stop
+_compaction: Optional[asyncio.Future] = None
+# The writer's connection is only used by one to_thread call at a time;
+# queries share a second connection behind a lock
+_write_db: Optional[sqlite3.Connection] = None
+_read_db: Optional[sqlite3.Connection] = None
+_read_lock = threading.Lock()
+
+history_stats: Dict[str, int] = {
+    "queued_records": 0,
+    "written_records": 0,
+    "dropped_records": 0,
+    "compacted_records": 0,
+    "queries": 0
+}
+
+def is_enabled():
+    """
+    Check whether request history is kept.
+
+    Returns:
+        bool: True if HISTORY_DB is set
+    """
+    return bool(config.HISTORY_DB)
+
+def _connect():
+    """Open a connection to HISTORY_DB in WAL mode."""
+    db = sqlite3.connect(config.HISTORY_DB, timeout=5.0, check_same_thread=False, isolation_level=None)
+    # Readers never block the writer and workers can share one file
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+def _extract_ids(query_string, body):
+    """
+    Find the run and experiment a request refers to.
+
+    Args:
+        query_string (str): The raw query string
+        body (bytes): The start of the request body
+
+    Returns:
+        tuple: The run ID and experiment ID, None where not found
+    """
+    ids = {}
+    if query_string:
+        for name, value in parse_qsl(query_string):
+            field = ID_PARAMS.get(name)
+            if field is not None and value:
+                ids.setdefault(field, value)
+    if body and len(ids) < 2:
+        for match in _BODY_ID.finditer(body):
+            field = "run_id" if match.group(1).startswith(b"run") else "experiment_id"
+            ids.setdefault(field, match.group(2).decode("utf-8", errors="replace"))
+    return ids.get("run_id"), ids.get("experiment_id")
+
+def _write_batch(batch):
+    """Insert a batch of records in one transaction. Runs in a worker thread."""
+    rows = []
+    for record in batch:
+        *fields, query_string, body, req_bytes, resp_bytes = record
+        rows.append((*fields, *_extract_ids(query_string, body), req_bytes, resp_bytes))
+    with _write_db:
+        _write_db.execute("BEGIN")
+        _write_db.executemany(_INSERT, rows)
+
+_writer = BatchWriter(
+    "request history", _write_batch, history_stats, config.HISTORY_QUEUE_SIZE, config.HISTORY_BATCH_SIZE
+)
+
+def submit(record):
+    """
+    Queue a request record for the background writer, dropping it if the queue is full.
+
+    Args:
+        record (tuple): The values of COLUMNS, except that run_id and
+            experiment_id may still be a body prefix to scan (see _extract_ids)
+    """
+    _writer.submit(record)
+
+def _delete_chunked(db, condition, value, chunk=10000):
+    """Delete matching rows, oldest first, one autocommitted chunk at a time."""
+    deleted = 0
+    while True:
+        count = db.execute(
+            f"DELETE FROM requests WHERE id IN (SELECT id FROM requests WHERE {condition} ORDER BY id LIMIT ?)",
+            (value, chunk)
+        ).rowcount
+        deleted += count
+        if count < chunk:
+            return deleted
+
+def compact():
+    """
+    Delete records older than HISTORY_RETENTION_DAYS and beyond HISTORY_MAX_ROWS.
+
+    Rows are deleted in small chunks so writers from other workers are
+    never locked out for long, then the freed pages are returned to the
+    file system. Runs in a worker thread.
+
+    Returns:
+        int: The number of records deleted
+    """
+    cutoff = time.time() - config.HISTORY_RETENTION_DAYS * 86400
+    # The writer task owns _write_db, so compaction uses its own connection
+    with closing(_connect()) as db:
+        deleted = _delete_chunked(db, "ts < ?", cutoff)
+        if config.HISTORY_MAX_ROWS > 0:
+            row = db.execute(
+                "SELECT id FROM requests ORDER BY id DESC LIMIT 1 OFFSET ?", (config.HISTORY_MAX_ROWS,)
+            ).fetchone()
+            if row is not None:
+                deleted += _delete_chunked(db, "id <= ?", row[0])
+        if deleted:
+            db.execute("PRAGMA incremental_vacuum")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return deleted
+
+async def _compact_periodically():
+    """Run compact() every HISTORY_COMPACT_INTERVAL seconds until cancelled."""
+    global _compaction
+    while True:
+        _compaction = asyncio.ensure_future(asyncio.to_thread(compact))
+        try:
+            # Shielded, so shutdown can wait for a compaction that is under way
+            deleted = await asyncio.shield(_compaction)
+            history_stats["compacted_records"] += deleted
+        except Exception as e:
+            logger.error(f"Failed to compact request history: {str(e)}")
+        await asyncio.sleep(config.HISTORY_COMPACT_INTERVAL)
+
+def _query(filters, cursor, limit):
+    """Run a history query on the reader connection. Runs in a worker thread."""
+    conditions = []
+    values = []
+    for name, value in filters.items():
+        conditions.append(FILTERS[name])
+        values.append(value)
+    if cursor is not None:
+        # Keyset pagination: the cursor is the (ts, id) of the last row returned
+        conditions.append("(ts, id) < (?, ?)")
+        values.extend(cursor)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT id, {', '.join(COLUMNS)} FROM requests {where} ORDER BY ts DESC, id DESC LIMIT ?"
+    with _read_lock:
+        return _read_db.execute(sql, (*values, limit + 1)).fetchall()
+
+async def query(filters, cursor=None, limit=100):
+    """
+    Get recorded requests, newest first.
+
+    Every filter is backed by an index over (column, ts), so a page costs
+    the same however many rows the database holds.
+
+    Args:
+        filters (dict): Values for any of FILTERS; since and until are Unix timestamps
+        cursor (str, optional): The next_cursor of the previous page
+        limit (int, optional): Page size, at most HISTORY_MAX_PAGE_SIZE
+
+    Returns:
+        dict: The page's items and the cursor of the next page, None on the last page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    limit = min(max(limit, 1), config.HISTORY_MAX_PAGE_SIZE)
+    position = None
+    if cursor:
+        ts, _, row_id = cursor.partition(":")
+        position = (float(ts), int(row_id))
+    history_stats["queries"] += 1
+    rows = await asyncio.to_thread(_query, filters, position, limit)
+    items = [dict(zip(("id",) + COLUMNS, row)) for row in rows[:limit]]
+    for item in items:
+        item["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(item["ts"]))
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = f"{last['ts']!r}:{last['id']}"
+    return {"items": items, "next_cursor": next_cursor}
+
+class HistoryMiddleware:
+    """
+    ASGI middleware that records a summary of every proxied MLflow call.
+
+    The request type, client, sizes, status and latencies are collected
+    here and the first BODY_PREFIX_SIZE bytes of the body are kept; the
+    run and experiment IDs are extracted and the row is written by a
+    background task, in batches.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not is_enabled() or routes.is_proxy_endpoint(path):
+            await self.app(scope, receive, send)
+            return
+
+        request_bytes = 0
+        response_bytes = 0
+        status = None
+        body_chunks = []
+
+        async def history_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                if request_bytes < BODY_PREFIX_SIZE:
+                    body_chunks.append(chunk[:BODY_PREFIX_SIZE - request_bytes])
+                request_bytes += len(chunk)
+            return message
+
+        async def history_send(message):
+            nonlocal response_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        state = scope.setdefault("state", {})
+        timestamp = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, history_receive, history_send)
+        finally:
+            method = scope["method"]
+            relative_path = path.lstrip('/')
+            upstream_duration = state.get("upstream_duration")
+            submit((
+                timestamp,
+                method,
+                relative_path,
+                routes.classify(relative_path, method).name,
+                status,
+                round((time.perf_counter() - start) * 1000, 3),
+                round(upstream_duration * 1000, 3) if upstream_duration is not None else None,
+                client_id(scope),
+                scope.get("query_string", b"").decode("latin-1"),
+                b"".join(body_chunks),
+                request_bytes,
+                response_bytes
+            ))
+
+async def startup():
+    """Open the database and start the background writer and compactor."""
+    global _compactor, _write_db, _read_db
+    if not is_enabled():
+        return
+    directory = os.path.dirname(config.HISTORY_DB)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _write_db = _connect()
+    # auto_vacuum only takes effect on a new database, before the first table
+    _write_db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    _write_db.executescript(SCHEMA)
+    _read_db = _connect()
+    _writer.start()
+    _compactor = asyncio.get_running_loop().create_task(_compact_periodically())
+
+async def shutdown():
+    """Stop the background tasks, write any records still queued and close the database."""
+    global _compactor, _compaction, _write_db, _read_db
+    if _compactor is None:
+        return
+    _compactor.cancel()
+    try:
+        await _compactor
+    except asyncio.CancelledError:
+        pass
+    _compactor = None
+    if _compaction is not None:
+        try:
+            await _compaction
+        except Exception:
+            pass
+        _compaction = None
+    # Waits for a batch being written, then writes the rest, before the connection closes
+    await _writer.stop()
+    _write_db.close()
+    _read_db.close()
+    _write_db = _read_db = None
+
+def get_history_stats() -> Dict[str, Any]:
+    """
+    Get request history statistics for /api/stats.
+
+    Returns:
+        dict: Queued, written, dropped and compacted record counts, and the database size
+    """
+    size = 0
+    for suffix in ("", "-wal"):
+        try:
+            size += os.path.getsize(config.HISTORY_DB + suffix)
+        except OSError:
+            pass
+    return {**history_stats, "file": config.HISTORY_DB, "bytes": size}
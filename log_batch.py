@@ -0,0 +1,115 @@
+import json
+from typing import Dict
+
+# Single-item endpoints whose writes can be merged into runs/log-batch
+BATCHABLE_ENDPOINTS = {"runs/log-metric", "runs/log-parameter", "runs/set-tag"}
+
+# Per-request limits the MLflow server enforces on runs/log-batch
+MAX_METRICS = 1000
+MAX_PARAMS = 100
+MAX_TAGS = 100
+MAX_ENTITIES = 1000
+
+def parse_write(endpoint, body):
+    """
+    Decode a single-item write.
+
+    Args:
+        endpoint (str): The route endpoint, one of BATCHABLE_ENDPOINTS
+        body (bytes): The request body
+
+    Returns:
+        dict: The payload, or None if it is not a well-formed single-item write
+    """
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    run_id = payload.get("run_id") or payload.get("run_uuid")
+    if not isinstance(run_id, str) or not isinstance(payload.get("key"), str) or "value" not in payload:
+        return None
+    if endpoint == "runs/log-metric" and "timestamp" not in payload:
+        return None
+    payload["run_id"] = run_id
+    return payload
+
+def batch_url(url, endpoint):
+    """
+    Get the runs/log-batch URL next to a single-item endpoint URL.
+
+    Args:
+        url (str): The single-item endpoint URL, without a query string
+        endpoint (str): The route endpoint the URL ends with
+
+    Returns:
+        str: The URL with the endpoint replaced by runs/log-batch
+    """
+    return url[:url.rindex(endpoint)] + "runs/log-batch"
+
+class PendingBatch:
+    """Writes for one run waiting to be sent as a single runs/log-batch call."""
+
+    __slots__ = ("url", "headers", "run_id", "metrics", "params", "tags")
+
+    def __init__(self, url, headers, run_id):
+        self.url = url
+        self.headers = headers
+        self.run_id = run_id
+        self.metrics = []
+        # Params and tags keyed by name; a later set-tag replaces an earlier one
+        self.params: Dict[str, str] = {}
+        self.tags: Dict[str, str] = {}
+
+    @property
+    def size(self):
+        """The number of entities in the batch."""
+        return len(self.metrics) + len(self.params) + len(self.tags)
+
+    def accepts(self, endpoint, payload):
+        """
+        Check whether a write can join the batch.
+
+        MLflow rejects a batch that sets one param twice, so a param that
+        changes value has to go into the next batch.
+        """
+        if endpoint != "runs/log-parameter":
+            return True
+        return self.params.get(payload["key"], payload["value"]) == payload["value"]
+
+    def add(self, endpoint, payload):
+        """
+        Add a write parsed by parse_write().
+
+        Args:
+            endpoint (str): The route endpoint the write was sent to
+            payload (dict): The write
+        """
+        if endpoint == "runs/log-metric":
+            self.metrics.append({
+                "key": payload["key"],
+                "value": payload["value"],
+                "timestamp": payload["timestamp"],
+                "step": payload.get("step", 0)
+            })
+        elif endpoint == "runs/log-parameter":
+            self.params[payload["key"]] = payload["value"]
+        else:
+            self.tags[payload["key"]] = payload["value"]
+
+    def is_full(self, max_items=MAX_ENTITIES):
+        """Check whether one more entity could exceed a log-batch limit."""
+        return (self.size >= min(MAX_ENTITIES, max_items)
+                or len(self.metrics) >= MAX_METRICS
+                or len(self.params) >= MAX_PARAMS
+                or len(self.tags) >= MAX_TAGS)
+
+    def to_json(self):
+        """Encode the batch as a runs/log-batch request body."""
+        return json.dumps({
+            "run_id": self.run_id,
+            "metrics": self.metrics,
+            "params": [{"key": key, "value": value} for key, value in self.params.items()],
+            "tags": [{"key": key, "value": value} for key, value in self.tags.items()]
+        }, separators=(",", ":")).encode()
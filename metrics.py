@@ -0,0 +1,169 @@
+from itertools import accumulate
+from typing import List
+from stats import HISTOGRAM_MIN, HISTOGRAM_GROWTH, HISTOGRAM_BUCKETS
+import shared_stats
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Exposed histogram bucket bounds (seconds), the Prometheus client defaults
+EXPOSED_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _fine_bucket_cutoffs():
+    """
+    Map each exposed bucket bound to the last fine histogram bucket below it.
+
+    Computed once at import, so exposing a histogram costs the same no
+    matter how many requests it holds.
+    """
+    cutoffs = []
+    for bound in EXPOSED_BUCKETS:
+        index = 0
+        while index + 1 < HISTOGRAM_BUCKETS and HISTOGRAM_MIN * HISTOGRAM_GROWTH ** (index + 1) <= bound * (1 + 1e-9):
+            index += 1
+        cutoffs.append(index)
+    return cutoffs
+
+_CUTOFFS = _fine_bucket_cutoffs()
+_BUCKET_LABELS = [repr(bound) for bound in EXPOSED_BUCKETS]
+
+# Escaped label values, cached since label sets are capped by the stats limits
+_escaped = {}
+
+def escape_label(value):
+    """
+    Escape a label value for the exposition format.
+
+    Args:
+        value (str): The raw label value
+
+    Returns:
+        str: The escaped value
+    """
+    escaped = _escaped.get(value)
+    if escaped is None:
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        if len(_escaped) < 1024:
+            _escaped[value] = escaped
+    return escaped
+
+class MetricsWriter:
+    """Builds exposition text in either Prometheus 0.0.4 or OpenMetrics format."""
+
+    def __init__(self, openmetrics):
+        self.openmetrics = openmetrics
+        self.lines: List[str] = []
+
+    def family(self, name, metric_type, help_text):
+        """Write the HELP and TYPE lines of a metric family."""
+        # Prometheus 0.0.4 names counter families after their _total sample
+        if metric_type == "counter" and not self.openmetrics:
+            name = f"{name}_total"
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+
+    def sample(self, name, value, labels=""):
+        """Write a single sample; labels is an already formatted label list."""
+        if labels:
+            self.lines.append(f"{name}{{{labels}}} {value}")
+        else:
+            self.lines.append(f"{name} {value}")
+
+    def counter(self, name, help_text, value):
+        """Write an unlabelled counter."""
+        self.family(name, "counter", help_text)
+        self.sample(f"{name}_total", value)
+
+    def gauge(self, name, help_text, value):
+        """Write an unlabelled gauge."""
+        self.family(name, "gauge", help_text)
+        self.sample(name, value)
+
+    def histogram(self, name, histogram, labels=""):
+        """
+        Write the samples of a stats.LatencyHistogram under the exposed buckets.
+
+        Args:
+            name (str): The metric family name
+            histogram (stats.LatencyHistogram): The histogram to expose
+            labels (str, optional): Formatted labels shared by every sample
+        """
+        cumulative = list(accumulate(histogram.counts))
+        prefix = f"{labels}," if labels else ""
+        for label, cutoff in zip(_BUCKET_LABELS, _CUTOFFS):
+            self.sample(f"{name}_bucket", cumulative[cutoff], f'{prefix}le="{label}"')
+        self.sample(f"{name}_bucket", cumulative[-1], f'{prefix}le="+Inf"')
+        self.sample(f"{name}_count", cumulative[-1], labels)
+        self.sample(f"{name}_sum", histogram.total, labels)
+
+    def render(self):
+        """Return the exposition text."""
+        if self.openmetrics:
+            self.lines.append("# EOF")
+        return "\n".join(self.lines) + "\n"
+
+def render_metrics(stats, pool_stats, log_stats, openmetrics=False):
+    """
+    Render the proxy's metrics in the Prometheus text or OpenMetrics format.
+
+    Everything is read from fixed-size state, so the cost of a scrape does
+    not grow with the amount of traffic served.
+
+    Args:
+        stats (stats.ProxyStats): The proxy statistics
+        pool_stats (dict): Upstream pool statistics from upstream.get_pool_stats()
+        log_stats (dict): Exchange log statistics from exchange_log.get_log_stats()
+        openmetrics (bool, optional): Render OpenMetrics instead of Prometheus 0.0.4
+
+    Returns:
+        str: The exposition text
+    """
+    writer = MetricsWriter(openmetrics)
+
+    writer.family("mlflow_proxy_requests", "counter", "Requests received, by MLflow request type.")
+    for request_type, count in stats.request_types.counts.items():
+        writer.sample("mlflow_proxy_requests_total", count, f'type="{escape_label(request_type)}"')
+
+    writer.counter("mlflow_proxy_errors", "Requests that could not be proxied.", stats.errors)
+
+    writer.family("mlflow_proxy_responses", "counter", "Upstream responses, by status code.")
+    for code, count in stats.status_codes.counts.items():
+        writer.sample("mlflow_proxy_responses_total", count, f'code="{escape_label(code)}"')
+
+    writer.gauge("mlflow_proxy_in_flight_requests", "Requests currently being proxied.", stats.in_flight)
+    writer.counter("mlflow_proxy_request_bytes", "Request body bytes streamed upstream.", stats.request_bytes)
+    writer.counter("mlflow_proxy_response_bytes", "Response body bytes streamed to clients.", stats.response_bytes)
+
+    writer.family("mlflow_proxy_upstream_latency_seconds", "histogram", "Time waiting on the MLflow server, by request type.")
+    for request_type, latency in stats.latency_by_type.items():
+        writer.histogram("mlflow_proxy_upstream_latency_seconds", latency.upstream, f'type="{escape_label(request_type)}"')
+
+    writer.family("mlflow_proxy_overhead_latency_seconds", "histogram", "Time spent in the proxy itself, by request type.")
+    for request_type, latency in stats.latency_by_type.items():
+        writer.histogram("mlflow_proxy_overhead_latency_seconds", latency.overhead, f'type="{escape_label(request_type)}"')
+
+    writer.counter("mlflow_proxy_upstream_pool_hits", "Requests that reused an upstream pool.", pool_stats["hits"])
+    writer.counter("mlflow_proxy_upstream_pool_misses", "Requests that opened a new upstream pool.", pool_stats["misses"])
+    writer.counter("mlflow_proxy_upstream_pool_evictions", "Upstream pools closed to stay under the host limit.", pool_stats["evictions"])
+    writer.gauge("mlflow_proxy_upstream_pools", "Open upstream pools.", len(pool_stats["hosts"]))
+    writer.family("mlflow_proxy_upstream_active_requests", "gauge", "Requests in flight, by upstream host.")
+    for origin, host in pool_stats["hosts"].items():
+        writer.sample("mlflow_proxy_upstream_active_requests", host["active"], f'host="{escape_label(origin)}"')
+
+    writer.counter("mlflow_proxy_log_dropped_records", "Exchange log records dropped.", log_stats["dropped_records"])
+    writer.gauge("mlflow_proxy_log_queue_depth", "Exchange log records waiting to be written.", log_stats["queue_depth"])
+
+    if stats.shared is not None:
+        totals = stats.shared.snapshot()["totals"]
+        writer.counter("mlflow_proxy_cluster_requests", "Requests received by all workers.", totals["requests"])
+        writer.counter("mlflow_proxy_cluster_errors", "Requests all workers could not proxy.", totals["errors"])
+        writer.family("mlflow_proxy_cluster_upstream_latency_seconds", "histogram", "Time waiting on the MLflow server, across all workers.")
+        cumulative = 0
+        for bound, count in zip(shared_stats.LATENCY_BUCKETS, totals["latency_histogram"].values()):
+            cumulative += count
+            label = "+Inf" if bound == float("inf") else repr(bound)
+            writer.sample("mlflow_proxy_cluster_upstream_latency_seconds_bucket", cumulative, f'le="{label}"')
+        writer.sample("mlflow_proxy_cluster_upstream_latency_seconds_count", cumulative)
+        writer.sample("mlflow_proxy_cluster_upstream_latency_seconds_sum", totals["total_request_time"])
+
+    return writer.render()
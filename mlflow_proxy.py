@@ -1,20 +1,79 @@
-from fastapi import FastAPI, Request, Response, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse, FileResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-import requests
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+import asyncio
+import httpx
 import logging
+import os
 import time
 import json
-from typing import Dict, Any, List, Optional
-from urllib.parse import urlparse
+from typing import Optional
 import config
+import upstream
+import exchange_log
+import shared_stats
+import metrics
+import routes
+import singleflight
+import write_batcher
+import log_batch
+import spool
+import balancer
+import admission
+import compression
+import capture
+import retries
+import profiling
+import history
+import stats_stream
+from stats import ProxyStats
+from response_cache import ResponseCache, ENTITY_PREFIX_SIZE, entity_id
+from artifact_cache import ArtifactCache
 from utils import (
-    get_target_url, log_request, log_response, 
-    get_mlflow_request_type, logger
+    get_target_url, request_log_record, add_request_body, add_response,
+    request_key, filter_headers, BodyCapture, logger
 )
 
-app = FastAPI(title="MLflow Proxy", description="A proxy server for MLflow")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared resources on startup and release them on shutdown."""
+    await upstream.startup()
+    await balancer.startup()
+    await exchange_log.startup()
+    await capture.startup()
+    await history.startup()
+    await spool.startup()
+    await write_batcher.startup(on_flushed=invalidate_cached_run)
+    if artifact_cache is not None:
+        await asyncio.to_thread(artifact_cache.load)
+    stats.shared = shared_stats.open_slot()
+    if config.ENABLE_DASHBOARD:
+        await stats_stream.startup(stats)
+    yield
+    await stats_stream.shutdown()
+    # Pending batched writes still need the spool and the upstream pools
+    await write_batcher.shutdown()
+    await spool.shutdown()
+    await balancer.shutdown()
+    await upstream.shutdown()
+    await exchange_log.shutdown()
+    await capture.shutdown()
+    await history.shutdown()
+    if artifact_cache is not None:
+        await artifact_cache.save()
+    if stats.shared is not None:
+        stats.shared.close()
+        stats.shared = None
+
+def invalidate_cached_run(run_id):
+    """Drop a cached run once batched writes to it have reached the MLflow server."""
+    if response_cache is not None:
+        response_cache.invalidate("runs", run_id)
+
+app = FastAPI(title="MLflow Proxy", description="A proxy server for MLflow", lifespan=lifespan)
 
 # Set up templates
 templates = Jinja2Templates(directory="templates")
@@ -22,15 +81,41 @@ templates = Jinja2Templates(directory="templates")
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Simple in-memory statistics storage
-stats: Dict[str, Any] = {
-    "requests": 0,
-    "errors": 0,
-    "total_request_time": 0,
-    "request_types": {},
-    "status_codes": {},
-    "last_requests": []  # Will keep the last 100 requests for display
-}
+# In-memory statistics with a fixed-size recent requests history
+stats = ProxyStats(
+    history_size=config.STATS_HISTORY_SIZE,
+    max_request_types=config.STATS_MAX_REQUEST_TYPES,
+    max_status_codes=config.STATS_MAX_STATUS_CODES
+)
+
+# Read-through cache for idempotent MLflow reads, None when disabled
+response_cache = ResponseCache(
+    ttl=config.RESPONSE_CACHE_TTL,
+    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=config.RESPONSE_CACHE_MAX_BYTES,
+    max_entry_bytes=config.RESPONSE_CACHE_MAX_ENTRY_BYTES
+) if config.RESPONSE_CACHE_ENABLED else None
+
+# On-disk cache for artifact downloads, None when disabled
+artifact_cache = ArtifactCache(
+    directory=config.ARTIFACT_CACHE_DIR,
+    max_bytes=config.ARTIFACT_CACHE_MAX_BYTES,
+    max_entry_bytes=config.ARTIFACT_CACHE_MAX_ENTRY_BYTES,
+    ttl=config.ARTIFACT_CACHE_TTL
+) if config.ARTIFACT_CACHE_DIR else None
+
+def record_shed_request(method, path, request_type, status_code):
+    """Count a request the admission middleware turned away like any other proxied request."""
+    stats.record_request(request_type)
+    stats.record_response(method, path, request_type, status_code, 0.0, 0.0)
+    stats.record_finished(0, 0)
+
+# Rate limits and the in-flight cap sit in front of every proxied request
+app.add_middleware(admission.AdmissionMiddleware, on_shed=record_shed_request)
+# Outside admission control, so the history shows shed requests too
+app.add_middleware(history.HistoryMiddleware)
+# Added last so it wraps admission control and captures shed requests too
+app.add_middleware(capture.CaptureMiddleware)
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -39,8 +124,9 @@ async def index(request: Request):
         return "MLflow Proxy Server is running. Dashboard is disabled."
     
     return templates.TemplateResponse(
+        request,
         "index.html", 
-        {"request": request, "stats": stats, "mlflow_server": config.MLFLOW_SERVER_URL}
+        {"stats": stats.snapshot(), "mlflow_server": config.MLFLOW_SERVER_URL}
     )
 
 @app.get("/api/stats", response_class=JSONResponse)
@@ -52,7 +138,123 @@ async def get_stats():
             status_code=403
         )
     
-    return stats
+    return {
+        **stats.snapshot(),
+        "upstream_pools": upstream.get_pool_stats(),
+        "compression": compression.get_compression_stats() if compression.is_enabled() else None,
+        "load_balancer": balancer.get_balancer_stats() if balancer.is_enabled() else None,
+        "retries": retries.get_retry_stats() if retries.is_enabled() else None,
+        "admission": admission.get_admission_stats() if admission.is_enabled() else None,
+        "capture": capture.get_capture_stats() if capture.is_enabled() else None,
+        "history": history.get_history_stats() if history.is_enabled() else None,
+        "stats_stream": stats_stream.get_stream_stats(),
+        "profiling": profiling.get_profiling_stats()
+            if config.PROFILING_ENABLED or config.STAGE_TIMERS_ENABLED else None,
+        "logging": exchange_log.get_log_stats(),
+        "response_cache": response_cache.snapshot() if response_cache is not None else None,
+        "artifact_cache": artifact_cache.snapshot() if artifact_cache is not None else None,
+        "single_flight": singleflight.get_flight_stats(),
+        "write_batching": write_batcher.get_batch_stats() if write_batcher.is_enabled() else None,
+        "spool": spool.get_spool_stats() if spool.is_enabled() else None
+    }
+
+@app.get("/api/stats/stream")
+async def stream_stats():
+    """Push dashboard updates as Server-Sent Events: a snapshot, then throttled deltas."""
+    if not config.ENABLE_DASHBOARD:
+        return JSONResponse(
+            content={"error": "Dashboard is disabled"}, 
+            status_code=403
+        )
+
+    queue = stats_stream.subscribe()
+    if queue is None:
+        return JSONResponse(
+            content={"error": "Too many open stats streams"},
+            status_code=503,
+            headers={"Retry-After": "10"}
+        )
+    return StreamingResponse(
+        stats_stream.events(queue),
+        media_type="text/event-stream",
+        # Keep reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/profile")
+async def get_profile(seconds: float = 10.0, interval: float = 0.005, threads: str = "loop", format: str = "collapsed"):
+    """
+    Take a sampling profile of the worker that answers the request.
+    
+    Args:
+        seconds (float): How long to sample for, capped at PROFILING_MAX_SECONDS
+        interval (float): Seconds between samples
+        threads (str): "loop" for the event loop thread only, "all" for every thread
+        format (str): "collapsed" for flamegraph-ready collapsed stacks, "json"
+            for the stacks plus the functions with the most samples
+    """
+    if not config.PROFILING_ENABLED:
+        return JSONResponse(
+            content={"error": "Profiling is disabled"}, 
+            status_code=403
+        )
+    
+    result = await profiling.profile(seconds, interval, all_threads=threads == "all")
+    if result is None:
+        return JSONResponse(
+            content={"error": "A profile is already running in this worker"},
+            status_code=409
+        )
+    headers = {"X-Profile-Pid": str(result["pid"]), "X-Profile-Rounds": str(result["rounds"])}
+    if format == "json":
+        return JSONResponse(
+            content={
+                **result,
+                "stacks": dict(result["stacks"].most_common()),
+                "top_functions": profiling.top_functions(result)
+            },
+            headers=headers
+        )
+    return PlainTextResponse(profiling.collapsed(result), headers=headers)
+
+@app.get("/api/history", response_class=JSONResponse)
+async def get_history(
+    type: Optional[str] = None,
+    status: Optional[int] = None,
+    min_status: Optional[int] = None,
+    method: Optional[str] = None,
+    client: Optional[str] = None,
+    run_id: Optional[str] = None,
+    experiment_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100
+):
+    """
+    Query the persistent request history, newest first.
+    
+    Every filter is optional; since and until are Unix timestamps. Pass a
+    page's next_cursor as cursor to get the page after it.
+    """
+    if not history.is_enabled():
+        return JSONResponse(
+            content={"error": "Request history is disabled"}, 
+            status_code=403
+        )
+    
+    filters = {
+        name: value for name, value in (
+            ("type", type), ("status", status), ("min_status", min_status),
+            ("method", method.upper() if method else None), ("client", client),
+            ("run_id", run_id), ("experiment_id", experiment_id),
+            ("since", since), ("until", until)
+        ) if value is not None
+    }
+    try:
+        return await history.query(filters, cursor, limit)
+    except ValueError:
+        return JSONResponse(content={"error": f"Invalid cursor: {cursor}"}, status_code=400)
 
 @app.get("/health", response_class=JSONResponse)
 async def health_check():
@@ -60,9 +262,273 @@ async def health_check():
     return {
         "status": "healthy",
         "mlflow_server": config.MLFLOW_SERVER_URL,
-        "requests_proxied": stats["requests"]
+        "requests_proxied": stats.requests,
+        "worker": os.getpid()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    """Prometheus/OpenMetrics endpoint exposing proxy metrics."""
+    if not config.ENABLE_METRICS:
+        return JSONResponse(
+            content={"error": "Metrics are disabled"}, 
+            status_code=403
+        )
+    
+    openmetrics = "application/openmetrics-text" in request.headers.get("accept", "")
+    return Response(
+        content=metrics.render_metrics(
+            stats, upstream.get_pool_stats(), exchange_log.get_log_stats(), openmetrics
+        ),
+        media_type=metrics.OPENMETRICS_CONTENT_TYPE if openmetrics else metrics.PROMETHEUS_CONTENT_TYPE
+    )
+
+def body_size(request_body):
+    """
+    Get the number of request body bytes forwarded so far.
+    
+    Args:
+        request_body (BodyCapture, optional): The capture wrapping the request stream
+        
+    Returns:
+        int: The body size, 0 when the request has no body
+    """
+    return request_body.size if request_body is not None else 0
+
+def add_request_body_to_record(log_record, request_body):
+    """
+    Attach the captured request body to an exchange log record.
+    
+    Args:
+        log_record (dict, optional): The log record, None when logging is off
+        request_body (BodyCapture, optional): The capture wrapping the request stream
+    """
+    if log_record is not None and request_body is not None:
+        # The capture may be longer than MAX_LOG_BODY_SIZE when the response cache needs it
+        add_request_body(log_record, request_body.captured[:config.MAX_LOG_BODY_SIZE], request_body.size)
+
+def cached_response(cache_key, entry, method, path, request_type, handler_start, log_record, accept_encoding=None):
+    """
+    Build the response for a cache hit and record it like a proxied request.
+    
+    The body is compressed at most once per encoding; the compressed copy
+    is kept on the entry for later hits.
+    
+    Args:
+        cache_key (tuple): The cache key of the entry
+        entry (response_cache.CacheEntry): The cached upstream response
+        method (str): The HTTP method
+        path (str): The request path
+        request_type (str): The MLflow request type
+        handler_start (float): perf_counter() value from when the request arrived
+        log_record (dict, optional): The log record, None when logging is off
+        accept_encoding (str, optional): The client's Accept-Encoding header
+        
+    Returns:
+        Response: The cached response
+    """
+    stats.record_response(method, path, request_type, entry.status_code, 0.0, time.perf_counter() - handler_start)
+    stats.record_finished(0, len(entry.body))
+    body = entry.body
+    headers = {**entry.headers, "X-MLflow-Proxy-Cache": "HIT"}
+    encoding = None
+    if compression.is_enabled() and compression.is_compressible(method, entry.status_code, entry.headers):
+        encoding = compression.negotiate(accept_encoding)
+    if encoding is not None:
+        body = entry.encoded.get(encoding)
+        if body is None:
+            body = compression.compress_body(entry.body, encoding)
+            response_cache.add_encoding(cache_key, entry, encoding, body)
+        headers = compression.encoded_headers(headers, encoding)
+    response = Response(content=body, status_code=entry.status_code, headers=headers)
+    if log_record is not None:
+        add_response(log_record, response, 0.0, entry.body)
+        log_record["cache"] = "hit"
+        exchange_log.submit(log_record)
+    return response
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an ETag, using weak comparison.
+    
+    Args:
+        if_none_match (str): The If-None-Match request header
+        etag (str): The current ETag of the resource
+        
+    Returns:
+        bool: True if the client already has this version
+    """
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+class CachedFileResponse(FileResponse):
+    """
+    A FileResponse that reports the status and size it actually sent.
+
+    FileResponse answers a Range header with a 206, 400 or 416 only once
+    it parses the header while sending, so the caller learns the outcome
+    through on_sent rather than from status_code.
+    """
+
+    def __init__(self, path, headers, on_sent):
+        super().__init__(path, headers=headers)
+        self.on_sent = on_sent
+
+    async def __call__(self, scope, receive, send):
+        status = 500
+        size = 0
+
+        async def record_send(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if scope["method"] != "HEAD":
+                    size = int(dict(message["headers"]).get(b"content-length", b"0"))
+            await send(message)
+
+        try:
+            await super().__call__(scope, receive, record_send)
+        finally:
+            self.on_sent(status, size)
+
+def cached_artifact_response(entry, request, method, path, request_type, handler_start, log_record):
+    """
+    Serve an artifact from the on-disk cache and record it like a proxied request.
+    
+    The file is sent by FileResponse, which answers Range requests and uses
+    the server's zero-copy file sending when it offers one. Clients that
+    already hold this version get a 304 without a body.
+    
+    Args:
+        entry (artifact_cache.ArtifactEntry): The cached artifact
+        request (Request): The FastAPI request object
+        method (str): The HTTP method
+        path (str): The request path
+        request_type (str): The MLflow request type
+        handler_start (float): perf_counter() value from when the request arrived
+        log_record (dict, optional): The log record, None when logging is off
+        
+    Returns:
+        Response: The cached artifact, or an empty 304 response
+    """
+    def record(status, size):
+        stats.record_response(method, path, request_type, status, 0.0, time.perf_counter() - handler_start)
+        stats.record_finished(0, size)
+        if log_record is not None:
+            add_response(log_record, response, 0.0)
+            log_record["status"] = status
+            log_record["cache"] = "hit"
+            exchange_log.submit(log_record)
+
+    headers = {**entry.headers, "etag": entry.etag, "X-MLflow-Proxy-Cache": "HIT"}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None and etag_matches(if_none_match, entry.etag):
+        artifact_cache.counters["not_modified"] += 1
+        response = Response(status_code=304, headers={"etag": entry.etag, "X-MLflow-Proxy-Cache": "HIT"})
+        record(304, 0)
+    else:
+        # Recorded once the Range header, if any, has been parsed
+        response = CachedFileResponse(artifact_cache.blob_path(entry.digest), headers, record)
+    return response
+
+def deferred_write_response(method, path, request_type, handler_start, log_record, body, mode):
+    """
+    Acknowledge a write the proxy will deliver later, recording it like a proxied request.
+    
+    Args:
+        method (str): The HTTP method
+        path (str): The request path
+        request_type (str): The MLflow request type
+        handler_start (float): perf_counter() value from when the request arrived
+        log_record (dict, optional): The log record, None when logging is off
+        body (bytes): The request body
+        mode (str): "batched" or "spooled"
+        
+    Returns:
+        Response: An empty JSON object, as MLflow answers these writes
+    """
+    stats.record_response(method, path, request_type, 200, 0.0, time.perf_counter() - handler_start)
+    stats.record_finished(len(body), 2)
+    response = Response(
+        content=b"{}",
+        media_type="application/json",
+        headers={"X-MLflow-Proxy-Deferred": mode}
+    )
+    if log_record is not None:
+        add_request_body(log_record, body)
+        add_response(log_record, response, 0.0, b"{}")
+        log_record[mode] = True
+        exchange_log.submit(log_record)
+    return response
+
+async def log_streamed_response(log_record, response, duration, response_body, log_time=0.0):
+    """
+    Queue the exchange log record after the body has been streamed to the client.
+    
+    Args:
+        log_record (dict): The log record started for the request
+        response (httpx.Response): The upstream response
+        duration (float): The duration of the upstream request in seconds
+        response_body (BodyCapture): The capture wrapping the response stream
+        log_time (float, optional): Seconds already spent starting the record, for the stage timers
+    """
+    start = time.perf_counter()
+    add_response(log_record, response, duration, response_body.captured, response_body.size)
+    exchange_log.submit(log_record)
+    if config.STAGE_TIMERS_ENABLED:
+        profiling.record("logging", log_time + time.perf_counter() - start)
+
+def store_cached_response(cache_key, group, entity, generation, response, headers, response_body):
+    """
+    Store a fully streamed upstream response in the response cache.
+    
+    Only complete 200 responses that fit in a cache entry and that the
+    MLflow server did not mark as private are kept.
+    
+    Args:
+        cache_key (tuple): The cache key of the request
+        group (str): The entity family of the endpoint
+        entity (str): The entity the request reads, None if it names none
+        generation (int): The cache generation from before the request was sent
+        response (httpx.Response): The upstream response
+        headers (dict): The filtered response headers
+        response_body (BodyCapture): The capture wrapping the response stream
+    """
+    if not response_body.completed or response.status_code != 200:
+        return
+    if response_body.size > response_cache.max_entry_bytes:
+        return
+    cache_control = response.headers.get('cache-control', '').lower()
+    if 'no-store' in cache_control or 'private' in cache_control or 'set-cookie' in response.headers:
+        return
+    response_cache.store(cache_key, group, entity, generation, response.status_code, headers, response_body.captured)
+
+def is_cacheable_artifact(request, response, max_entry_bytes):
+    """
+    Check whether an upstream artifact response can be written to the artifact cache.
+    
+    Only whole, unencoded 200 responses of unconditional requests are kept,
+    so a cached file always holds the artifact's exact bytes.
+    
+    Args:
+        request (Request): The FastAPI request object
+        response (httpx.Response): The upstream response
+        max_entry_bytes (int): The largest artifact the cache keeps
+        
+    Returns:
+        bool: True if the body can be cached while it streams
+    """
+    if response.status_code != 200 or 'range' in request.headers or 'content-encoding' in response.headers:
+        return False
+    cache_control = response.headers.get('cache-control', '').lower()
+    if 'no-store' in cache_control or 'private' in cache_control or 'set-cookie' in response.headers:
+        return False
+    try:
+        return int(response.headers.get('content-length', 0)) <= max_entry_bytes
+    except ValueError:
+        return False
+
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"])
 async def proxy(request: Request, path: str):
     """
@@ -75,77 +541,278 @@ async def proxy(request: Request, path: str):
     Returns:
         Response: The proxied response from the MLflow server
     """
-    target_url = get_target_url(path, config.MLFLOW_SERVER_URL)
+    handler_start = time.perf_counter()
     
     # Read request details
     method = request.method
-    headers = {key: value for key, value in request.headers.items() if key.lower() != 'host'}
-    body = await request.body()
-    params = dict(request.query_params)
+    headers = filter_headers(request.headers, exclude=('host',))
+    params = request.query_params.multi_items()
+    
+    # The body is streamed straight through to the MLflow server; only its
+    # first MAX_LOG_BODY_SIZE bytes are kept for logging
+    request_body = None
+    if 'content-length' in request.headers or 'transfer-encoding' in request.headers:
+        request_stream = request.stream()
+        if config.STAGE_TIMERS_ENABLED:
+            request_stream = profiling.timed_stream(request_stream, "read_body")
+        request_body = BodyCapture(
+            request_stream,
+            config.MAX_LOG_BODY_SIZE if config.LOG_REQUEST_BODY else 0
+        )
     
     # Identify MLflow request type
-    request_type = get_mlflow_request_type(path, method)
+    classify_start = time.perf_counter()
+    route = routes.classify(path, method)
+    request_type = route.name
+    if config.STAGE_TIMERS_ENABLED:
+        profiling.record("classify", time.perf_counter() - classify_start)
     
     # Update statistics
-    stats["requests"] += 1
-    stats["request_types"][request_type] = stats["request_types"].get(request_type, 0) + 1
+    stats.record_request(request_type)
+    
+    # Reads are spread over the replicas and writes go to the primary,
+    # unless the client names the server itself
+    target = None
+    original_host = request.headers.get('x-original-host')
+    if original_host is None and balancer.is_enabled():
+        target = balancer.choose(route.read_only)
+    target_url = get_target_url(
+        path, original_host or (target.url if target is not None else config.MLFLOW_SERVER_URL)
+    )
+    # Replicas serve the same data, so balanced requests share cache and
+    # single-flight keys whichever replica they were sent to
+    key_origin = upstream.get_origin(config.MLFLOW_SERVER_URL if target is not None else target_url)
+    
+    # Start the exchange log record; it is written once the response is sent
+    log_start = time.perf_counter()
+    log_record = request_log_record(request) if exchange_log.is_enabled() else None
+    log_time = time.perf_counter() - log_start
+    
+    # Identical read-only GETs get the same upstream response
+    key = None
+    if request_body is None and method == "GET" and route.read_only:
+        key = request_key(method, path, params, key_origin, request.headers)
+    
+    # Answer idempotent reads from the cache; writes drop the cached entries
+    # of the entity they name once they have been sent, which needs the
+    # start of the body
+    cache_key = None
+    if response_cache is not None:
+        if key is not None and response_cache.is_cacheable(method, route):
+            cache_key = key
+            if 'no-cache' not in request.headers.get('cache-control', '').lower():
+                cached = response_cache.get(cache_key)
+                if cached is not None:
+                    return cached_response(
+                        cache_key, cached, method, path, request_type, handler_start, log_record,
+                        request.headers.get('accept-encoding')
+                    )
+            cache_entity = entity_id(route.group, params)
+        elif not route.read_only and request_body is not None:
+            request_body.limit = max(request_body.limit, ENTITY_PREFIX_SIZE)
     
-    # Log the incoming request
-    log_request(request, body)
-    target_url = get_target_url(path, request.headers.get('x-original-host'))
+    # Artifact downloads are served from disk once fetched, and stale copies
+    # are revalidated with the upstream; uploads and deletes drop the cached
+    # copies of their path
+    artifact_key = None
+    stale_artifact = None
+    if artifact_cache is not None:
+        if request_body is None and artifact_cache.is_cacheable(method, route):
+            artifact_key = artifact_cache.make_key(path, params, key_origin, request.headers.get('authorization'))
+            if 'no-cache' not in request.headers.get('cache-control', '').lower():
+                entry = artifact_cache.get(artifact_key)
+                if entry is not None:
+                    if artifact_cache.is_fresh(entry):
+                        return cached_artifact_response(
+                            entry, request, method, path, request_type, handler_start, log_record
+                        )
+                    conditional = entry.conditional_headers()
+                    if conditional:
+                        # The client's own validators are for our ETag, not the upstream's
+                        stale_artifact = entry
+                        headers = {
+                            name: value for name, value in headers.items()
+                            if name.lower() not in ('if-none-match', 'if-modified-since')
+                        }
+                        headers.update(conditional)
+        elif method in ("PUT", "DELETE") and route.endpoint == "artifacts":
+            await artifact_cache.invalidate(path)
+    
+    # Single-item tracking writes are answered now and sent later as one
+    # runs/log-batch call; any other call naming a run waits for the run's
+    # pending writes first, so reads see them and writes stay in order
+    if write_batcher.is_enabled():
+        if method == "POST" and route.endpoint in log_batch.BATCHABLE_ENDPOINTS:
+            body = await request.body()
+            batch_url = log_batch.batch_url(target_url, route.endpoint)
+            if write_batcher.submit(route.endpoint, batch_url, request.headers.get('authorization'), body):
+                if response_cache is not None:
+                    response_cache.invalidate_write(route, params, body)
+                return deferred_write_response(method, path, request_type, handler_start, log_record, body, "batched")
+        if route.group == "runs" and write_batcher.has_pending():
+            run_id = entity_id(route.group, params)
+            if run_id is None and not route.read_only and request_body is not None:
+                # Tracking write bodies are small JSON documents
+                run_id = entity_id(route.group, (), await request.body())
+            if run_id:
+                await write_batcher.flush_run(run_id)
+    
+    # Taken after any flush above, whose invalidation would otherwise
+    # discard this fill
+    if cache_key is not None:
+        cache_generation = response_cache.generation()
+    
+    # Tracking writes that can be spooled are read whole so they can be
+    # replayed; while a backlog is being replayed they queue behind it
+    spool_body = None
+    if spool.is_enabled() and spool.accepts(method, route):
+        spool_body = await request.body()
+        spool_url = f"{target_url}?{request.url.query}" if request.url.query else target_url
+        if spool.has_backlog() and await spool.append(method, spool_url, headers, spool_body, route.endpoint):
+            if response_cache is not None:
+                response_cache.invalidate_write(route, params, spool_body)
+            return deferred_write_response(method, path, request_type, handler_start, log_record, spool_body, "spooled")
+    
+    # Concurrent identical reads share one upstream request; range requests
+    # ask for different bytes of the same URL and are always sent
+    flight_key = None
+    if (config.SINGLE_FLIGHT_ENABLED and key is not None and 'range' not in request.headers
+            and stale_artifact is None):
+        flight_key = key
+    
+    # Idempotent calls may be retried and slow reads hedged; balanced
+    # requests send each retry or hedge to a freshly chosen replica
+    next_url = None
+    if target is not None:
+        next_url = lambda: get_target_url(path, balancer.choose(route.read_only).url)
+    policy = None
+    if retries.is_enabled():
+        policy = retries.policy_for(
+            route, method, request_body is not None, stats.latency_by_type.get(request_type), next_url
+        )
     
     # Make the request to the actual MLflow server
-    start_time = time.time()
+    start_time = time.perf_counter()
     try:
-        response = requests.request(
-            method=method,
-            url=target_url,
-            headers=headers,
-            data=body,
-            params=params,
-            stream=True,  # Important for handling large responses
-            allow_redirects=False  # We will handle redirects manually
-        )
+        coalesced = False
+        if flight_key is not None:
+            response, body, coalesced = await singleflight.send(
+                flight_key, method, target_url, headers=headers, params=params, policy=policy
+            )
+        else:
+            content = request_body
+            if policy is not None and policy.retries > 0 and request_body is not None:
+                # A retried body has to be sent again, so it is read whole first
+                content = await request_body.read()
+            response = await retries.send(
+                method,
+                target_url,
+                headers=headers,
+                params=params,
+                content=content,
+                policy=policy
+            )
+            body = upstream.iter_response(response)
+        
+        # The request body has been sent by now
+        add_request_body_to_record(log_record, request_body)
+        
+        # Reads that raced the write are discarded when they finish
+        if response_cache is not None and not route.read_only:
+            response_cache.invalidate_write(
+                route, params, request_body.captured if request_body is not None else b""
+            )
+        if artifact_cache is not None and method in ("PUT", "DELETE") and route.endpoint == "artifacts":
+            await artifact_cache.invalidate(path)
         
-        # Calculate request duration
-        duration = time.time() - start_time
-        stats["total_request_time"] += duration
-        
-        # Update status code statistics
-        status_code = str(response.status_code)
-        stats["status_codes"][status_code] = stats["status_codes"].get(status_code, 0) + 1
-        
-        # Log the response from MLflow server
-        log_response(response, duration)
-        
-        # Store request in history
-        request_entry = {
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "method": method,
-            "path": path,
-            "type": request_type,
-            "status_code": response.status_code,
-            "duration": round(duration, 3)
-        }
-        stats["last_requests"].insert(0, request_entry)
-        stats["last_requests"] = stats["last_requests"][:100]  # Keep only last 100
+        # The cached copy is still current
+        if stale_artifact is not None and response.status_code == 304:
+            await upstream.discard(response)
+            await artifact_cache.refresh(artifact_key, stale_artifact)
+            return cached_artifact_response(
+                stale_artifact, request, method, path, request_type, handler_start, log_record
+            )
+        
+        # Calculate request duration, and the time spent in the proxy itself
+        duration = time.perf_counter() - start_time
+        overhead = time.perf_counter() - handler_start - duration
+        
+        # Update status code statistics, latency histograms and the request history
+        stats.record_response(method, path, request_type, response.status_code, duration, overhead)
+        request.state.upstream_duration = duration
         
         # Create a FastAPI response from the MLflow server response
-        headers_dict = dict(response.headers)
+        headers_dict = filter_headers(response.headers)
+        
+        # Keep the first bytes of the body for logging while it streams out,
+        # and count the request as finished once the body has been sent.
+        # Cacheable responses are captured whole, up to the entry size limit.
+        capture_limit = config.MAX_LOG_BODY_SIZE if config.LOG_RESPONSE_BODY else 0
+        if cache_key is not None:
+            capture_limit = max(capture_limit, response_cache.max_entry_bytes + 1)
+        
+        def finish(capture):
+            stats.record_finished(body_size(request_body), capture.size)
+            if config.STAGE_TIMERS_ENABLED:
+                profiling.record("stream_out", time.perf_counter() - stream_start)
+            if cache_key is not None and not coalesced:
+                store_cached_response(
+                    cache_key, route.group, cache_entity, cache_generation, response, headers_dict, capture
+                )
+        
+        # Complete artifact downloads are written to disk as they stream out
+        if (artifact_key is not None and method == "GET" and not coalesced
+                and is_cacheable_artifact(request, response, artifact_cache.max_entry_bytes)):
+            body = artifact_cache.tee(body, artifact_key, headers_dict)
         
-        # Return a streaming response
+        response_body = BodyCapture(body, capture_limit, on_complete=finish)
+        
+        # Text and JSON bodies are compressed for clients that accept it; the
+        # capture above still sees the body as the MLflow server sent it
+        content = response_body
+        response_headers = headers_dict
+        encoding = None
+        if compression.is_enabled() and compression.is_compressible(method, response.status_code, response.headers):
+            encoding = compression.negotiate(request.headers.get('accept-encoding'))
+        if encoding is not None:
+            content = compression.compress_stream(response_body, encoding)
+            response_headers = compression.encoded_headers(headers_dict, encoding)
+        
+        # Return a streaming response, logging it once the body has been sent
+        background = None
+        if log_record is not None:
+            if coalesced:
+                log_record["coalesced"] = True
+            background = BackgroundTask(
+                log_streamed_response, log_record, response, duration, response_body, log_time
+            )
+        stream_start = time.perf_counter()
         return StreamingResponse(
-            content=response.iter_content(chunk_size=1024),
+            content=content,
             status_code=response.status_code,
-            headers=headers_dict
+            headers=response_headers,
+            background=background
         )
         
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
+        # Writes that never reached the server are replayed once it is back
+        if spool_body is not None and isinstance(e, spool.UNDELIVERED_ERRORS):
+            if await spool.append(method, spool_url, headers, spool_body, route.endpoint):
+                if response_cache is not None:
+                    response_cache.invalidate_write(route, params, spool_body)
+                return deferred_write_response(method, path, request_type, handler_start, log_record, spool_body, "spooled")
+        
         # Handle any errors during the request
-        stats["errors"] += 1
+        stats.record_error()
         error_message = f"Error proxying to MLflow server: {str(e)}"
         logger.error(error_message)
         
+        if log_record is not None:
+            add_request_body_to_record(log_record, request_body)
+            log_record["error"] = error_message
+            exchange_log.submit(log_record)
+        
+        stats.record_finished(body_size(request_body), 0)
         return JSONResponse(
             content={
                 "error": error_message,
@@ -153,3 +820,7 @@ async def proxy(request: Request, path: str):
             },
             status_code=502  # Bad Gateway
         )
+    except BaseException:
+        # e.g. the client disconnected while its body was being forwarded
+        stats.record_finished(body_size(request_body), 0)
+        raise
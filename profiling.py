@@ -0,0 +1,242 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any
+import config
+from stats import LatencyHistogram
+
+# Request stages timed with STAGE_TIMERS_ENABLED, in the order they happen
+STAGES = (
+    "read_body", "classify", "upstream_connect", "upstream_tls",
+    "upstream_ttfb", "stream_out", "logging"
+)
+
+# httpcore trace events that map to an upstream stage
+_TRACED_STAGES = {
+    "connection.connect_tcp": "upstream_connect",
+    "connection.start_tls": "upstream_tls",
+    "http11.receive_response_headers": "upstream_ttfb",
+    "http2.receive_response_headers": "upstream_ttfb"
+}
+
+_stage_histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in STAGES}
+# Only one sampling profile runs at a time per worker
+_profiling = False
+
+profile_stats: Dict[str, int] = {
+    "profiles": 0,
+    "rejected": 0
+}
+
+def record(stage, seconds):
+    """
+    Add one timing to a stage.
+
+    Callers check STAGE_TIMERS_ENABLED first, so disabled timers cost a
+    single attribute lookup.
+
+    Args:
+        stage (str): One of STAGES
+        seconds (float): The time spent in the stage
+    """
+    _stage_histograms[stage].record(seconds)
+
+async def timed_stream(stream, stage):
+    """
+    Pass a stream through, recording the total time spent waiting for its chunks.
+
+    Args:
+        stream: The async iterator to wrap
+        stage (str): The stage the waiting time is recorded under
+
+    Yields:
+        The items of the stream
+    """
+    waited = 0.0
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                waited += time.perf_counter() - start
+            yield chunk
+    finally:
+        record(stage, waited)
+
+class UpstreamTrace:
+    """
+    An httpx trace callback timing one upstream attempt.
+
+    Reused connections skip the connect and TLS events, so those stages
+    only count attempts that opened a connection.
+    """
+
+    __slots__ = ("started",)
+
+    def __init__(self):
+        self.started = 0.0
+
+    async def __call__(self, event, info):
+        name, _, phase = event.rpartition(".")
+        if phase == "started":
+            self.started = time.perf_counter()
+        elif phase == "complete":
+            stage = _TRACED_STAGES.get(name)
+            if stage is not None:
+                record(stage, time.perf_counter() - self.started)
+
+def upstream_extensions():
+    """
+    Get the httpx request extensions that time an upstream attempt.
+
+    Returns:
+        dict: The extensions, or None when stage timers are disabled
+    """
+    if not config.STAGE_TIMERS_ENABLED:
+        return None
+    return {"trace": UpstreamTrace()}
+
+def _frame_name(frame):
+    """Name a stack frame as function (file:first line), stable across samples."""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _sample(duration, interval, thread_ids):
+    """
+    Sample thread stacks until the duration is up. Runs in its own thread.
+
+    Args:
+        duration (float): Seconds to sample for
+        interval (float): Seconds between samples
+        thread_ids (set): The threads to sample, None for every thread but this one
+
+    Returns:
+        tuple: A Counter of collapsed stacks and the number of sampling rounds
+    """
+    stacks = Counter()
+    own = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    rounds = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or (thread_ids is not None and thread_id not in thread_ids):
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_name(frame))
+                frame = frame.f_back
+            if thread_id not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames.append(names.get(thread_id, str(thread_id)))
+            frames.reverse()
+            stacks[";".join(frames)] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+async def profile(duration, interval, all_threads=False):
+    """
+    Take a time-boxed sampling profile of this worker.
+
+    The stacks are sampled from a separate thread while the event loop
+    keeps serving requests, so the profile shows the worker under its real
+    load. Sampling costs one stack walk per thread every `interval` seconds.
+
+    Args:
+        duration (float): Seconds to sample for, capped at PROFILING_MAX_SECONDS
+        interval (float): Seconds between samples, at least 1 ms
+        all_threads (bool, optional): Also sample worker threads (log writers,
+            to_thread calls) rather than only the event loop thread
+
+    Returns:
+        dict: The collapsed stacks with their sample counts, the number of
+            sampling rounds and the actual duration, or None if a profile is already running
+    """
+    global _profiling
+    if _profiling:
+        profile_stats["rejected"] += 1
+        return None
+    _profiling = True
+    duration = min(max(duration, 0.1), config.PROFILING_MAX_SECONDS)
+    interval = max(interval, 0.001)
+    thread_ids = None if all_threads else {threading.get_ident()}
+    start = time.perf_counter()
+    try:
+        # A dedicated thread, so the default executor's pool is not tied up
+        future = asyncio.get_running_loop().create_future()
+        def run():
+            try:
+                result = _sample(duration, interval, thread_ids)
+            except BaseException as e:
+                future.get_loop().call_soon_threadsafe(future.set_exception, e)
+            else:
+                future.get_loop().call_soon_threadsafe(future.set_result, result)
+        threading.Thread(target=run, name="profiler", daemon=True).start()
+        stacks, rounds = await future
+    finally:
+        _profiling = False
+    profile_stats["profiles"] += 1
+    return {
+        "pid": os.getpid(),
+        "seconds": round(time.perf_counter() - start, 3),
+        "interval": interval,
+        "rounds": rounds,
+        "stacks": stacks
+    }
+
+def collapsed(result):
+    """
+    Format a profile as collapsed stacks, the input of flamegraph.pl and speedscope.
+
+    Args:
+        result (dict): A profile from profile()
+
+    Returns:
+        str: One "frame;frame;frame count" line per distinct stack, most sampled first
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in result["stacks"].most_common())
+
+def top_functions(result, limit=30):
+    """
+    Rank the functions of a profile by the samples they were running in.
+
+    Args:
+        result (dict): A profile from profile()
+        limit (int, optional): How many functions to list
+
+    Returns:
+        list: [function, self samples, total samples] rows, by self samples
+    """
+    own = Counter()
+    total = Counter()
+    for stack, count in result["stacks"].items():
+        frames = stack.split(";")[1:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [[frame, count, total[frame]] for frame, count in own.most_common(limit)]
+
+def get_profiling_stats() -> Dict[str, Any]:
+    """
+    Get stage timers and profiler usage for /api/stats.
+
+    Returns:
+        dict: Latency percentiles per request stage (None when the timers
+            are disabled), profiles taken and whether one is running
+    """
+    return {
+        **profile_stats,
+        "running": _profiling,
+        "stages": {
+            stage: histogram.to_dict() for stage, histogram in _stage_histograms.items()
+        } if config.STAGE_TIMERS_ENABLED else None
+    }
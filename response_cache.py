@@ -0,0 +1,278 @@
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+# Read-only endpoints whose GET responses may be served from the cache
+CACHEABLE_ENDPOINTS = {
+    "experiments/get",
+    "experiments/get-by-name",
+    "runs/get",
+    "registered-models/get",
+    "registered-models/get-latest-versions",
+    "registered-models/alias",
+    "model-versions/get",
+}
+
+# Request fields naming the entity of each family, in query strings and JSON bodies
+ENTITY_FIELDS = {
+    "runs": ("run_id", "run_uuid"),
+    "experiments": ("experiment_id",),
+    "registry": ("name",),
+}
+
+# Writes that create a new entity, which no cached response can describe yet
+CREATE_ENDPOINTS = {"runs/create", "experiments/create", "registered-models/create"}
+
+# Write bodies are scanned for the entity within this prefix; MLflow clients
+# send the ID field first
+ENTITY_PREFIX_SIZE = 4096
+# Works on truncated JSON, so only the body prefix is needed
+_BODY_FIELD = re.compile(rb'"(run_id|run_uuid|experiment_id|name)"\s*:\s*"((?:[^"\\]|\\.){1,512})"')
+
+def entity_id(group, params, body=b""):
+    """
+    Find the entity a request reads or writes.
+
+    Args:
+        group (str): The entity family of the endpoint
+        params (list): Query parameters as (key, value) pairs
+        body (bytes, optional): The request body or its first ENTITY_PREFIX_SIZE bytes
+
+    Returns:
+        str: The run ID, experiment ID or registered model name, or None if
+            the request does not name one
+    """
+    fields = ENTITY_FIELDS.get(group)
+    if fields is None:
+        return None
+    for name, value in params:
+        if name in fields and value:
+            return value
+    if body:
+        for match in _BODY_FIELD.finditer(body):
+            if match.group(1).decode() in fields:
+                try:
+                    return json.loads(b'"' + match.group(2) + b'"')
+                except ValueError:
+                    return None
+    return None
+
+class CacheEntry:
+    """A cached upstream response."""
+
+    __slots__ = ("status_code", "headers", "body", "expires", "group", "entity", "encoded")
+
+    def __init__(self, status_code, headers, body, expires, group, entity):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.group = group
+        # The entity the response describes, None if the request did not name one
+        self.entity = entity
+        # Compressed copies of the body, keyed by content encoding
+        self.encoded: Dict[str, bytes] = {}
+
+    @property
+    def size(self):
+        """The bytes held for the entry: its body and every compressed copy."""
+        return len(self.body) + sum(len(body) for body in self.encoded.values())
+
+class ResponseCache:
+    """
+    In-process TTL and LRU cache for idempotent MLflow reads.
+
+    Entries are indexed by the entity they describe: a run, an experiment
+    or a registered model. A write drops only the entries of the entity it
+    names, found through the index, and stamps the entity with a new
+    generation so fills that started before the write are discarded when
+    they finish. Entries whose request named no entity are dropped by any
+    write to their family, and a write that names no entity drops the
+    whole family.
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes, max_entry_bytes):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        # Cache keys by family, then by entity
+        self._index: Dict[str, Dict[Optional[str], set]] = {}
+        # Incremented by every invalidation; fills remember it when they start
+        self._clock = 0
+        # Generation of the last invalidation of each (family, entity), None
+        # standing for the whole family, least recent first
+        self._stamps: "OrderedDict[tuple, int]" = OrderedDict()
+        # Generation of the last invalidation of anything in each family
+        self._touched: Dict[str, int] = {}
+        # Newest stamp dropped to keep _stamps bounded
+        self._forgotten = 0
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def is_cacheable(self, method, route):
+        """
+        Check whether a request may be answered from the cache.
+
+        Args:
+            method (str): The HTTP method
+            route (routes.Route): The classified MLflow route
+
+        Returns:
+            bool: True for GETs of cacheable read-only endpoints
+        """
+        return method == "GET" and route.read_only and route.endpoint in CACHEABLE_ENDPOINTS
+
+    def get(self, key) -> Optional[CacheEntry]:
+        """
+        Look up a fresh entry.
+
+        Args:
+            key (tuple): The cache key
+
+        Returns:
+            CacheEntry: The entry, or None on a miss
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires < time.monotonic():
+            self._remove(key)
+            self.counters["expired"] += 1
+            entry = None
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry
+
+    def generation(self):
+        """
+        Get the current generation, taken when a fill starts.
+
+        Returns:
+            int: The generation to pass back to store()
+        """
+        return self._clock
+
+    def _changed_since(self, group, entity, generation):
+        """Check whether an entity may have been written since a generation was taken."""
+        if self._forgotten > generation:
+            return True
+        if entity is None:
+            return self._touched.get(group, 0) > generation
+        return (self._stamps.get((group, entity), 0) > generation
+                or self._stamps.get((group, None), 0) > generation)
+
+    def store(self, key, group, entity, generation, status_code, headers, body):
+        """
+        Store a response unless it is too large or its entity changed since the fill started.
+
+        Args:
+            key (tuple): The cache key
+            group (str): The entity family
+            entity (str): The entity the response describes, None if unknown
+            generation (int): The generation from when the fill started
+            status_code (int): The upstream status code
+            headers (dict): The response headers
+            body (bytes): The complete response body
+        """
+        if len(body) > self.max_entry_bytes or self._changed_since(group, entity, generation):
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(status_code, headers, body, time.monotonic() + self.ttl, group, entity)
+        self._index.setdefault(group, {}).setdefault(entity, set()).add(key)
+        self.size += len(body)
+        self.counters["stores"] += 1
+        self._evict()
+
+    def add_encoding(self, key, entry, encoding, body):
+        """
+        Keep a compressed copy of a cached body for later hits that accept the same encoding.
+
+        Args:
+            key (tuple): The cache key
+            entry (CacheEntry): The entry returned by get()
+            encoding (str): The content encoding
+            body (bytes): The body compressed with that encoding
+        """
+        if self._entries.get(key) is not entry or encoding in entry.encoded:
+            return
+        entry.encoded[encoding] = body
+        self.size += len(body)
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is within its limits."""
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.counters["evictions"] += 1
+
+    def invalidate(self, group, entity=None):
+        """
+        Drop the entries a write to an entity may have changed.
+
+        Costs one index lookup per affected entity, however many entries
+        the cache holds.
+
+        Args:
+            group (str): The entity family
+            entity (str, optional): The entity written; None for the whole family
+        """
+        self._clock += 1
+        self._stamp((group, entity))
+        self._touched[group] = self._clock
+        family = self._index.get(group)
+        if family:
+            if entity is None:
+                stale = [key for keys in family.values() for key in keys]
+            else:
+                stale = [*family.get(entity, ()), *family.get(None, ())]
+            for key in stale:
+                self._remove(key)
+        self.counters["invalidations"] += 1
+
+    def invalidate_write(self, route, params, body):
+        """
+        Drop the entries a forwarded write may have changed.
+
+        Args:
+            route (routes.Route): The classified MLflow route
+            params (list): Query parameters as (key, value) pairs
+            body (bytes): The request body or its first ENTITY_PREFIX_SIZE bytes
+        """
+        if route.read_only or route.group not in ENTITY_FIELDS or route.endpoint in CREATE_ENDPOINTS:
+            return
+        self.invalidate(route.group, entity_id(route.group, params, body))
+
+    def _stamp(self, tag):
+        """Record the current generation for a (family, entity), keeping at most max_entries stamps."""
+        self._stamps.pop(tag, None)
+        self._stamps[tag] = self._clock
+        # Fills only live for one upstream call, so old stamps are rarely
+        # needed; fills older than a dropped stamp are treated as stale
+        while len(self._stamps) > max(self.max_entries, 1):
+            _, stamp = self._stamps.popitem(last=False)
+            self._forgotten = max(self._forgotten, stamp)
+
+    def _remove(self, key):
+        """Remove an entry, unindex it and release its size."""
+        entry = self._entries.pop(key)
+        family = self._index[entry.group]
+        keys = family[entry.entity]
+        keys.discard(key)
+        if not keys:
+            del family[entry.entity]
+        self.size -= entry.size
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get cache statistics for /api/stats.
+
+        Returns:
+            dict: Hit/miss/eviction counters, entry count and size in bytes
+        """
+        return {**self.counters, "entries": len(self._entries), "bytes": self.size}
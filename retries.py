@@ -0,0 +1,269 @@
+import asyncio
+import random
+import time
+import httpx
+from typing import Any, Callable, Dict, NamedTuple, Optional
+import config
+import upstream
+import balancer
+import profiling
+from utils import logger
+
+# Failures after which an idempotent request can safely be sent again
+RETRYABLE_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+
+class Policy(NamedTuple):
+    """How one request may be re-sent."""
+    # Attempts allowed after the first one
+    retries: int
+    # Seconds to wait for response headers before hedging, None to never hedge
+    hedge_delay: Optional[float]
+    # Picks the URL for retries and hedges; None to reuse the original URL
+    next_url: Optional[Callable[[], str]]
+
+class RetryBudget:
+    """
+    A token balance that caps retries and hedges at a fraction of requests.
+
+    Each request deposits `ratio` tokens and each retry or hedge withdraws
+    one, so extra traffic stays proportional to real traffic however many
+    upstream calls fail. `min_per_second` tokens a second are added on top
+    so quiet proxies can still retry.
+    """
+
+    __slots__ = ("ratio", "min_per_second", "burst", "balance", "updated")
+
+    def __init__(self, ratio, min_per_second, burst):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.burst = max(burst, 1.0)
+        self.balance = self.burst
+        self.updated = time.monotonic()
+
+    def deposit(self):
+        """Credit the budget for one request."""
+        self.balance = min(self.burst, self.balance + self.ratio)
+
+    def withdraw(self):
+        """
+        Spend one token if the budget has one.
+
+        Returns:
+            bool: True if a retry or hedge may be sent
+        """
+        now = time.monotonic()
+        self.balance = min(self.burst, self.balance + (now - self.updated) * self.min_per_second)
+        self.updated = now
+        if self.balance >= 1.0:
+            self.balance -= 1.0
+            return True
+        return False
+
+_budget = RetryBudget(config.RETRY_BUDGET_RATIO, config.RETRY_BUDGET_MIN_PER_SECOND, config.RETRY_BUDGET_BURST)
+_retry_status_codes = frozenset(config.RETRY_STATUS_CODES)
+_safe_endpoints = frozenset(config.RETRY_SAFE_ENDPOINTS)
+# Losing hedges whose responses are still being closed
+_discarding: set = set()
+
+retry_stats: Dict[str, int] = {
+    "retries": 0,
+    "retries_after_error": 0,
+    "retries_after_status": 0,
+    "retries_exhausted": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "budget_exhausted": 0
+}
+
+def is_enabled():
+    """
+    Check whether upstream requests can be retried or hedged.
+
+    Returns:
+        bool: True if RETRY_MAX_RETRIES is positive or HEDGE_ENABLED is set
+    """
+    return config.RETRY_MAX_RETRIES > 0 or config.HEDGE_ENABLED
+
+def hedge_delay(latency):
+    """
+    Get the time to wait before hedging a request.
+
+    Args:
+        latency (LatencyStats): The latency statistics of the request type, if any
+
+    Returns:
+        float: The HEDGE_PERCENTILE upstream latency clamped to the
+            configured bounds, or None if there are too few samples to hedge
+    """
+    if not config.HEDGE_ENABLED or latency is None:
+        return None
+    histogram = latency.upstream
+    if histogram.count < config.HEDGE_MIN_SAMPLES:
+        return None
+    delay = histogram.percentile(config.HEDGE_PERCENTILE)
+    return min(max(delay, config.HEDGE_MIN_DELAY), config.HEDGE_MAX_DELAY)
+
+def policy_for(route, method, has_body, latency, next_url=None):
+    """
+    Build the re-send policy for a proxied request.
+
+    Args:
+        route (routes.Route): The MLflow route of the request
+        method (str): The HTTP method
+        has_body (bool): Whether the request has a body
+        latency (LatencyStats): The latency statistics of the request type, if any
+        next_url (callable, optional): Picks the URL for retries and hedges
+
+    Returns:
+        Policy: The policy, or None if the request is sent exactly once
+    """
+    if not (route.read_only or route.endpoint in _safe_endpoints):
+        return None
+    # Only body-less GETs are hedged, so nothing has to be buffered for the copy
+    delay = hedge_delay(latency) if method == "GET" and not has_body else None
+    if config.RETRY_MAX_RETRIES <= 0 and delay is None:
+        return None
+    return Policy(config.RETRY_MAX_RETRIES, delay, next_url)
+
+def backoff(retry):
+    """
+    Get the jittered wait before a retry.
+
+    Args:
+        retry (int): The retry number, starting at 1
+
+    Returns:
+        float: A random delay in seconds, up to the exponential backoff for the retry
+    """
+    return random.uniform(0, min(config.RETRY_MAX_BACKOFF, config.RETRY_BASE_BACKOFF * 2 ** (retry - 1)))
+
+def _observe(url, duration, status_code=None):
+    """Report the outcome of one attempt to the load balancer."""
+    if balancer.is_enabled():
+        target = balancer.find(url)
+        if target is not None:
+            balancer.observe(target, duration, status_code)
+
+async def _attempt(method, url, headers, params, content):
+    """Send one attempt upstream and report how it went."""
+    start = time.perf_counter()
+    try:
+        response = await upstream.send(
+            method, url, headers=headers, params=params, content=content,
+            extensions=profiling.upstream_extensions()
+        )
+    except Exception:
+        _observe(url, time.perf_counter() - start)
+        raise
+    _observe(url, time.perf_counter() - start, response.status_code)
+    return response
+
+def _abandon(task):
+    """Cancel a losing attempt and close its response if it already has one."""
+    def close(task):
+        if not task.cancelled() and task.exception() is None:
+            closing = asyncio.get_running_loop().create_task(upstream.discard(task.result()))
+            _discarding.add(closing)
+            closing.add_done_callback(_discarding.discard)
+    task.cancel()
+    task.add_done_callback(close)
+
+async def _hedged(method, url, headers, params, policy):
+    """Send a GET, and a second copy if it is slow; the first response wins."""
+    loop = asyncio.get_running_loop()
+    first = loop.create_task(_attempt(method, url, headers, params, None))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=policy.hedge_delay)
+        if not done:
+            if not _budget.withdraw():
+                retry_stats["budget_exhausted"] += 1
+            else:
+                retry_stats["hedges"] += 1
+                hedge_url = policy.next_url() if policy.next_url is not None else url
+                pending.add(loop.create_task(_attempt(method, hedge_url, headers, params, None)))
+                done = set()
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        retry_stats["hedge_wins"] += 1
+                    # Any other attempt that also finished is closed below
+                    pending |= done - {task}
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            _abandon(task)
+
+def _may_retry(policy, retry):
+    """Check whether retry number `retry` is allowed, spending budget if so."""
+    if retry > policy.retries:
+        retry_stats["retries_exhausted"] += 1
+        return False
+    if not _budget.withdraw():
+        retry_stats["budget_exhausted"] += 1
+        return False
+    return True
+
+async def send(method, url, headers=None, params=None, content=None, policy=None):
+    """
+    Send a request upstream, retrying and hedging it as its policy allows.
+
+    Every attempt is reported to the load balancer. Retries happen only
+    after connection failures, timeouts and RETRY_STATUS_CODES responses,
+    and only while the shared retry budget lasts; when retries run out,
+    the last error is raised or the last response returned.
+
+    Args:
+        method (str): The HTTP method
+        url (str): The complete target URL
+        headers (dict, optional): Headers to forward
+        params (list, optional): Query parameters as (key, value) pairs
+        content (bytes or async iterator, optional): The request body; must
+            be bytes when the policy allows retries
+        policy (Policy, optional): How the request may be re-sent; None to send it once
+
+    Returns:
+        httpx.Response: The upstream response with an open body stream
+    """
+    _budget.deposit()
+    if policy is None:
+        return await _attempt(method, url, headers, params, content)
+    retry = 0
+    while True:
+        try:
+            if retry == 0 and policy.hedge_delay is not None:
+                response = await _hedged(method, url, headers, params, policy)
+            else:
+                response = await _attempt(method, url, headers, params, content)
+        except RETRYABLE_ERRORS as e:
+            if policy.retries <= 0 or not _may_retry(policy, retry + 1):
+                raise
+            retry_stats["retries_after_error"] += 1
+            logger.warning(f"Retrying {method} {url} after {type(e).__name__}: {str(e)}")
+        else:
+            if (policy.retries <= 0 or response.status_code not in _retry_status_codes
+                    or not _may_retry(policy, retry + 1)):
+                return response
+            await upstream.discard(response)
+            retry_stats["retries_after_status"] += 1
+            logger.warning(f"Retrying {method} {url} after a {response.status_code} response")
+        retry += 1
+        retry_stats["retries"] += 1
+        await asyncio.sleep(backoff(retry))
+        if policy.next_url is not None:
+            url = policy.next_url()
+
+def get_retry_stats() -> Dict[str, Any]:
+    """
+    Get retry and hedging statistics for /api/stats.
+
+    Returns:
+        dict: Retry, hedge and budget counts, and the tokens left in the budget
+    """
+    return {**retry_stats, "budget_tokens": round(_budget.balance, 2)}
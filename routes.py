@@ -0,0 +1,181 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple
+import config
+
+class Route(NamedTuple):
+    """An MLflow REST endpoint the proxy knows about."""
+    name: str
+    read_only: bool
+    # The endpoint after the API prefix, e.g. "runs/get"
+    endpoint: str = ""
+    # Entity family the endpoint reads or writes: "runs", "experiments",
+    # "registry" or "artifacts"
+    group: str = ""
+
+# MLflow 2.x REST endpoints as (method, endpoint, name, read_only).
+# The endpoint is the part after api/2.0/mlflow/ (or api/2.0/preview/mlflow/);
+# method "*" matches any method not listed separately.
+MLFLOW_ROUTES = [
+    # Experiments
+    ("*", "experiments/create", "MLflow Tracking: Create Experiment", False),
+    ("*", "experiments/get", "MLflow Tracking: Get Experiment", True),
+    ("*", "experiments/get-by-name", "MLflow Tracking: Get Experiment By Name", True),
+    ("*", "experiments/search", "MLflow Tracking: Search Experiments", True),
+    ("*", "experiments/list", "MLflow Tracking: List Experiments", True),
+    ("*", "experiments/update", "MLflow Tracking: Update Experiment", False),
+    ("*", "experiments/delete", "MLflow Tracking: Delete Experiment", False),
+    ("*", "experiments/restore", "MLflow Tracking: Restore Experiment", False),
+    ("*", "experiments/set-experiment-tag", "MLflow Tracking: Set Experiment Tag", False),
+    ("*", "experiments/delete-experiment-tag", "MLflow Tracking: Delete Experiment Tag", False),
+    # Runs
+    ("*", "runs/create", "MLflow Tracking: Create Run", False),
+    ("*", "runs/get", "MLflow Tracking: Get Run", True),
+    ("*", "runs/update", "MLflow Tracking: Update Run", False),
+    ("*", "runs/delete", "MLflow Tracking: Delete Run", False),
+    ("*", "runs/restore", "MLflow Tracking: Restore Run", False),
+    ("*", "runs/search", "MLflow Tracking: Search Runs", True),
+    ("*", "runs/log-metric", "MLflow Tracking: Log Metric", False),
+    ("*", "runs/log-parameter", "MLflow Tracking: Log Parameter", False),
+    ("*", "runs/log-batch", "MLflow Tracking: Log Batch", False),
+    ("*", "runs/log-model", "MLflow Tracking: Log Model", False),
+    ("*", "runs/log-inputs", "MLflow Tracking: Log Inputs", False),
+    ("*", "runs/set-tag", "MLflow Tracking: Set Tag", False),
+    ("*", "runs/delete-tag", "MLflow Tracking: Delete Tag", False),
+    # Metrics and artifacts
+    ("*", "metrics/get-history", "MLflow Tracking: Get Metric History", True),
+    ("*", "metrics/get-history-bulk-interval", "MLflow Tracking: Get Metric History Bulk", True),
+    ("*", "artifacts/list", "MLflow Tracking: List Artifacts", True),
+    # Registered models
+    ("*", "registered-models/create", "MLflow Registry: Create Model", False),
+    ("*", "registered-models/get", "MLflow Registry: Get Model", True),
+    ("*", "registered-models/rename", "MLflow Registry: Rename Model", False),
+    ("*", "registered-models/update", "MLflow Registry: Update Model", False),
+    ("*", "registered-models/delete", "MLflow Registry: Delete Model", False),
+    ("*", "registered-models/search", "MLflow Registry: Search Models", True),
+    ("*", "registered-models/list", "MLflow Registry: List Models", True),
+    ("*", "registered-models/get-latest-versions", "MLflow Registry: Get Latest Versions", True),
+    ("*", "registered-models/set-tag", "MLflow Registry: Set Model Tag", False),
+    ("*", "registered-models/delete-tag", "MLflow Registry: Delete Model Tag", False),
+    ("GET", "registered-models/alias", "MLflow Registry: Get Model Version By Alias", True),
+    ("POST", "registered-models/alias", "MLflow Registry: Set Model Alias", False),
+    ("DELETE", "registered-models/alias", "MLflow Registry: Delete Model Alias", False),
+    # Model versions
+    ("*", "model-versions/create", "MLflow Registry: Create Model Version", False),
+    ("*", "model-versions/get", "MLflow Registry: Get Model Version", True),
+    ("*", "model-versions/update", "MLflow Registry: Update Model Version", False),
+    ("*", "model-versions/delete", "MLflow Registry: Delete Model Version", False),
+    ("*", "model-versions/search", "MLflow Registry: Search Model Versions", True),
+    ("*", "model-versions/get-download-uri", "MLflow Registry: Get Download URI", True),
+    ("*", "model-versions/transition-stage", "MLflow Registry: Transition Stage", False),
+    ("*", "model-versions/set-tag", "MLflow Registry: Set Model Version Tag", False),
+    ("*", "model-versions/delete-tag", "MLflow Registry: Delete Model Version Tag", False),
+]
+
+# Artifact proxy endpoints under api/2.0/mlflow-artifacts/, keyed by (method, kind)
+ARTIFACT_ROUTES = [
+    ("GET", "artifacts", "MLflow Artifacts: Download Artifact", True),
+    ("HEAD", "artifacts", "MLflow Artifacts: Download Artifact", True),
+    ("PUT", "artifacts", "MLflow Artifacts: Upload Artifact", False),
+    ("DELETE", "artifacts", "MLflow Artifacts: Delete Artifact", False),
+    ("*", "artifacts", "MLflow Artifacts API", False),
+    ("GET", "list", "MLflow Artifacts: List Artifacts", True),
+    ("*", "mpu", "MLflow Artifacts: Multipart Upload", False),
+]
+
+# Entity family of each endpoint prefix; metrics and artifact listings belong to runs
+GROUPS = {
+    "experiments": "experiments",
+    "runs": "runs",
+    "metrics": "runs",
+    "artifacts": "runs",
+    "registered-models": "registry",
+    "model-versions": "registry",
+}
+
+# Top-level artifact downloads served by the tracking server UI handlers
+DOWNLOAD_ROUTES = {
+    "get-artifact": Route("MLflow Tracking: Get Artifact", True, "get-artifact", "artifacts"),
+    "model-versions/get-artifact": Route(
+        "MLflow Registry: Get Model Version Artifact", True, "model-versions/get-artifact", "artifacts"
+    ),
+}
+
+# One compiled pattern for every REST prefix the MLflow server exposes
+_ROUTE_PATTERN = re.compile(
+    r"^(?:ajax-)?api/2\.0/(?:"
+    r"(?:preview/)?mlflow/(?P<endpoint>[a-z-]+/[a-z-]+)"
+    r"|mlflow-artifacts/(?P<artifact_kind>artifacts|mpu)(?P<artifact_path>/.*)?"
+    r")/?$"
+)
+
+_TRACKING_API = Route("MLflow Tracking API", False)
+_ARTIFACTS_API = Route("MLflow Artifacts API", False, group="artifacts")
+_OTHER = Route("Other", False)
+
+def _build_table(routes, group=None):
+    """Index a route list by (method, key)."""
+    return {
+        (method, key): Route(name, read_only, key, group or GROUPS[key.split('/')[0]])
+        for method, key, name, read_only in routes
+    }
+
+_MLFLOW_TABLE = _build_table(MLFLOW_ROUTES)
+_ARTIFACT_TABLE = _build_table(ARTIFACT_ROUTES, group="artifacts")
+
+def _lookup(table, method, key):
+    """Find a route for a method, falling back to the method-independent entry."""
+    return table.get((method, key)) or table.get(("*", key))
+
+@lru_cache(maxsize=config.ROUTE_CACHE_SIZE)
+def classify(path, method):
+    """
+    Identify the MLflow endpoint a request targets.
+
+    Results are memoized per (path, method), so repeated calls to the same
+    endpoint skip the regex match.
+
+    Args:
+        path (str): The request path, without the query string
+        method (str): The HTTP method
+
+    Returns:
+        Route: The matching route, or a generic category that never embeds the path
+    """
+    path = path.lstrip('/')
+    match = _ROUTE_PATTERN.match(path)
+    if match is None:
+        return DOWNLOAD_ROUTES.get(path.rstrip('/'), _OTHER)
+
+    endpoint = match.group("endpoint")
+    if endpoint is not None:
+        route = _lookup(_MLFLOW_TABLE, method, endpoint)
+        if route is not None:
+            return route
+        group = GROUPS.get(endpoint.split('/')[0], "")
+        if group == "registry":
+            return Route("MLflow Registry API", False, endpoint, group)
+        return Route(_TRACKING_API.name, False, endpoint, group)
+
+    kind = match.group("artifact_kind")
+    # A GET on the artifacts root lists a directory rather than downloading a file
+    if kind == "artifacts" and method == "GET" and not (match.group("artifact_path") or "").strip('/'):
+        kind = "list"
+    return _lookup(_ARTIFACT_TABLE, method, kind) or _ARTIFACTS_API
+
+# The proxy's own endpoints: not part of the MLflow workload, so they are
+# never rate limited, captured or kept in the request history
+PROXY_PATHS = {"/", "/health", "/metrics", "/api/profile", "/api/history"}
+PROXY_PREFIXES = ("/static/", "/api/stats")
+
+def is_proxy_endpoint(path):
+    """
+    Check whether a path is one of the proxy's own endpoints.
+
+    Args:
+        path (str): The request path, with its leading slash
+
+    Returns:
+        bool: True for the dashboard, health, metrics and other proxy APIs
+    """
+    return path in PROXY_PATHS or path.startswith(PROXY_PREFIXES)
@@ -1,3 +1,6 @@
 mlflow server --host localhost --port 5001 &
 
 gunicorn -k uvicorn.workers.UvicornWorker --bind localhost:6150 --reload asgi:application
+
+# HTTP/2 listener (h2c, or h2 over TLS with --certfile/--keyfile); uvicorn only speaks HTTP/1.1
+# hypercorn --workers 4 --bind localhost:6150 asgi:application
@@ -3,7 +3,28 @@ from mlflow_proxy import app
 import config
 from utils import logger
 
+def serve_http2():
+    """Serve the app with hypercorn, which speaks HTTP/2 as well as HTTP/1.1."""
+    import asyncio
+    try:
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+    except ImportError:
+        raise SystemExit("HTTP2_ENABLED needs hypercorn; install the http2 extra (pip install hypercorn)")
+
+    server_config = Config()
+    host = config.FASTAPI_HOST.split("://")[-1]
+    server_config.bind = [f"{host}:{config.FASTAPI_PORT}"]
+    if config.TLS_CERTFILE and config.TLS_KEYFILE:
+        # h2 is negotiated through ALPN, with HTTP/1.1 as the fallback
+        server_config.certfile = config.TLS_CERTFILE
+        server_config.keyfile = config.TLS_KEYFILE
+    asyncio.run(serve(app, server_config))
+
 if __name__ == "__main__":
     logger.info(f"Starting MLflow Proxy Server with FastAPI on {config.FASTAPI_HOST}:{config.FASTAPI_PORT}")
     logger.info(f"Proxying requests to MLflow server at: {config.MLFLOW_SERVER_URL}")
-    uvicorn.run(app, host=config.FASTAPI_HOST, port=config.FASTAPI_PORT, reload=True)
\ No newline at end of file
+    if config.HTTP2_ENABLED:
+        serve_http2()
+    else:
+        uvicorn.run(app, host=config.FASTAPI_HOST, port=config.FASTAPI_PORT, reload=True)
@@ -0,0 +1,270 @@
+import os
+import sys
+import mmap
+import time
+import fcntl
+import bisect
+import tempfile
+import multiprocessing
+from typing import Dict, Any, List
+import config
+from stats import STATUS_CLASSES
+from utils import logger
+
+# Upper bounds (seconds) of the shared request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+# Each worker slot is a row of 8-byte fields:
+# pid, started, requests, errors, total_request_time, status classes, histogram.
+# One more row after the worker slots holds the counts of retired slots.
+PID = 0
+STARTED = 1
+REQUESTS = 2
+ERRORS = 3
+TOTAL_REQUEST_TIME = 4
+STATUS_BASE = 5
+HISTOGRAM_BASE = STATUS_BASE + len(STATUS_CLASSES)
+SLOT_FIELDS = HISTOGRAM_BASE + len(LATENCY_BUCKETS)
+SLOT_SIZE = SLOT_FIELDS * 8
+
+def _master_pid():
+    """
+    Get the pid of the process that owns this deployment's workers.
+
+    Gunicorn forks its workers and uvicorn and hypercorn spawn them through
+    multiprocessing, so in those cases the parent is the master. A process
+    serving on its own is its own master: its parent is just whatever
+    started it (a shell, a benchmark, a container init) and may start
+    other proxies too.
+    """
+    if "gunicorn.arbiter" in sys.modules or multiprocessing.parent_process() is not None:
+        return os.getppid()
+    return os.getpid()
+
+def default_path():
+    """
+    Get the default shared stats file path.
+
+    The file is named after the master pid, so every worker of a deployment
+    maps the same file and no two running deployments collide.
+
+    Returns:
+        str: The path of the shared stats file
+    """
+    return os.path.join(tempfile.gettempdir(), f"mlflow-proxy-stats-{_master_pid()}.bin")
+
+def _pid_alive(pid):
+    """Check whether a process with the given pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class SharedStatsSlot:
+    """
+    This worker's row in a memory-mapped statistics file shared by all workers.
+
+    Updates are plain memory writes into the worker's own slot, so the
+    request path never makes a system call or waits on another worker.
+    Readers sum every slot to get cluster-wide totals. A slot taken over
+    from an exited worker has its counts moved to the retired row first,
+    so the totals never go down while the deployment runs.
+    """
+
+    __slots__ = ("path", "max_workers", "index", "_file", "_mmap", "_ints", "_floats", "_base")
+
+    def __init__(self, path, max_workers):
+        self.path = path
+        self.max_workers = max_workers
+        self.index = -1
+        size = SLOT_SIZE * (max_workers + 1)
+        self._file = self._open_locked()
+        try:
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+            self._ints = memoryview(self._mmap).cast("q")
+            self._floats = memoryview(self._mmap).cast("d")
+            self._claim()
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._base = self.index * SLOT_FIELDS
+
+    def _open_locked(self):
+        """
+        Open the stats file and lock it.
+
+        The last worker to exit removes the file, so a file that was
+        unlinked while this worker waited for the lock is opened again.
+        """
+        while True:
+            file = open(self.path, "a+b")
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(file.fileno()).st_ino:
+                    return file
+            except FileNotFoundError:
+                pass
+            file.close()
+
+    def _claim(self):
+        """Take a free slot, or the slot of a worker that has exited."""
+        pid = os.getpid()
+        for index in range(self.max_workers):
+            base = index * SLOT_FIELDS
+            owner = self._ints[base + PID]
+            if owner == pid:
+                self.index = index
+                return
+            if owner == 0 or not _pid_alive(owner):
+                self._retire(index)
+                self._ints[base + PID] = pid
+                self._floats[base + STARTED] = time.time()
+                self.index = index
+                return
+        raise RuntimeError(f"All {self.max_workers} shared stats slots are in use")
+
+    def _retire(self, index):
+        """Move a slot's counts to the retired row and clear the slot. Called with the file locked."""
+        base = index * SLOT_FIELDS
+        retired = self.max_workers * SLOT_FIELDS
+        for field in range(REQUESTS, SLOT_FIELDS):
+            if field == TOTAL_REQUEST_TIME:
+                self._floats[retired + field] += self._floats[base + field]
+            else:
+                self._ints[retired + field] += self._ints[base + field]
+        self._mmap[index * SLOT_SIZE:(index + 1) * SLOT_SIZE] = bytes(SLOT_SIZE)
+
+    def record_request(self):
+        """Count an incoming request."""
+        self._ints[self._base + REQUESTS] += 1
+
+    def record_error(self):
+        """Count a request that could not be proxied."""
+        self._ints[self._base + ERRORS] += 1
+
+    def record_response(self, status_code, duration):
+        """
+        Record a completed upstream call.
+
+        Args:
+            status_code (int): The upstream status code
+            duration (float): The upstream duration in seconds
+        """
+        base = self._base
+        self._floats[base + TOTAL_REQUEST_TIME] += duration
+        status_class = min(max(status_code // 100, 1), 5) - 1
+        self._ints[base + STATUS_BASE + status_class] += 1
+        self._ints[base + HISTOGRAM_BASE + bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def _read_slot(self, index):
+        """Read one slot as a dict."""
+        base = index * SLOT_FIELDS
+        ints = self._ints
+        return {
+            "pid": ints[base + PID],
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._floats[base + STARTED])),
+            "requests": ints[base + REQUESTS],
+            "errors": ints[base + ERRORS],
+            "total_request_time": self._floats[base + TOTAL_REQUEST_TIME],
+            "status_classes": {
+                name: ints[base + STATUS_BASE + offset]
+                for offset, name in enumerate(STATUS_CLASSES)
+            },
+            "latency_histogram": [
+                ints[base + HISTOGRAM_BASE + offset]
+                for offset in range(len(LATENCY_BUCKETS))
+            ]
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Sum every worker slot and the retired row, and list each worker separately.
+
+        Returns:
+            dict: Cluster-wide totals and the per-worker breakdown
+        """
+        workers: List[Dict[str, Any]] = []
+        # Shared, so a slot being retired is never counted twice or not at all
+        fcntl.flock(self._file, fcntl.LOCK_SH)
+        try:
+            for index in range(self.max_workers):
+                # Slots that were never claimed are skipped; released slots still count
+                if self._floats[index * SLOT_FIELDS + STARTED] == 0:
+                    continue
+                worker = self._read_slot(index)
+                worker["alive"] = worker["pid"] != 0 and _pid_alive(worker["pid"])
+                workers.append(worker)
+            counted = workers + [self._read_slot(self.max_workers)]
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+        totals = {
+            "requests": sum(worker["requests"] for worker in counted),
+            "errors": sum(worker["errors"] for worker in counted),
+            "total_request_time": sum(worker["total_request_time"] for worker in counted),
+            "status_classes": {
+                name: sum(worker["status_classes"][name] for worker in counted)
+                for name in STATUS_CLASSES
+            },
+            "latency_histogram": {
+                ("+Inf" if bound == float("inf") else str(bound)):
+                    sum(worker["latency_histogram"][offset] for worker in counted)
+                for offset, bound in enumerate(LATENCY_BUCKETS)
+            }
+        }
+        for worker in workers:
+            del worker["latency_histogram"]
+        return {"totals": totals, "workers": workers}
+
+    def _any_alive(self):
+        """Check whether any slot is owned by a running process."""
+        for index in range(self.max_workers):
+            owner = self._ints[index * SLOT_FIELDS + PID]
+            if owner != 0 and _pid_alive(owner):
+                return True
+        return False
+
+    def close(self):
+        """
+        Release the slot and unmap the file.
+
+        The slot's counters are kept until another worker claims it. The
+        last worker of a deployment to exit removes the file.
+        """
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            if self.index >= 0:
+                self._ints[self._base + PID] = 0
+            if not self._any_alive():
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._ints.release()
+        self._floats.release()
+        self._mmap.close()
+        self._file.close()
+
+def open_slot():
+    """
+    Open the shared stats file and claim a slot for this worker.
+
+    Returns:
+        SharedStatsSlot: The claimed slot, or None if sharing is disabled or unavailable
+    """
+    if not config.SHARED_STATS_ENABLED:
+        return None
+    path = config.SHARED_STATS_FILE or default_path()
+    try:
+        slot = SharedStatsSlot(path, config.SHARED_STATS_MAX_WORKERS)
+    except (OSError, RuntimeError) as e:
+        logger.warning(f"Shared statistics disabled, using per-worker statistics only: {str(e)}")
+        return None
+    logger.info(f"Worker {os.getpid()} using shared stats slot {slot.index} in {path}")
+    return slot
@@ -0,0 +1,199 @@
+import asyncio
+import httpx
+from typing import Dict, Any, AsyncIterator, Tuple
+import config
+import upstream
+import retries
+from utils import logger
+
+class Flight:
+    """An upstream GET in progress that identical requests can join."""
+
+    __slots__ = ("response", "followers")
+
+    def __init__(self):
+        # Resolves to the upstream response, or None if the leader gave up
+        self.response = asyncio.get_running_loop().create_future()
+        # One bounded chunk queue per joined request
+        self.followers = []
+
+# Flights that can still be joined, keyed by utils.request_key()
+_flights: Dict[tuple, Flight] = {}
+
+# Marks the end of a body in a follower's queue
+_END = object()
+
+flight_stats = {
+    "leaders": 0,
+    "followers": 0,
+    "detached": 0,
+    "dropped": 0
+}
+
+async def send(key, method, url, headers=None, params=None, policy=None) -> Tuple[httpx.Response, AsyncIterator[bytes], bool]:
+    """
+    Send a read-only request upstream, or join an identical one already in flight.
+
+    The first request for a key (the leader) is sent as usual. Requests
+    with the same key that arrive before the leader's response headers
+    wait for its response instead of calling the MLflow server.
+    Every chunk the leader streams is handed to each follower through a
+    small bounded queue, so a body is never held in memory in full; the
+    slowest client sets the pace for all of them.
+
+    Args:
+        key (tuple): The request key from utils.request_key()
+        method (str): The HTTP method
+        url (str): The target URL
+        headers (dict, optional): The headers to send
+        params (list, optional): The query parameters as (key, value) pairs
+        policy (retries.Policy, optional): How the leader's request may be retried or hedged
+
+    Returns:
+        tuple: The upstream response, its body iterator, and whether the request joined another
+    """
+    flight = _flights.get(key)
+    if flight is not None:
+        queue = asyncio.Queue(maxsize=config.SINGLE_FLIGHT_QUEUE_SIZE)
+        flight.followers.append(queue)
+        flight_stats["followers"] += 1
+        try:
+            response = await asyncio.shield(flight.response)
+        except BaseException:
+            _leave(flight, queue)
+            raise
+        if response is not None:
+            return response, _follow(flight, queue), True
+        # The leader was cancelled before a response arrived; try again
+        _leave(flight, queue)
+        return await send(key, method, url, headers, params, policy)
+
+    flight = _flights[key] = Flight()
+    flight_stats["leaders"] += 1
+    try:
+        response = await retries.send(method, url, headers=headers, params=params, policy=policy)
+    except Exception as e:
+        _land(key, flight)
+        if flight.followers:
+            flight.response.set_exception(e)
+        else:
+            flight.response.cancel()
+        raise
+    except BaseException:
+        _land(key, flight)
+        flight.response.set_result(None)
+        raise
+    # Requests arriving from now on would miss the start of the body
+    _land(key, flight)
+    flight.response.set_result(response)
+    return response, _lead(flight, response), False
+
+def _land(key, flight):
+    """Stop other requests from joining a flight."""
+    if _flights.get(key) is flight:
+        del _flights[key]
+
+def _leave(flight, queue):
+    """Remove a follower, unblocking the leader if it is waiting on its queue."""
+    if queue in flight.followers:
+        flight.followers.remove(queue)
+    while not queue.empty():
+        queue.get_nowait()
+
+async def _publish(followers, item):
+    """
+    Hand a chunk, the end marker or an error to every follower.
+
+    Waits for followers whose queue is full, but drops any that have not
+    made room within UPSTREAM_READ_TIMEOUT, such as one whose client went
+    away before its body was read, so it cannot stall the others.
+    """
+    full = []
+    for queue in tuple(followers):
+        if queue.full():
+            full.append(queue)
+        else:
+            queue.put_nowait(item)
+    if not full:
+        return
+    results = await asyncio.gather(*(
+        asyncio.wait_for(queue.put(item), config.UPSTREAM_READ_TIMEOUT) for queue in full
+    ), return_exceptions=True)
+    for queue, result in zip(full, results):
+        if isinstance(result, asyncio.TimeoutError):
+            _drop(followers, queue)
+
+def _drop(followers, queue):
+    """Stop handing chunks to a follower that fell behind; it gets an error if it reads on."""
+    if queue in followers:
+        followers.remove(queue)
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(httpx.ReadTimeout("Fell behind a coalesced response"))
+    flight_stats["dropped"] += 1
+
+async def _lead(flight, response):
+    """
+    Stream the leader's body, copying each chunk to the followers.
+
+    If the leader's client goes away mid-body, the rest of the body keeps
+    streaming to the followers in a background task.
+    """
+    followers = flight.followers
+    body = upstream.iter_response(response)
+    try:
+        async for chunk in body:
+            if followers:
+                await _publish(followers, chunk)
+            yield chunk
+    except Exception as e:
+        await _publish(followers, e)
+        raise
+    except BaseException:
+        if followers:
+            flight_stats["detached"] += 1
+            asyncio.create_task(_pump(body, followers))
+        raise
+    else:
+        await _publish(followers, _END)
+
+async def _pump(body, followers):
+    """Finish streaming a body to the followers after the leader left."""
+    try:
+        if body.ag_frame is None:
+            raise httpx.ReadError("Upstream response was interrupted")
+        async for chunk in body:
+            if not followers:
+                break
+            await _publish(followers, chunk)
+    except Exception as e:
+        logger.warning(f"Coalesced response failed: {str(e)}")
+        await _publish(followers, e)
+    else:
+        await _publish(followers, _END)
+    finally:
+        await body.aclose()
+
+async def _follow(flight, queue):
+    """Yield the chunks the leader hands to one follower."""
+    try:
+        while True:
+            # The leader may wait one read timeout on the upstream and another
+            # on a follower it ends up dropping before the next chunk comes
+            item = await asyncio.wait_for(queue.get(), 2 * config.UPSTREAM_READ_TIMEOUT)
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        _leave(flight, queue)
+
+def get_flight_stats() -> Dict[str, Any]:
+    """
+    Get single-flight statistics for /api/stats.
+
+    Returns:
+        dict: Leader, follower, detached and dropped counts, and the flights that can be joined
+    """
+    return {**flight_stats, "in_flight": len(_flights)}
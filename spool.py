@@ -0,0 +1,497 @@
+import os
+import json
+import contextlib
+import fcntl
+import itertools
+import mmap
+import time
+import zlib
+import struct
+import asyncio
+import httpx
+from typing import Dict, Any, List, Optional
+import config
+import upstream
+from log_batch import BATCHABLE_ENDPOINTS, PendingBatch, parse_write, batch_url
+from utils import logger
+
+# Tracking writes that MLflow answers with an empty object, so a spooled
+# call can be acknowledged without the server's response
+SPOOLABLE_ENDPOINTS = {
+    "runs/log-metric",
+    "runs/log-parameter",
+    "runs/log-batch",
+    "runs/log-model",
+    "runs/log-inputs",
+    "runs/set-tag",
+    "runs/delete-tag",
+    "experiments/set-experiment-tag",
+    "experiments/delete-experiment-tag",
+}
+
+# Errors raised before the request could have reached the MLflow server
+UNDELIVERED_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Upstream statuses meaning the server is still unavailable, e.g. from a load balancer
+UNAVAILABLE_STATUSES = {502, 503, 504}
+
+# File header: magic, read offset, write offset
+HEADER = struct.Struct("<8sQQ")
+MAGIC = b"MLFSPOOL"
+# Record header: payload length, CRC32 of the payload, sequence number, metadata length
+RECORD = struct.Struct("<IIQH")
+
+class SpoolFile:
+    """
+    Append-only, memory-mapped queue of requests waiting to be replayed.
+
+    Records are appended at the write offset and consumed from the read
+    offset. The region in between is the backlog. When an append does not
+    fit, the backlog is moved to the start of the file (compaction); the
+    file never grows past its capacity. The offsets live in the file
+    header, so a restarted proxy resumes where it stopped. The file is
+    locked for as long as it is open, so only one process ever uses it.
+
+    Raises:
+        BlockingIOError: If another process has the file open
+    """
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = max(capacity, mmap.PAGESIZE)
+        self.records = 0
+        self.compactions = 0
+        self._next_seq = 0
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, "r+b")
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            raise
+        if os.fstat(fd).st_size < self.capacity:
+            self._file.truncate(self.capacity)
+        self._mmap = mmap.mmap(fd, self.capacity)
+        magic, self._read, self._write = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or not HEADER.size <= self._read <= self._write <= self.capacity:
+            self._read = self._write = HEADER.size
+            self._save_header()
+        self._recover()
+
+    def _save_header(self):
+        """Write the offsets to the file header."""
+        HEADER.pack_into(self._mmap, 0, MAGIC, self._read, self._write)
+
+    def _recover(self):
+        """Count the records of an existing backlog, dropping a torn record at its end."""
+        offset = self._read
+        while offset < self._write:
+            record = self._read_record(offset)
+            if record is None:
+                logger.warning(f"Spool {self.path}: discarding {self._write - offset} unreadable bytes")
+                self._write = offset
+                self._save_header()
+                break
+            self.records += 1
+            self._next_seq = record[1] + 1
+            offset = record[0]
+
+    def _read_record(self, offset):
+        """
+        Decode the record at an offset.
+
+        Returns:
+            tuple: (next offset, seq, metadata, body), or None if the record is incomplete or corrupt
+        """
+        if offset + RECORD.size > self._write:
+            return None
+        length, crc, seq, meta_length = RECORD.unpack_from(self._mmap, offset)
+        start = offset + RECORD.size
+        end = start + length
+        if end > self._write or meta_length > length:
+            return None
+        payload = self._mmap[start:end]
+        if zlib.crc32(payload) != crc:
+            return None
+        return end, seq, json.loads(payload[:meta_length]), payload[meta_length:]
+
+    @property
+    def backlog_bytes(self):
+        """The number of bytes waiting to be replayed."""
+        return self._write - self._read
+
+    def append(self, meta, body):
+        """
+        Append a request to the backlog.
+
+        Args:
+            meta (dict): JSON-serializable request details
+            body (bytes): The request body
+
+        Returns:
+            bool: False if the spool is full
+        """
+        meta_bytes = json.dumps(meta, separators=(",", ":")).encode()
+        payload = meta_bytes + body
+        size = RECORD.size + len(payload)
+        if self._write + size > self.capacity:
+            self.compact()
+            if self._write + size > self.capacity:
+                return False
+        offset = self._write
+        RECORD.pack_into(self._mmap, offset, len(payload), zlib.crc32(payload), self._next_seq, len(meta_bytes))
+        self._mmap[offset + RECORD.size:offset + size] = payload
+        self._next_seq += 1
+        self._write += size
+        self.records += 1
+        self._save_header()
+        if config.SPOOL_FSYNC:
+            # Sync the pages holding the record, then the header that makes it visible
+            start = offset - offset % mmap.PAGESIZE
+            self._mmap.flush(start, self._write - start)
+            self._mmap.flush(0, HEADER.size)
+        return True
+
+    def peek(self, limit) -> List[tuple]:
+        """
+        Read records from the front of the backlog without consuming them.
+
+        Args:
+            limit (int): The maximum number of records
+
+        Returns:
+            list: (seq, metadata, body) tuples, oldest first
+        """
+        records = []
+        offset = self._read
+        while offset < self._write and len(records) < limit:
+            next_offset, seq, meta, body = self._read_record(offset)
+            records.append((seq, meta, body))
+            offset = next_offset
+        return records
+
+    def consume(self, done):
+        """
+        Drop the records at the front of the backlog whose sequence numbers are in done.
+
+        Stops at the first record not in done, so the backlog stays in order.
+
+        Args:
+            done (set): Sequence numbers of replayed records; consumed ones are removed
+
+        Returns:
+            int: The number of records consumed
+        """
+        consumed = 0
+        while self._read < self._write:
+            length, crc, seq, meta_length = RECORD.unpack_from(self._mmap, self._read)
+            if seq not in done:
+                break
+            done.discard(seq)
+            self._read += RECORD.size + length
+            consumed += 1
+        if self._read == self._write:
+            # An empty backlog starts over at the front for free
+            self._read = self._write = HEADER.size
+        self.records -= consumed
+        self._save_header()
+        return consumed
+
+    def compact(self):
+        """
+        Move the backlog to the start of the file to make room at its end.
+
+        Only done when the backlog fits in the space already consumed, so
+        the copy never overwrites records the header still points at and a
+        crash during compaction loses nothing.
+        """
+        backlog = self.backlog_bytes
+        if self._read - HEADER.size < backlog or self._read == HEADER.size:
+            return
+        self._mmap.move(HEADER.size, self._read, backlog)
+        if config.SPOOL_FSYNC:
+            self._mmap.flush()
+        self._read = HEADER.size
+        self._write = HEADER.size + backlog
+        self._save_header()
+        if config.SPOOL_FSYNC:
+            self._mmap.flush(0, HEADER.size)
+        self.compactions += 1
+
+    def close(self):
+        """Flush and unmap the file."""
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+_spool: Optional[SpoolFile] = None
+# Semaphore placeholder for replays that already hold a slot
+_UNLIMITED = contextlib.nullcontext()
+_replayer: Optional[asyncio.Task] = None
+_appended: Optional[asyncio.Event] = None
+# Held while the spool file is read or changed; appends, syncs and
+# compactions run in a worker thread, so the event loop never waits on the disk
+_lock: Optional[asyncio.Lock] = None
+
+spool_stats: Dict[str, Any] = {
+    "spooled_records": 0,
+    "rejected_records": 0,
+    "replayed_records": 0,
+    "failed_records": 0,
+    "replay_records_per_second": 0.0,
+    "last_error": None
+}
+
+def is_enabled():
+    """
+    Check whether tracking writes are spooled during upstream outages.
+
+    Returns:
+        bool: True if the spool is open
+    """
+    return _spool is not None
+
+def accepts(method, route):
+    """
+    Check whether a request can be spooled.
+
+    Args:
+        method (str): The HTTP method
+        route (routes.Route): The classified MLflow route
+
+    Returns:
+        bool: True for POSTs of the tracking writes in SPOOLABLE_ENDPOINTS
+    """
+    return method == "POST" and route.endpoint in SPOOLABLE_ENDPOINTS
+
+def has_backlog():
+    """
+    Check whether spooled requests are still waiting to be replayed.
+
+    New spoolable writes join the backlog while this is true, so they
+    reach the MLflow server after the writes spooled before them.
+
+    Returns:
+        bool: True if the backlog is not empty
+    """
+    return _spool is not None and _spool.records > 0
+
+def _ordering_key(body):
+    """Get the run or experiment a write belongs to; writes with the same key replay in order."""
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    return payload.get("run_id") or payload.get("run_uuid") or payload.get("experiment_id")
+
+async def append(method, url, headers, body, endpoint=""):
+    """
+    Durably queue a write for replay.
+
+    Returns once the write is on disk (synced with SPOOL_FSYNC), so it can
+    be acknowledged; writes are appended in the order this is called.
+
+    Args:
+        method (str): The HTTP method
+        url (str): The complete target URL, including any query string
+        headers (dict): The headers to replay it with
+        body (bytes): The request body
+        endpoint (str, optional): The route endpoint, so single-item writes can be merged on replay
+
+    Returns:
+        bool: True if the write was spooled, False if the spool is full
+    """
+    headers = {key: value for key, value in headers.items() if key.lower() != "content-length"}
+    meta = {"method": method, "url": url, "headers": headers, "endpoint": endpoint, "key": _ordering_key(body)}
+    async with _lock:
+        spooled = await asyncio.to_thread(_spool.append, meta, body)
+    if not spooled:
+        spool_stats["rejected_records"] += 1
+        logger.error(f"Spool is full, rejecting {method} {url}")
+        return False
+    spool_stats["spooled_records"] += 1
+    _appended.set()
+    return True
+
+def _merge_writes(records):
+    """
+    Merge consecutive single-item writes to one run into runs/log-batch calls.
+
+    Args:
+        records (list): (seq, metadata, body) tuples of one run, oldest first
+
+    Yields:
+        tuple: (records, metadata, body) of each request to replay, where
+            records are the spooled records the request covers
+    """
+    batch = None
+    merged = []
+    for record in records:
+        seq, meta, body = record
+        endpoint = meta.get("endpoint")
+        payload = None
+        if endpoint in BATCHABLE_ENDPOINTS and "?" not in meta["url"]:
+            payload = parse_write(endpoint, body)
+        if payload is not None and batch is not None:
+            same_target = (batch_url(meta["url"], endpoint) == batch.url
+                           and meta["headers"].get("authorization") == batch.headers.get("authorization"))
+            if same_target and batch.accepts(endpoint, payload) and not batch.is_full():
+                batch.add(endpoint, payload)
+                merged.append(record)
+                continue
+        if merged:
+            yield _merged_request(batch, merged)
+            batch, merged = None, []
+        if payload is None:
+            yield [record], meta, body
+            continue
+        batch = PendingBatch(batch_url(meta["url"], endpoint), meta["headers"], payload["run_id"])
+        batch.add(endpoint, payload)
+        merged.append(record)
+    if merged:
+        yield _merged_request(batch, merged)
+
+def _merged_request(batch, records):
+    """Build the replay request for the records merged into a batch."""
+    if len(records) == 1:
+        return records, records[0][1], records[0][2]
+    return records, {"method": "POST", "url": batch.url, "headers": batch.headers}, batch.to_json()
+
+async def _replay_one(meta, body):
+    """
+    Replay one request.
+
+    Returns:
+        int: The upstream status code, or None if the server is still unavailable
+    """
+    try:
+        response = await upstream.send(meta["method"], meta["url"], headers=meta["headers"], content=body)
+        response_body = await upstream.read_response(response)
+    except httpx.HTTPError as e:
+        spool_stats["last_error"] = f"{meta['method']} {meta['url']}: {str(e)}"
+        return None
+    if response.status_code in UNAVAILABLE_STATUSES:
+        spool_stats["last_error"] = f"{meta['method']} {meta['url']}: HTTP {response.status_code}"
+        return None
+    if response.status_code >= 400:
+        spool_stats["last_error"] = (
+            f"{meta['method']} {meta['url']}: HTTP {response.status_code} "
+            f"{response_body[:500].decode('utf-8', errors='replace')}"
+        )
+    return response.status_code
+
+async def _replay_group(records, done, semaphore, merge=True):
+    """Replay the records of one run in order, stopping at the first that cannot be delivered."""
+    if merge:
+        requests = _merge_writes(records)
+    else:
+        requests = (([record], record[1], record[2]) for record in records)
+    async with semaphore:
+        for covered, meta, body in requests:
+            status = await _replay_one(meta, body)
+            if status is None:
+                return False
+            if status >= 400 and len(covered) > 1:
+                # One bad write fails the whole batch; replay them one by one instead
+                if not await _replay_group(covered, done, _UNLIMITED, merge=False):
+                    return False
+                continue
+            if status >= 400:
+                # The server rejected the write; replaying it again would not help
+                spool_stats["failed_records"] += 1
+                logger.error(f"Spooled write rejected by MLflow server: {spool_stats['last_error']}")
+            else:
+                spool_stats["replayed_records"] += len(covered)
+            done.update(seq for seq, meta, body in covered)
+    return True
+
+async def _replay():
+    """Replay the backlog until cancelled, waiting while the server is unavailable."""
+    done = set()
+    semaphore = asyncio.Semaphore(config.SPOOL_REPLAY_CONCURRENCY)
+    while True:
+        if _spool.records == 0:
+            _appended.clear()
+            await _appended.wait()
+            continue
+        started = time.perf_counter()
+        groups: Dict[Any, list] = {}
+        async with _lock:
+            records = _spool.peek(config.SPOOL_REPLAY_BATCH)
+        for seq, meta, body in records:
+            if seq not in done:
+                groups.setdefault(meta.get("key"), []).append((seq, meta, body))
+        results = await asyncio.gather(*(
+            _replay_group(records, done, semaphore) for records in groups.values()
+        ))
+        async with _lock:
+            consumed = _spool.consume(done)
+        elapsed = time.perf_counter() - started
+        if consumed and elapsed > 0:
+            spool_stats["replay_records_per_second"] = round(consumed / elapsed, 1)
+        if not all(results):
+            logger.warning(f"MLflow server unavailable, {_spool.records} spooled writes waiting")
+            await asyncio.sleep(config.SPOOL_RETRY_INTERVAL)
+
+def _open():
+    """
+    Open the first spool file no other worker holds: SPOOL_FILE, then SPOOL_FILE.1, .2 and so on.
+
+    A restarted worker takes over the file of the worker it replaces,
+    backlog included.
+
+    Returns:
+        SpoolFile: The open spool
+    """
+    for index in itertools.count():
+        path = config.SPOOL_FILE if index == 0 else f"{config.SPOOL_FILE}.{index}"
+        try:
+            return SpoolFile(path, config.SPOOL_MAX_BYTES)
+        except BlockingIOError:
+            continue
+
+async def startup():
+    """Open a spool file, if configured, and start replaying its backlog."""
+    global _spool, _replayer, _appended, _lock
+    if not config.SPOOL_FILE:
+        return
+    try:
+        _spool = await asyncio.to_thread(_open)
+    except (OSError, ValueError) as e:
+        logger.error(f"Write spool disabled, could not open {config.SPOOL_FILE}: {str(e)}")
+        return
+    if _spool.records:
+        logger.info(f"Replaying {_spool.records} spooled writes from {_spool.path}")
+    _appended = asyncio.Event()
+    _lock = asyncio.Lock()
+    _replayer = asyncio.get_running_loop().create_task(_replay())
+
+async def shutdown():
+    """Stop replaying and close the spool; its backlog is replayed on the next start."""
+    global _spool, _replayer
+    if _replayer is not None:
+        _replayer.cancel()
+        _replayer = None
+    if _spool is not None:
+        # Waits for an append in progress, so it is not cut off by the close
+        async with _lock:
+            await asyncio.to_thread(_spool.close)
+            _spool = None
+
+def get_spool_stats():
+    """
+    Get spool statistics for /api/stats.
+
+    Returns:
+        dict: The spool file, backlog depth and size, spooled/replayed/failed counts and the replay rate
+    """
+    return {
+        **spool_stats,
+        "file": _spool.path,
+        "backlog_records": _spool.records,
+        "backlog_bytes": _spool.backlog_bytes,
+        "capacity_bytes": _spool.capacity,
+        "compactions": _spool.compactions
+    }
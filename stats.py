@@ -0,0 +1,402 @@
+import math
+import time
+from array import array
+from typing import Dict, Any
+
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+# Latency histogram buckets grow geometrically by 5% from 10 microseconds,
+# giving percentiles within 5% relative error up to about 1000 seconds
+HISTOGRAM_MIN = 1e-5
+HISTOGRAM_GROWTH = 1.05
+HISTOGRAM_BUCKETS = int(math.log(1e3 / HISTOGRAM_MIN) / math.log(HISTOGRAM_GROWTH)) + 2
+_INV_LOG_GROWTH = 1 / math.log(HISTOGRAM_GROWTH)
+_INV_MIN = 1 / HISTOGRAM_MIN
+_log = math.log
+
+# Status class names indexed by status_code // 100
+_STATUS_CLASS_BY_HUNDRED = ("1xx",) + STATUS_CLASSES + ("5xx",) * 4
+
+class RequestEntry:
+    """A single proxied request kept in the recent requests history."""
+
+    __slots__ = ("timestamp", "method", "path", "type", "status_code", "duration")
+
+    def __init__(self):
+        self.timestamp = 0.0
+        self.method = ""
+        self.path = ""
+        self.type = ""
+        self.status_code = 0
+        self.duration = 0.0
+
+    def to_dict(self):
+        """
+        Convert the entry to the /api/stats JSON shape.
+
+        Returns:
+            dict: The entry with a formatted timestamp
+        """
+        return {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.timestamp)),
+            "method": self.method,
+            "path": self.path,
+            "type": self.type,
+            "status_code": self.status_code,
+            "duration": round(self.duration, 3)
+        }
+
+class LatencyHistogram:
+    """
+    Log-scale latency histogram with fixed, preallocated buckets.
+
+    Recording computes the bucket index directly from the value, so it is
+    O(1) and never grows the histogram. Percentiles are read by walking the
+    buckets, which only happens when statistics are requested.
+    """
+
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = array("q", bytes(8 * HISTOGRAM_BUCKETS))
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self):
+        """The number of recorded observations."""
+        return sum(self.counts)
+
+    def record(self, seconds):
+        """
+        Add one observation.
+
+        Args:
+            seconds (float): The latency in seconds
+        """
+        index = int(_log(seconds * _INV_MIN) * _INV_LOG_GROWTH) + 1 if seconds > HISTOGRAM_MIN else 0
+        if index >= HISTOGRAM_BUCKETS:
+            index = HISTOGRAM_BUCKETS - 1
+        self.counts[index] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        """
+        Get an upper bound for the pct-th percentile.
+
+        Args:
+            pct (float): The percentile, between 0 and 100
+
+        Returns:
+            float: The latency in seconds, or 0 when nothing was recorded
+        """
+        count = self.count
+        if count == 0:
+            return 0.0
+        rank = max(1, math.ceil(count * pct / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                upper = HISTOGRAM_MIN * HISTOGRAM_GROWTH ** index
+                return min(upper, self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Summarize the histogram in milliseconds.
+
+        Returns:
+            dict: Count, mean, p50/p95/p99 and max latencies
+        """
+        count = self.count
+        mean = self.total / count if count else 0.0
+        return {
+            "count": count,
+            "mean_ms": round(mean * 1000, 3),
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+class LatencyStats:
+    """Upstream and proxy overhead latency histograms for one category of requests."""
+
+    __slots__ = ("upstream", "overhead")
+
+    def __init__(self):
+        self.upstream = LatencyHistogram()
+        self.overhead = LatencyHistogram()
+
+    def record(self, upstream, overhead):
+        """
+        Record one request.
+
+        Args:
+            upstream (float): Time spent waiting on the MLflow server, in seconds
+            overhead (float): Time spent in the proxy itself, in seconds
+        """
+        self.upstream.record(upstream)
+        self.overhead.record(overhead)
+
+    def to_dict(self):
+        """Summarize both histograms."""
+        return {"upstream": self.upstream.to_dict(), "overhead": self.overhead.to_dict()}
+
+class BoundedCounter:
+    """
+    Counter that tracks at most max_keys distinct keys.
+
+    Once the cap is reached, new keys are counted under other_key so the
+    counter cannot grow without bound.
+    """
+
+    __slots__ = ("counts", "max_keys", "other_key")
+
+    def __init__(self, max_keys, other_key="other"):
+        self.counts: Dict[str, int] = {}
+        self.max_keys = max_keys
+        self.other_key = other_key
+
+    def add(self, key, amount=1):
+        """
+        Add to the count for a key.
+
+        Args:
+            key (str): The key to count
+            amount (int, optional): How much to add
+        """
+        counts = self.counts
+        if key in counts:
+            counts[key] += amount
+        elif len(counts) < self.max_keys:
+            counts[key] = amount
+        else:
+            counts[self.other_key] = counts.get(self.other_key, 0) + amount
+
+    def to_dict(self):
+        """Return a copy of the counts."""
+        return dict(self.counts)
+
+class ProxyStats:
+    """
+    Fixed-memory statistics for the proxy.
+
+    Recent requests live in a preallocated ring buffer whose entries are
+    overwritten in place, so recording a request allocates nothing beyond
+    the values stored. All updates happen on the event loop thread and
+    need no locking.
+
+    When a shared stats slot is attached, counters are also written to it
+    so totals can be aggregated across gunicorn workers.
+    """
+
+    __slots__ = (
+        "requests", "errors", "total_request_time", "in_flight", "request_bytes", "response_bytes",
+        "request_types", "status_codes", "latency_by_type", "latency_by_status_class",
+        "max_request_types", "shared", "recorded", "_history", "_next", "_filled"
+    )
+
+    def __init__(self, history_size=100, max_request_types=64, max_status_codes=32):
+        self.requests = 0
+        self.errors = 0
+        self.total_request_time = 0.0
+        self.in_flight = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.request_types = BoundedCounter(max_request_types)
+        self.status_codes = BoundedCounter(max_status_codes)
+        self.latency_by_type: Dict[str, LatencyStats] = {}
+        self.latency_by_status_class = {name: LatencyStats() for name in STATUS_CLASSES}
+        self.max_request_types = max_request_types
+        self.shared = None
+        # Total number of history entries ever written, used as a sequence number
+        self.recorded = 0
+        self._history = [RequestEntry() for _ in range(history_size)]
+        self._next = 0
+        self._filled = 0
+
+    def record_request(self, request_type):
+        """
+        Count an incoming request.
+
+        Args:
+            request_type (str): The MLflow request type
+        """
+        self.requests += 1
+        self.in_flight += 1
+        self.request_types.add(request_type)
+        if self.shared is not None:
+            self.shared.record_request()
+
+    def _latency_for_type(self, request_type):
+        """Get the latency stats for a request type, pooling types past the cap under "other"."""
+        latency = self.latency_by_type.get(request_type)
+        if latency is None:
+            if len(self.latency_by_type) >= self.max_request_types:
+                request_type = self.request_types.other_key
+                latency = self.latency_by_type.get(request_type)
+            if latency is None:
+                latency = self.latency_by_type[request_type] = LatencyStats()
+        return latency
+
+    def record_response(self, method, path, request_type, status_code, duration, overhead=0.0):
+        """
+        Record a completed upstream call in the counters, histograms and history.
+
+        Args:
+            method (str): The HTTP method
+            path (str): The request path
+            request_type (str): The MLflow request type
+            status_code (int): The upstream status code
+            duration (float): The upstream duration in seconds
+            overhead (float, optional): Time spent in the proxy itself, in seconds
+        """
+        self.total_request_time += duration
+        self.status_codes.add(str(status_code))
+        latency = self.latency_by_type.get(request_type) or self._latency_for_type(request_type)
+        latency.upstream.record(duration)
+        latency.overhead.record(overhead)
+        latency = self.latency_by_status_class[_STATUS_CLASS_BY_HUNDRED[status_code // 100]]
+        latency.upstream.record(duration)
+        latency.overhead.record(overhead)
+        if self.shared is not None:
+            self.shared.record_response(status_code, duration)
+
+        history = self._history
+        if not history:
+            return
+        entry = history[self._next]
+        entry.timestamp = time.time()
+        entry.method = method
+        entry.path = path
+        entry.type = request_type
+        entry.status_code = status_code
+        entry.duration = duration
+        self._next = (self._next + 1) % len(history)
+        self.recorded += 1
+        if self._filled < len(history):
+            self._filled += 1
+
+    def record_finished(self, request_bytes, response_bytes):
+        """
+        Mark a request as no longer in flight and count the bytes it streamed.
+
+        Args:
+            request_bytes (int): Request body bytes forwarded upstream
+            response_bytes (int): Response body bytes sent to the client
+        """
+        self.in_flight -= 1
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+
+    def record_error(self):
+        """Count a request that could not be proxied."""
+        self.errors += 1
+        if self.shared is not None:
+            self.shared.record_error()
+
+    def last_requests(self):
+        """
+        Get the recent requests, newest first.
+
+        Returns:
+            list: The recent requests as dicts
+        """
+        history = self._history
+        size = len(history)
+        return [
+            history[(self._next - offset) % size].to_dict()
+            for offset in range(1, self._filled + 1)
+        ]
+
+    def requests_since(self, seq):
+        """
+        Get the recent requests recorded after a sequence number, newest first.
+
+        Args:
+            seq (int): A previous value of `recorded`
+
+        Returns:
+            list: The new entries as dicts; entries already overwritten in the ring buffer are skipped
+        """
+        history = self._history
+        size = len(history)
+        count = min(self.recorded - seq, self._filled)
+        return [
+            history[(self._next - offset) % size].to_dict()
+            for offset in range(1, count + 1)
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Get the counters the dashboard charts show, without the request history.
+
+        Requests and errors are cluster totals when a shared slot is attached.
+
+        Returns:
+            dict: Request and error totals, request type and status code
+                counts, upstream p50/p95/p99 by request type and the proxy overhead p99
+        """
+        requests, errors = self.requests, self.errors
+        if self.shared is not None:
+            totals = self.shared.snapshot()["totals"]
+            requests, errors = totals["requests"], totals["errors"]
+        return {
+            "requests": requests,
+            "errors": errors,
+            "request_types": self.request_types.to_dict(),
+            "status_codes": self.status_codes.to_dict(),
+            "latency": {
+                request_type: [
+                    round(latency.upstream.percentile(pct) * 1000, 3) for pct in (50, 95, 99)
+                ]
+                for request_type, latency in self.latency_by_type.items()
+            },
+            "overhead_p99": round(max(
+                latency.overhead.percentile(99) for latency in self.latency_by_status_class.values()
+            ) * 1000, 3)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the statistics in the /api/stats JSON shape.
+
+        With a shared slot attached, requests, errors and total_request_time
+        are totals across all workers, and "cluster" holds the per-worker
+        breakdown. The other fields describe the worker that answered.
+
+        Returns:
+            dict: Counters and the recent requests history
+        """
+        snapshot = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "total_request_time": self.total_request_time,
+            "in_flight": self.in_flight,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "request_types": self.request_types.to_dict(),
+            "status_codes": self.status_codes.to_dict(),
+            "last_requests": self.last_requests(),
+            "latency": {
+                "by_type": {
+                    request_type: latency.to_dict()
+                    for request_type, latency in self.latency_by_type.items()
+                },
+                "by_status_class": {
+                    status_class: latency.to_dict()
+                    for status_class, latency in self.latency_by_status_class.items()
+                    if latency.upstream.count
+                }
+            }
+        }
+        if self.shared is not None:
+            cluster = self.shared.snapshot()
+            for key in ("requests", "errors", "total_request_time"):
+                snapshot[key] = cluster["totals"][key]
+            snapshot["cluster"] = cluster
+        return snapshot
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import time
+from typing import Dict, Any, AsyncIterator, Optional
+import config
+from utils import logger
+
+# The ProxyStats instance being streamed, set by startup()
+_stats = None
+_broadcaster: Optional[asyncio.Task] = None
+# One bounded queue of encoded events per open stream
+_subscribers: set = set()
+# The dashboard view and history sequence the last delta was computed against
+_view: Dict[str, Any] = {}
+_seq = 0
+# The encoded snapshot event for new subscribers, rebuilt after every change
+_snapshot_event: Optional[bytes] = None
+
+stream_stats: Dict[str, int] = {
+    "connections": 0,
+    "rejected": 0,
+    "dropped_slow": 0,
+    "snapshots": 0,
+    "deltas": 0,
+    "events_sent": 0
+}
+
+def encode_event(event, data):
+    """
+    Encode one Server-Sent Event.
+
+    Args:
+        event (str): The event name
+        data: A JSON-serializable payload
+
+    Returns:
+        bytes: The event frame, ready to write to every stream
+    """
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+def diff_view(old, new):
+    """
+    Compute the changes between two dashboard views.
+
+    Top-level values are compared as a whole, except dicts, whose changed
+    keys are sent on their own. Values are absolute, so applying the same
+    delta twice is harmless.
+
+    Args:
+        old (dict): The previous view from ProxyStats.summary()
+        new (dict): The current view
+
+    Returns:
+        dict: The changed values; empty if nothing changed
+    """
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict):
+            previous = previous or {}
+            changed = {name: item for name, item in value.items() if previous.get(name) != item}
+            if changed:
+                delta[key] = changed
+        elif value != previous:
+            delta[key] = value
+    return delta
+
+def _get_snapshot_event():
+    """Get the snapshot event a new subscriber starts from, building it if needed."""
+    global _snapshot_event
+    if _snapshot_event is None:
+        _snapshot_event = encode_event("snapshot", {
+            **_stats.summary(),
+            "last_requests": _stats.last_requests(),
+            "history_size": config.STATS_HISTORY_SIZE,
+            "seq": _stats.recorded
+        })
+    stream_stats["snapshots"] += 1
+    return _snapshot_event
+
+def _close(queue):
+    """Drop a subscriber and end its stream."""
+    _subscribers.discard(queue)
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+def _publish(event):
+    """Hand one encoded event to every subscriber, disconnecting those that fell behind."""
+    for queue in list(_subscribers):
+        if queue.full():
+            # The browser reconnects and starts over from a fresh snapshot
+            _close(queue)
+            stream_stats["dropped_slow"] += 1
+        else:
+            queue.put_nowait(event)
+            stream_stats["events_sent"] += 1
+
+def _tick():
+    """Compute one delta against the last view and publish it if anything changed."""
+    global _view, _seq, _snapshot_event
+    view = _stats.summary()
+    delta = diff_view(_view, view)
+    new_requests = _stats.requests_since(_seq)
+    if new_requests:
+        delta["new_requests"] = new_requests
+    if delta:
+        # Clients skip entries at or below the sequence they already have
+        delta["seq"] = _stats.recorded
+        _publish(encode_event("delta", delta))
+        stream_stats["deltas"] += 1
+        _snapshot_event = None
+    _view, _seq = view, _stats.recorded
+
+async def _broadcast():
+    """Compute and publish deltas every STATS_STREAM_INTERVAL seconds until cancelled."""
+    global _snapshot_event
+    while True:
+        await asyncio.sleep(config.STATS_STREAM_INTERVAL)
+        if not _subscribers:
+            # Nothing is computed while no dashboard is open
+            _snapshot_event = None
+            continue
+        try:
+            _tick()
+        except Exception as e:
+            logger.error(f"Failed to compute stats stream delta: {str(e)}")
+
+def subscribe():
+    """
+    Open a stream for one dashboard.
+
+    Returns:
+        asyncio.Queue: The subscriber's event queue, starting with a snapshot,
+            or None if STATS_STREAM_MAX_SUBSCRIBERS streams are already open
+    """
+    if len(_subscribers) >= config.STATS_STREAM_MAX_SUBSCRIBERS:
+        stream_stats["rejected"] += 1
+        return None
+    if not _subscribers:
+        # The view went stale while nobody was listening
+        _tick()
+    queue = asyncio.Queue(maxsize=config.STATS_STREAM_QUEUE_SIZE)
+    queue.put_nowait(_get_snapshot_event())
+    _subscribers.add(queue)
+    stream_stats["connections"] += 1
+    stream_stats["events_sent"] += 1
+    return queue
+
+async def events(queue) -> AsyncIterator[bytes]:
+    """
+    Write a subscriber's events, with heartbeats while idle.
+
+    Args:
+        queue (asyncio.Queue): A queue returned by subscribe()
+
+    Yields:
+        bytes: SSE frames
+    """
+    deadline = time.monotonic() + config.STATS_STREAM_MAX_AGE
+    try:
+        # Reconnect quickly after the stream ends on purpose
+        yield b"retry: 1000\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(queue.get(), min(config.STATS_STREAM_HEARTBEAT, remaining))
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            yield event
+    finally:
+        _subscribers.discard(queue)
+
+async def startup(stats):
+    """
+    Start the broadcaster.
+
+    Args:
+        stats (ProxyStats): The statistics to stream
+    """
+    global _stats, _broadcaster
+    _stats = stats
+    _broadcaster = asyncio.get_running_loop().create_task(_broadcast())
+
+async def shutdown():
+    """Stop the broadcaster and end every open stream."""
+    global _broadcaster
+    if _broadcaster is not None:
+        _broadcaster.cancel()
+        _broadcaster = None
+    for queue in list(_subscribers):
+        _close(queue)
+
+def get_stream_stats() -> Dict[str, Any]:
+    """
+    Get dashboard stream statistics for /api/stats.
+
+    Returns:
+        dict: Open and total connections, events sent and slow subscribers dropped
+    """
+    return {**stream_stats, "subscribers": len(_subscribers)}
@@ -0,0 +1,179 @@
+import asyncio
+import json
+from collections import OrderedDict, deque
+import pytest
+import admission
+import config
+from admission import TokenBucket, parse_endpoint_limits
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(admission, "_endpoint_buckets", {})
+    monkeypatch.setattr(admission, "_client_buckets", OrderedDict())
+    monkeypatch.setattr(admission, "_in_flight", 0)
+    monkeypatch.setattr(admission, "_waiters", deque())
+    monkeypatch.setattr(admission, "admission_stats", dict.fromkeys(admission.admission_stats, 0))
+    monkeypatch.setattr(config, "ADMISSION_MAX_IN_FLIGHT", 0)
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_RATE", 0.0)
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2.0, burst=3)
+    now = bucket.updated
+    assert [bucket.take(now) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.5) == 0.0
+    # Never more than the burst, however long it was idle
+    now += 100
+    assert [bucket.take(now) for _ in range(4)][-1] > 0
+
+def test_parse_endpoint_limits():
+    assert parse_endpoint_limits("runs/search=5, /runs/log-batch/=10:20,,bad,x=0,y=abc") == {
+        "runs/search": (5.0, 5.0),
+        "runs/log-batch": (10.0, 20.0)
+    }
+
+def test_client_id():
+    scope = {"headers": [(b"x-forwarded-for", b"10.0.0.1, 10.0.0.2")], "client": ("127.0.0.1", 5000)}
+    assert admission.client_id(scope) == "10.0.0.1"
+    assert admission.client_id({"headers": [], "client": ("127.0.0.1", 5000)}) == "127.0.0.1"
+    assert admission.client_id({"headers": [], "client": None}) == ""
+
+def test_client_rate_limit_is_per_client(monkeypatch):
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_RATE", 1.0)
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_BURST", 2.0)
+    assert admission.check_rate("a", "runs/get") == (None, 0.0)
+    assert admission.check_rate("a", "runs/get") == (None, 0.0)
+    limit, wait = admission.check_rate("a", "runs/get")
+    assert limit == "client_rate" and 0 < wait <= 1.0
+    assert admission.check_rate("b", "runs/get") == (None, 0.0)
+
+def test_least_recently_seen_client_is_forgotten(monkeypatch):
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_RATE", 1.0)
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_BURST", 1.0)
+    monkeypatch.setattr(config, "RATE_LIMIT_MAX_CLIENTS", 2)
+    admission.check_rate("a", "runs/get")
+    admission.check_rate("b", "runs/get")
+    admission.check_rate("a", "runs/get")
+    admission.check_rate("c", "runs/get")
+    assert list(admission._client_buckets) == ["a", "c"]
+
+def test_endpoint_rate_limit(monkeypatch):
+    monkeypatch.setattr(admission, "_endpoint_buckets", {"runs/search": TokenBucket(1.0, 1.0)})
+    assert admission.check_rate("a", "runs/search") == (None, 0.0)
+    assert admission.check_rate("b", "runs/search")[0] == "endpoint_rate"
+    assert admission.check_rate("b", "runs/get") == (None, 0.0)
+
+def test_waiters_get_slots_in_arrival_order(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(config, "ADMISSION_QUEUE_SIZE", 2)
+    monkeypatch.setattr(config, "ADMISSION_QUEUE_TIMEOUT", 5.0)
+
+    async def scenario():
+        admitted = []
+
+        async def request(name):
+            result = await admission.acquire()
+            admitted.append((name, result))
+
+        assert await admission.acquire() is None
+        tasks = [asyncio.create_task(request(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        assert await admission.acquire() == "queue_full"
+        admission.release()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert admitted == [("first", None)]
+        admission.release()
+        await asyncio.gather(*tasks)
+        admission.release()
+        return admitted
+
+    assert asyncio.run(scenario()) == [("first", None), ("second", None)]
+    assert admission._in_flight == 0
+    assert admission.admission_stats["queued"] == 2
+
+def test_queue_timeout_and_cancelled_waiters_give_their_place_back(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(config, "ADMISSION_QUEUE_SIZE", 10)
+    monkeypatch.setattr(config, "ADMISSION_QUEUE_TIMEOUT", 0.01)
+
+    async def scenario():
+        await admission.acquire()
+        assert await admission.acquire() == "queue_timeout"
+        waiting = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert not admission._waiters
+        admission.release()
+
+    asyncio.run(scenario())
+    assert admission._in_flight == 0
+
+async def call(app, path, client="10.0.0.1"):
+    """Send a GET through an ASGI app, returning its status and response headers."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"",
+             "headers": [], "client": (client, 5000)}
+    await app(scope, receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"]), sent[1].get("body", b"")
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+def test_middleware_sheds_with_retry_after(monkeypatch):
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_RATE", 0.5)
+    monkeypatch.setattr(config, "RATE_LIMIT_CLIENT_BURST", 1.0)
+    shed = []
+    app = admission.AdmissionMiddleware(ok_app, on_shed=lambda *args: shed.append(args))
+
+    async def scenario():
+        first = await call(app, "/api/2.0/mlflow/runs/get")
+        second = await call(app, "/api/2.0/mlflow/runs/get")
+        # The dashboard is never shed
+        health = await call(app, "/health")
+        return first, second, health
+
+    first, second, health = asyncio.run(scenario())
+    assert first[0] == 200 and health[0] == 200
+    status, headers, body = second
+    assert status == 429
+    assert headers[b"retry-after"] == b"2"
+    assert json.loads(body) == {"error": "Rate limit exceeded (client rate)"}
+    assert shed == [("GET", "api/2.0/mlflow/runs/get", "MLflow Tracking: Get Run", 429)]
+
+def test_middleware_holds_the_slot_until_the_response_is_sent(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(config, "ADMISSION_QUEUE_SIZE", 0)
+    app_state = {}
+
+    async def slow_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await app_state["done"].wait()
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    app = admission.AdmissionMiddleware(slow_app)
+
+    async def scenario():
+        app_state["done"] = asyncio.Event()
+        first = asyncio.create_task(call(app, "/api/2.0/mlflow/artifacts/get"))
+        await asyncio.sleep(0)
+        second = await call(app, "/api/2.0/mlflow/runs/get")
+        app_state["done"].set()
+        await first
+        third = await call(app, "/api/2.0/mlflow/runs/get")
+        return second, third
+
+    second, third = asyncio.run(scenario())
+    assert second[0] == 503
+    assert third[0] == 200
+    assert admission.admission_stats["rejected_queue_full"] == 1
+    assert admission._in_flight == 0
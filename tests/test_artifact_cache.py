@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import os
+from artifact_cache import ArtifactCache
+
+KEY = ArtifactCache.make_key("/get-artifact", [("path", "model.pkl"), ("run_uuid", "a")], "http://mlflow")
+
+def make_cache(directory, **overrides):
+    settings = {"max_bytes": 1 << 20, "max_entry_bytes": 1 << 16, "ttl": 300.0}
+    settings.update(overrides)
+    return ArtifactCache(str(directory), **settings)
+
+async def fill(cache, key, body):
+    async def stream():
+        yield body
+    async for _ in cache.tee(stream(), key, {"content-type": "application/octet-stream"}):
+        pass
+
+def write(path, content=b"data"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+def test_entries_survive_a_restart(tmp_path):
+    async def scenario():
+        cache = make_cache(tmp_path)
+        await fill(cache, KEY, b"weights")
+        # No save(): the journal alone has to be enough after a crash
+        if cache._background:
+            await asyncio.wait(list(cache._background))
+
+    asyncio.run(scenario())
+    cache = make_cache(tmp_path)
+    cache.load()
+    entry = cache.get(KEY)
+    assert entry is not None
+    assert entry.digest == hashlib.sha256(b"weights").hexdigest()
+    with open(cache.blob_path(entry.digest), "rb") as blob:
+        assert blob.read() == b"weights"
+
+def test_load_only_deletes_files_the_cache_created(tmp_path):
+    asyncio.run(fill(make_cache(tmp_path), KEY, b"weights"))
+    kept = hashlib.sha256(b"weights").hexdigest()
+    orphan = hashlib.sha256(b"orphan").hexdigest()
+    stale_fill = tmp_path / "tmp" / ("0" * 32)
+    foreign = [
+        tmp_path / "notes.txt",
+        tmp_path / "other" / "data.bin",
+        tmp_path / "other" / "tmp" / "keep.txt",
+        tmp_path / "blobs" / "README",
+        tmp_path / "blobs" / "zz" / "user-file",
+        tmp_path / "blobs" / orphan[:2] / "user-file",
+        tmp_path / "tmp" / "keep.txt",
+    ]
+    for path in foreign + [stale_fill]:
+        write(str(path))
+    write(str(tmp_path / "blobs" / orphan[:2] / orphan))
+
+    cache = make_cache(tmp_path)
+    cache.load()
+    assert all(path.exists() for path in foreign)
+    assert not stale_fill.exists()
+    assert not os.path.exists(cache.blob_path(orphan))
+    assert os.path.exists(cache.blob_path(kept))
+    assert cache.get(KEY) is not None
+
+def test_entry_without_blob_is_dropped_on_load(tmp_path):
+    asyncio.run(fill(make_cache(tmp_path), KEY, b"weights"))
+    os.unlink(make_cache(tmp_path).blob_path(hashlib.sha256(b"weights").hexdigest()))
+    cache = make_cache(tmp_path)
+    cache.load()
+    assert cache.get(KEY) is None
+    assert cache.snapshot()["entries"] == 0
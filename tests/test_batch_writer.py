@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from batch_writer import BatchWriter
+
+def make_writer(write_batch, queue_size=100, batch_size=10, drop_oldest=False):
+    stats = {"queued_records": 0, "written_records": 0, "dropped_records": 0, "batches": 0}
+    return BatchWriter("test", write_batch, stats, queue_size, batch_size, drop_oldest), stats
+
+def test_records_are_written_in_batches():
+    written = []
+
+    async def scenario():
+        writer, stats = make_writer(written.append, batch_size=4)
+        for record in range(10):
+            writer.submit(record)
+        writer.start()
+        await writer.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert [len(batch) for batch in written] == [4, 4, 2]
+    assert sum(written, []) == list(range(10))
+    assert (stats["written_records"], stats["batches"]) == (10, 3)
+
+def test_full_queue_drops_new_or_oldest_records():
+    async def scenario(drop_oldest):
+        writer, stats = make_writer(lambda batch: None, queue_size=2, drop_oldest=drop_oldest)
+        for record in range(3):
+            writer.submit(record)
+        return list(writer.queue._queue), stats["dropped_records"]
+
+    assert asyncio.run(scenario(False)) == ([0, 1], 1)
+    assert asyncio.run(scenario(True)) == ([1, 2], 1)
+
+def test_stop_waits_for_the_batch_being_written():
+    release = threading.Event()
+    finished = []
+
+    def slow_write(batch):
+        release.wait(5)
+        finished.extend(batch)
+
+    async def scenario():
+        writer, stats = make_writer(slow_write, batch_size=1)
+        writer.start()
+        writer.submit("first")
+        await asyncio.sleep(0.01)
+        writer.submit("second")
+        stopping = asyncio.create_task(writer.stop())
+        await asyncio.sleep(0.01)
+        assert not stopping.done()
+        release.set()
+        await stopping
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert finished == ["first", "second"]
+    assert stats["written_records"] == 2
+
+def test_failed_batches_are_counted_as_dropped():
+    def failing_write(batch):
+        raise OSError("disk full")
+
+    async def scenario():
+        writer, stats = make_writer(failing_write)
+        writer.start()
+        writer.submit(1)
+        writer.submit(2)
+        await writer.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert (stats["written_records"], stats["dropped_records"]) == (0, 2)
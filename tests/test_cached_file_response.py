@@ -0,0 +1,37 @@
+import asyncio
+import pytest
+from mlflow_proxy import CachedFileResponse
+
+@pytest.fixture
+def blob(tmp_path):
+    path = tmp_path / "blob"
+    path.write_bytes(b"0123456789")
+    return path
+
+def serve(blob, method="GET", range_header=None):
+    sent = []
+    messages = []
+    headers = [(b"range", range_header.encode())] if range_header else []
+    scope = {"type": "http", "method": method, "headers": headers, "asgi": {"spec_version": "2.4"}}
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    response = CachedFileResponse(blob, {}, lambda status, size: sent.append((status, size)))
+    asyncio.run(response(scope, receive, send))
+    assert messages[0]["status"] == sent[0][0]
+    return sent
+
+def test_full_body_is_recorded_as_200(blob):
+    assert serve(blob) == [(200, 10)]
+    assert serve(blob, method="HEAD") == [(200, 0)]
+
+def test_satisfiable_range_is_recorded_as_206(blob):
+    assert serve(blob, range_header="bytes=2-5") == [(206, 4)]
+
+def test_unsatisfiable_range_is_not_recorded_as_partial(blob):
+    assert serve(blob, range_header="bytes=50-60") == [(416, 0)]
+    assert serve(blob, range_header="items=0-1")[0][0] == 400
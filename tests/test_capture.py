@@ -0,0 +1,62 @@
+import asyncio
+import json
+import pytest
+import capture
+import config
+from batch_writer import BatchWriter
+from urllib.parse import parse_qsl
+
+def test_sanitize_query_keeps_only_mlflow_values():
+    query = "run_id=r1&X-Amz-Signature=abc&access_token=secret&path=model%2Fmodel.pkl&flag"
+    assert parse_qsl(capture.sanitize_query(query), keep_blank_values=True) == [
+        ("run_id", "r1"), ("X-Amz-Signature", ""), ("access_token", ""), ("path", "model/model.pkl"), ("flag", "")
+    ]
+    assert capture.sanitize_query("") == ""
+
+@pytest.fixture
+def capture_file(tmp_path, monkeypatch):
+    path = tmp_path / "capture.jsonl"
+    monkeypatch.setattr(config, "CAPTURE_FILE", str(path))
+    monkeypatch.setattr(config, "CAPTURE_BODIES", False)
+    stats = dict.fromkeys(capture.capture_stats, 0)
+    monkeypatch.setattr(capture, "capture_stats", stats)
+    monkeypatch.setattr(capture, "_writer", BatchWriter(
+        "capture", capture._write_batch, stats, 100, 10, queued_stat="captured_records"
+    ))
+    return path
+
+async def ok_app(scope, receive, send):
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+async def call(app, path, query_string=b"", headers=()):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app({"type": "http", "method": "GET", "path": path, "query_string": query_string,
+               "headers": list(headers)}, receive, send)
+
+def test_records_hold_no_credentials(capture_file):
+    app = capture.CaptureMiddleware(ok_app)
+
+    async def scenario():
+        await capture.startup()
+        await call(app, "/api/2.0/mlflow/runs/get", b"run_id=r1&token=secret", [
+            (b"authorization", b"Bearer secret"), (b"cookie", b"session=secret"),
+            (b"content-type", b"application/json")
+        ])
+        # The proxy's own endpoints are not part of the workload
+        await call(app, "/api/stats")
+        await capture.shutdown()
+
+    asyncio.run(scenario())
+    lines = capture_file.read_text().splitlines()
+    assert len(lines) == 1
+    assert "secret" not in lines[0]
+    record = json.loads(lines[0])
+    assert (record["path"], record["query"], record["status"]) == ("/api/2.0/mlflow/runs/get", "run_id=r1&token=", 200)
+    assert record["content_type"] == "application/json"
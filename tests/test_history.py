@@ -0,0 +1,141 @@
+import asyncio
+import time
+import pytest
+import config
+import history
+from batch_writer import BatchWriter
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_DB", str(tmp_path / "history.db"))
+    monkeypatch.setattr(config, "HISTORY_COMPACT_INTERVAL", 3600.0)
+    stats = dict.fromkeys(history.history_stats, 0)
+    monkeypatch.setattr(history, "history_stats", stats)
+    monkeypatch.setattr(history, "_writer", BatchWriter("request history", history._write_batch, stats, 1000, 100))
+    return stats
+
+# Recent enough to be inside the default retention
+BASE = time.time() - 3600
+
+def record(ts, path="api/2.0/mlflow/runs/get", method="GET", status=200, client="10.0.0.1",
+           query_string="", body=b""):
+    request_type = "MLflow Tracking: Get Run" if path.endswith("runs/get") else "MLflow Tracking: Log Metric"
+    return (ts, method, path, request_type, status, 1.5, 1.0, client, query_string, body, len(body), 10)
+
+def run(records, scenario):
+    """Write records to a fresh history database, then run scenario() against it."""
+    async def main():
+        await history.startup()
+        # Let the compaction run at startup finish on the empty database first
+        await asyncio.sleep(0)
+        await history._compaction
+        try:
+            for item in records:
+                history.submit(item)
+            # Stopping the writer writes everything queued
+            await history._writer.stop()
+            return await scenario()
+        finally:
+            await history.shutdown()
+    return asyncio.run(main())
+
+def test_extract_ids():
+    assert history._extract_ids("run_id=r1&experiment_id=e1", b"") == ("r1", "e1")
+    assert history._extract_ids("", b'{"run_uuid": "r2", "key": "m"}') == ("r2", None)
+    assert history._extract_ids("", b'{"experiment_ids": ["e3", "e4"], "filter"') == (None, "e3")
+    assert history._extract_ids("run_id=r1", b'{"run_id": "other"}') == ("r1", None)
+
+def test_pages_cover_every_row_once_newest_first(db):
+    # Several rows share a timestamp, so the cursor has to break ties by id
+    records = [record(BASE + index // 3) for index in range(25)]
+
+    async def scenario():
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            page = await history.query({}, cursor, limit=4)
+            pages += 1
+            seen.extend((item["ts"], item["id"]) for item in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return seen, pages
+
+    seen, pages = run(records, scenario)
+    assert pages == 7
+    assert len(seen) == len(set(seen)) == 25
+    assert seen == sorted(seen, reverse=True)
+    assert db["written_records"] == 25
+
+def test_last_full_page_has_no_next_cursor(db):
+    async def scenario():
+        return await history.query({}, limit=3)
+
+    page = run([record(BASE + index) for index in range(3)], scenario)
+    assert len(page["items"]) == 3
+    assert page["next_cursor"] is None
+
+def test_filters(db):
+    records = [
+        record(BASE, query_string="run_id=r1"),
+        record(BASE + 1, path="api/2.0/mlflow/runs/log-metric", method="POST", status=400,
+               body=b'{"run_id": "r1", "key": "loss"}'),
+        record(BASE + 2, query_string="run_id=r2", client="10.0.0.2"),
+        record(BASE + 3, status=503, query_string="experiment_id=e1"),
+    ]
+
+    async def scenario():
+        async def timestamps(**filters):
+            page = await history.query(filters)
+            return [item["ts"] for item in page["items"]]
+        return {
+            "run": await timestamps(run_id="r1"),
+            "type": await timestamps(type="MLflow Tracking: Log Metric"),
+            "errors": await timestamps(min_status=400),
+            "client": await timestamps(client="10.0.0.2"),
+            "experiment": await timestamps(experiment_id="e1"),
+            "window": await timestamps(since=BASE + 1, until=BASE + 3),
+            "combined": await timestamps(run_id="r1", method="GET"),
+        }
+
+    assert run(records, scenario) == {
+        "run": [BASE + 1, BASE],
+        "type": [BASE + 1],
+        "errors": [BASE + 3, BASE + 1],
+        "client": [BASE + 2],
+        "experiment": [BASE + 3],
+        "window": [BASE + 2, BASE + 1],
+        "combined": [BASE],
+    }
+
+def test_page_size_is_capped(db, monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_MAX_PAGE_SIZE", 2)
+
+    async def scenario():
+        return await history.query({}, limit=100)
+
+    page = run([record(BASE + index) for index in range(5)], scenario)
+    assert len(page["items"]) == 2
+    assert page["next_cursor"] is not None
+
+def test_malformed_cursor(db):
+    async def scenario():
+        with pytest.raises(ValueError):
+            await history.query({}, "not-a-cursor")
+
+    run([], scenario)
+
+def test_compaction_applies_retention_and_row_cap(db, monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_RETENTION_DAYS", 1)
+    monkeypatch.setattr(config, "HISTORY_MAX_ROWS", 3)
+    now = time.time()
+    records = [record(now - 2 * 86400)] + [record(now - index) for index in range(5, 0, -1)]
+
+    async def scenario():
+        deleted = await asyncio.to_thread(history.compact)
+        page = await history.query({})
+        return deleted, [item["ts"] for item in page["items"]]
+
+    deleted, kept = run(records, scenario)
+    assert deleted == 3
+    assert kept == [now - 1, now - 2, now - 3]
@@ -0,0 +1,150 @@
+import time
+import routes
+from response_cache import ResponseCache, entity_id
+
+RUN_GET = routes.classify("/api/2.0/mlflow/runs/get", "GET")
+LOG_METRIC = routes.classify("/api/2.0/mlflow/runs/log-metric", "POST")
+CREATE_RUN = routes.classify("/api/2.0/mlflow/runs/create", "POST")
+UPDATE_EXPERIMENT = routes.classify("/api/2.0/mlflow/experiments/update", "POST")
+
+def make_cache(**overrides):
+    settings = {"ttl": 60.0, "max_entries": 100, "max_bytes": 1 << 20, "max_entry_bytes": 1 << 16}
+    settings.update(overrides)
+    return ResponseCache(**settings)
+
+def fill(cache, run_id, body=b'{"run": {}}', group="runs"):
+    key = ("GET", "api/2.0/mlflow/runs/get", (("run_id", run_id),))
+    cache.store(key, group, run_id, cache.generation(), 200, {}, body)
+    return key
+
+def test_entity_id_from_query_and_body():
+    assert entity_id("runs", [("run_id", "abc")]) == "abc"
+    assert entity_id("runs", [("run_uuid", "abc")]) == "abc"
+    assert entity_id("runs", [], b'{"run_id": "abc", "key": "loss"}') == "abc"
+    assert entity_id("experiments", [], b'{"experiment_id":"7","new_name":"x"}') == "7"
+    assert entity_id("registry", [], '{"name": "caf\\u00e9"}'.encode()) == "café"
+    # Only the family's own fields count
+    assert entity_id("runs", [], b'{"experiment_id": "7"}') is None
+    assert entity_id("artifacts", [("run_id", "abc")]) is None
+
+def test_entity_id_on_truncated_body():
+    body = b'{"run_id": "abc", "metrics": [' + b'{"key": "m", "value": 1},' * 1000
+    assert entity_id("runs", [], body[:4096]) == "abc"
+
+def test_hit_and_expiry():
+    cache = make_cache(ttl=0.05)
+    key = fill(cache, "a")
+    assert cache.get(key).body == b'{"run": {}}'
+    time.sleep(0.06)
+    assert cache.get(key) is None
+    assert cache.counters["expired"] == 1
+
+def test_write_drops_only_its_run():
+    cache = make_cache()
+    a = fill(cache, "a")
+    b = fill(cache, "b")
+    cache.invalidate_write(LOG_METRIC, [], b'{"run_id": "a", "key": "loss", "value": 1}')
+    assert cache.get(a) is None
+    assert cache.get(b) is not None
+
+def test_write_without_entity_drops_the_family():
+    cache = make_cache()
+    a = fill(cache, "a")
+    b = fill(cache, "b")
+    cache.invalidate_write(LOG_METRIC, [], b'{"key": "loss"}')
+    assert cache.get(a) is None
+    assert cache.get(b) is None
+
+def test_entries_without_entity_are_dropped_by_any_write_to_their_family():
+    cache = make_cache()
+    by_name = ("GET", "api/2.0/mlflow/experiments/get-by-name", (("experiment_name", "e"),))
+    cache.store(by_name, "experiments", None, cache.generation(), 200, {}, b"{}")
+    run = fill(cache, "a")
+    cache.invalidate_write(UPDATE_EXPERIMENT, [], b'{"experiment_id": "7", "new_name": "f"}')
+    assert cache.get(by_name) is None
+    assert cache.get(run) is not None
+
+def test_create_and_other_families_do_not_invalidate():
+    cache = make_cache()
+    a = fill(cache, "a")
+    cache.invalidate_write(CREATE_RUN, [], b'{"experiment_id": "1"}')
+    cache.invalidate_write(UPDATE_EXPERIMENT, [], b'{"experiment_id": "1"}')
+    assert cache.get(a) is not None
+    assert cache.counters["invalidations"] == 1
+
+def test_fill_that_raced_a_write_is_discarded():
+    cache = make_cache()
+    key = ("GET", "api/2.0/mlflow/runs/get", (("run_id", "a"),))
+    generation = cache.generation()
+    cache.invalidate("runs", "a")
+    cache.store(key, "runs", "a", generation, 200, {}, b"{}")
+    assert cache.get(key) is None
+    # A write to another run does not discard it
+    generation = cache.generation()
+    cache.invalidate("runs", "b")
+    cache.store(key, "runs", "a", generation, 200, {}, b"{}")
+    assert cache.get(key) is not None
+
+def test_forgotten_stamps_make_older_fills_stale():
+    cache = make_cache(max_entries=2)
+    key = ("GET", "api/2.0/mlflow/runs/get", (("run_id", "a"),))
+    generation = cache.generation()
+    for run_id in ("a", "b", "c"):
+        cache.invalidate("runs", run_id)
+    cache.store(key, "runs", "a", generation, 200, {}, b"{}")
+    assert cache.get(key) is None
+
+def test_lru_eviction_by_count_and_size():
+    cache = make_cache(max_entries=2)
+    a = fill(cache, "a")
+    b = fill(cache, "b")
+    cache.get(a)
+    fill(cache, "c")
+    assert cache.get(b) is None
+    assert cache.get(a) is not None
+
+    cache = make_cache(max_bytes=10)
+    a = fill(cache, "a", b"x" * 6)
+    fill(cache, "b", b"y" * 6)
+    assert cache.get(a) is None
+    assert cache.snapshot()["bytes"] == 6
+
+def test_oversized_bodies_are_not_stored():
+    cache = make_cache(max_entry_bytes=4)
+    key = fill(cache, "a", b"too large")
+    assert cache.get(key) is None
+
+def test_index_is_cleaned_up():
+    cache = make_cache()
+    fill(cache, "a")
+    cache.invalidate("runs", "a")
+    assert cache._index["runs"] == {}
+    assert cache.snapshot()["entries"] == 0
+
+def test_compressed_copies_are_kept_and_accounted():
+    cache = make_cache()
+    key = fill(cache, "a", b"x" * 100)
+    entry = cache.get(key)
+    cache.add_encoding(key, entry, "gzip", b"g" * 10)
+    cache.add_encoding(key, entry, "gzip", b"other")
+    assert cache.get(key).encoded == {"gzip": b"g" * 10}
+    assert cache.snapshot()["bytes"] == 110
+    cache.invalidate("runs", "a")
+    assert cache.snapshot()["bytes"] == 0
+
+def test_compressed_copy_of_a_replaced_entry_is_ignored():
+    cache = make_cache()
+    key = fill(cache, "a")
+    stale = cache.get(key)
+    fill(cache, "a", b"newer")
+    cache.add_encoding(key, stale, "gzip", b"g")
+    assert cache.get(key).encoded == {}
+    assert cache.snapshot()["bytes"] == len(b"newer")
+
+def test_compressed_copies_count_towards_the_size_limit():
+    cache = make_cache(max_bytes=100)
+    a = fill(cache, "a", b"x" * 40)
+    b = fill(cache, "b", b"y" * 40)
+    cache.add_encoding(b, cache.get(b), "br", b"z" * 30)
+    assert cache.get(a) is None
+    assert cache.get(b) is not None
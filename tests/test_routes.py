@@ -0,0 +1,80 @@
+import pytest
+import routes
+
+# Paths as the MLflow clients and UI send them, with the classification
+# each should get: (method, path, name, read_only, group)
+CASES = [
+    ("POST", "/api/2.0/mlflow/experiments/create", "MLflow Tracking: Create Experiment", False, "experiments"),
+    ("GET", "/api/2.0/mlflow/experiments/get", "MLflow Tracking: Get Experiment", True, "experiments"),
+    ("GET", "/api/2.0/mlflow/experiments/get-by-name", "MLflow Tracking: Get Experiment By Name", True, "experiments"),
+    ("POST", "/api/2.0/mlflow/experiments/search", "MLflow Tracking: Search Experiments", True, "experiments"),
+    ("POST", "/api/2.0/mlflow/experiments/delete", "MLflow Tracking: Delete Experiment", False, "experiments"),
+    ("POST", "/api/2.0/mlflow/runs/create", "MLflow Tracking: Create Run", False, "runs"),
+    ("GET", "/api/2.0/mlflow/runs/get", "MLflow Tracking: Get Run", True, "runs"),
+    ("POST", "/api/2.0/mlflow/runs/update", "MLflow Tracking: Update Run", False, "runs"),
+    ("POST", "/api/2.0/mlflow/runs/search", "MLflow Tracking: Search Runs", True, "runs"),
+    ("POST", "/api/2.0/mlflow/runs/log-metric", "MLflow Tracking: Log Metric", False, "runs"),
+    ("POST", "/api/2.0/mlflow/runs/log-parameter", "MLflow Tracking: Log Parameter", False, "runs"),
+    ("POST", "/api/2.0/mlflow/runs/log-batch", "MLflow Tracking: Log Batch", False, "runs"),
+    ("POST", "/api/2.0/mlflow/runs/set-tag", "MLflow Tracking: Set Tag", False, "runs"),
+    ("GET", "/api/2.0/mlflow/metrics/get-history", "MLflow Tracking: Get Metric History", True, "runs"),
+    ("GET", "/api/2.0/mlflow/artifacts/list", "MLflow Tracking: List Artifacts", True, "runs"),
+    # The UI goes through ajax-api, older clients through preview
+    ("POST", "/ajax-api/2.0/mlflow/runs/search", "MLflow Tracking: Search Runs", True, "runs"),
+    ("GET", "/api/2.0/preview/mlflow/registered-models/get", "MLflow Registry: Get Model", True, "registry"),
+    ("POST", "/api/2.0/mlflow/registered-models/create", "MLflow Registry: Create Model", False, "registry"),
+    ("GET", "/api/2.0/mlflow/registered-models/get-latest-versions",
+     "MLflow Registry: Get Latest Versions", True, "registry"),
+    # One endpoint, three operations told apart by the method
+    ("GET", "/api/2.0/mlflow/registered-models/alias", "MLflow Registry: Get Model Version By Alias", True, "registry"),
+    ("POST", "/api/2.0/mlflow/registered-models/alias", "MLflow Registry: Set Model Alias", False, "registry"),
+    ("DELETE", "/api/2.0/mlflow/registered-models/alias", "MLflow Registry: Delete Model Alias", False, "registry"),
+    ("POST", "/api/2.0/mlflow/model-versions/create", "MLflow Registry: Create Model Version", False, "registry"),
+    ("GET", "/api/2.0/mlflow/model-versions/get-download-uri", "MLflow Registry: Get Download URI", True, "registry"),
+    ("POST", "/api/2.0/mlflow/model-versions/transition-stage",
+     "MLflow Registry: Transition Stage", False, "registry"),
+    ("GET", "/api/2.0/mlflow-artifacts/artifacts/1/abc/artifacts/model/model.pkl",
+     "MLflow Artifacts: Download Artifact", True, "artifacts"),
+    ("HEAD", "/api/2.0/mlflow-artifacts/artifacts/1/abc/artifacts/model/model.pkl",
+     "MLflow Artifacts: Download Artifact", True, "artifacts"),
+    ("PUT", "/api/2.0/mlflow-artifacts/artifacts/1/abc/artifacts/model/model.pkl",
+     "MLflow Artifacts: Upload Artifact", False, "artifacts"),
+    ("DELETE", "/api/2.0/mlflow-artifacts/artifacts/1/abc/artifacts/model",
+     "MLflow Artifacts: Delete Artifact", False, "artifacts"),
+    ("GET", "/api/2.0/mlflow-artifacts/artifacts", "MLflow Artifacts: List Artifacts", True, "artifacts"),
+    ("GET", "/api/2.0/mlflow-artifacts/artifacts/", "MLflow Artifacts: List Artifacts", True, "artifacts"),
+    ("POST", "/api/2.0/mlflow-artifacts/mpu/create/1/abc/artifacts/model.pkl",
+     "MLflow Artifacts: Multipart Upload", False, "artifacts"),
+    ("GET", "/get-artifact", "MLflow Tracking: Get Artifact", True, "artifacts"),
+    ("GET", "/model-versions/get-artifact", "MLflow Registry: Get Model Version Artifact", True, "artifacts"),
+]
+
+@pytest.mark.parametrize("method,path,name,read_only,group", CASES)
+def test_classify_known_endpoints(method, path, name, read_only, group):
+    route = routes.classify(path, method)
+    assert (route.name, route.read_only, route.group) == (name, read_only, group)
+
+def test_trailing_slash_and_missing_leading_slash():
+    assert routes.classify("/api/2.0/mlflow/runs/get/", "GET").name == "MLflow Tracking: Get Run"
+    assert routes.classify("api/2.0/mlflow/runs/get", "GET").name == "MLflow Tracking: Get Run"
+
+def test_unknown_endpoints_fall_back_to_their_api():
+    tracking = routes.classify("/api/2.0/mlflow/runs/not-an-endpoint", "POST")
+    assert (tracking.name, tracking.read_only, tracking.group) == ("MLflow Tracking API", False, "runs")
+    registry = routes.classify("/api/2.0/mlflow/registered-models/not-an-endpoint", "POST")
+    assert (registry.name, registry.group) == ("MLflow Registry API", "registry")
+
+def test_unknown_paths_never_embed_the_path():
+    for path in ("/static-files/index.html", "/api/2.0/mlflow/runs", "/api/2.1/mlflow/runs/get", "/x/" + "a" * 500):
+        route = routes.classify(path, "GET")
+        assert route.name == "Other"
+        assert not route.read_only
+
+def test_unknown_methods_are_never_read_only():
+    assert not routes.classify("/api/2.0/mlflow-artifacts/artifacts/1/model.pkl", "PATCH").read_only
+
+def test_proxy_endpoints():
+    for path in ("/", "/health", "/metrics", "/api/stats", "/api/stats/stream", "/api/history", "/static/app.js"):
+        assert routes.is_proxy_endpoint(path)
+    for path in ("/api/2.0/mlflow/runs/get", "/get-artifact", "/statistics"):
+        assert not routes.is_proxy_endpoint(path)
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+from shared_stats import PID, SharedStatsSlot
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def test_workers_share_totals(tmp_path):
+    path = str(tmp_path / "stats.bin")
+    slot = SharedStatsSlot(path, 4)
+    slot.record_request()
+    slot.record_response(200, 0.02)
+    slot.record_response(503, 3.0)
+    slot.record_error()
+    totals = slot.snapshot()["totals"]
+    assert (totals["requests"], totals["errors"]) == (1, 1)
+    assert totals["status_classes"]["2xx"] == 1 and totals["status_classes"]["5xx"] == 1
+    assert totals["latency_histogram"]["0.025"] == 1 and totals["latency_histogram"]["5.0"] == 1
+    slot.close()
+
+def test_totals_survive_a_worker_being_replaced(tmp_path):
+    path = str(tmp_path / "stats.bin")
+    first = SharedStatsSlot(path, 2)
+    for _ in range(3):
+        first.record_request()
+        first.record_response(200, 0.1)
+    before = first.snapshot()["totals"]
+    # The worker dies and a new one takes over its slot
+    first._ints[first._base + PID] = dead_pid()
+    replacement = SharedStatsSlot(path, 2)
+    assert replacement.index == first.index
+    after = replacement.snapshot()
+    assert after["totals"] == before
+    assert after["workers"][0]["requests"] == 0
+    replacement.record_request()
+    assert replacement.snapshot()["totals"]["requests"] == 4
+    replacement.close()
+
+def test_released_slot_counts_are_kept_when_reused(tmp_path):
+    path = str(tmp_path / "stats.bin")
+    first = SharedStatsSlot(path, 1)
+    first.record_request()
+    # Released the way close() does while another worker keeps the file open
+    first._ints[first._base + PID] = 0
+    second = SharedStatsSlot(path, 1)
+    assert second.index == first.index
+    assert second.snapshot()["totals"]["requests"] == 1
+    second.close()
+
+def test_last_worker_removes_the_file(tmp_path):
+    path = tmp_path / "stats.bin"
+    slot = SharedStatsSlot(str(path), 2)
+    assert path.exists()
+    slot.close()
+    assert not path.exists()
@@ -0,0 +1,170 @@
+import asyncio
+import httpx
+import pytest
+import config
+import retries
+import singleflight
+import upstream
+
+KEY = ("GET", "api/2.0/mlflow/runs/get", (("run_id", "a"),))
+
+class FakeResponse:
+    """An upstream response whose body is released chunk by chunk."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.status_code = 200
+        self.released = asyncio.Event()
+        self.closed = False
+
+class FakeUpstream:
+    """Stands in for retries.send() and upstream.iter_response()."""
+
+    def __init__(self, chunks=(b"one", b"two"), error=None):
+        self.chunks = list(chunks)
+        self.error = error
+        self.calls = 0
+        self.answer = asyncio.Event()
+        self.responses = []
+
+    async def send(self, method, url, headers=None, params=None, content=None, policy=None):
+        self.calls += 1
+        await self.answer.wait()
+        if self.error is not None:
+            raise self.error
+        response = FakeResponse(self.chunks)
+        self.responses.append(response)
+        return response
+
+    async def iter_response(self, response):
+        try:
+            for chunk in response.chunks:
+                await response.released.wait()
+                yield chunk
+        finally:
+            response.closed = True
+
+@pytest.fixture
+def fake(monkeypatch):
+    def install():
+        fake = FakeUpstream()
+        monkeypatch.setattr(retries, "send", fake.send)
+        monkeypatch.setattr(upstream, "iter_response", fake.iter_response)
+        return fake
+    monkeypatch.setattr(singleflight, "_flights", {})
+    monkeypatch.setattr(singleflight, "flight_stats", {"leaders": 0, "followers": 0, "detached": 0, "dropped": 0})
+    return install
+
+async def fetch(key=KEY):
+    response, body, joined = await singleflight.send(key, "GET", "http://mlflow/" + key[1])
+    return b"".join([chunk async for chunk in body]), joined
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_identical_requests_share_one_upstream_call(fake):
+    async def scenario():
+        source = fake()
+        tasks = [asyncio.create_task(fetch()) for _ in range(5)]
+        await settle()
+        source.answer.set()
+        await settle()
+        source.responses[0].released.set()
+        return source, await asyncio.gather(*tasks)
+
+    source, results = asyncio.run(scenario())
+    assert source.calls == 1
+    assert [body for body, _ in results] == [b"onetwo"] * 5
+    assert [joined for _, joined in results] == [False, True, True, True, True]
+    assert singleflight.flight_stats["followers"] == 4
+    assert singleflight.get_flight_stats()["in_flight"] == 0
+
+def test_different_keys_are_not_coalesced(fake):
+    async def scenario():
+        source = fake()
+        source.answer.set()
+        other = ("GET", "api/2.0/mlflow/runs/get", (("run_id", "b"),))
+        tasks = [asyncio.create_task(fetch()), asyncio.create_task(fetch(other))]
+        await settle()
+        for response in source.responses:
+            response.released.set()
+        await asyncio.gather(*tasks)
+        return source
+
+    assert asyncio.run(scenario()).calls == 2
+
+def test_requests_after_the_headers_start_a_new_flight(fake):
+    async def scenario():
+        source = fake()
+        source.answer.set()
+        first = asyncio.create_task(fetch())
+        await settle()
+        # The first response's headers are in; its body is still streaming
+        second = asyncio.create_task(fetch())
+        await settle()
+        for response in source.responses:
+            response.released.set()
+        return source, await first, await second
+
+    source, first, second = asyncio.run(scenario())
+    assert source.calls == 2
+    assert first == second == (b"onetwo", False)
+
+def test_upstream_error_reaches_every_follower(fake):
+    async def scenario():
+        source = fake()
+        source.error = httpx.ConnectError("refused")
+        tasks = [asyncio.create_task(fetch()) for _ in range(3)]
+        await settle()
+        source.answer.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, httpx.ConnectError) for result in results)
+    assert singleflight.get_flight_stats()["in_flight"] == 0
+
+def test_followers_get_the_body_after_the_leader_disconnects(fake):
+    async def detached():
+        source = fake()
+        leader = asyncio.create_task(singleflight.send(KEY, "GET", "http://mlflow/runs/get"))
+        follower = asyncio.create_task(fetch())
+        await settle()
+        source.answer.set()
+        _, leader_body, _ = await leader
+        source.responses[0].released.set()
+        assert await leader_body.__anext__() == b"one"
+        # The leader's client goes away mid-body
+        await leader_body.aclose()
+        body, joined = await follower
+        await settle()
+        return source, body, joined
+
+    source, body, joined = asyncio.run(detached())
+    assert (body, joined) == (b"onetwo", True)
+    assert singleflight.flight_stats["detached"] == 1
+    assert source.responses[0].closed
+
+def test_follower_that_never_reads_is_dropped(fake, monkeypatch):
+    monkeypatch.setattr(config, "SINGLE_FLIGHT_QUEUE_SIZE", 1)
+    monkeypatch.setattr(config, "UPSTREAM_READ_TIMEOUT", 0.05)
+
+    async def scenario():
+        source = fake()
+        source.chunks = [b"one", b"two", b"three"]
+        readers = [asyncio.create_task(fetch()) for _ in range(2)]
+        # Gets its response, but its client is gone before the body is read
+        idle = asyncio.create_task(singleflight.send(KEY, "GET", "http://mlflow/runs/get"))
+        await settle()
+        source.answer.set()
+        await settle()
+        source.responses[0].released.set()
+        results = await asyncio.wait_for(asyncio.gather(*readers), 1)
+        _, idle_body, _ = await idle
+        with pytest.raises(httpx.ReadTimeout):
+            async for _ in idle_body:
+                pass
+        return results
+
+    assert asyncio.run(scenario()) == [(b"onetwothree", False), (b"onetwothree", True)]
+    assert singleflight.flight_stats["dropped"] == 1
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import threading
+import httpx
+import pytest
+import config
+import spool
+import upstream
+from spool import HEADER, SpoolFile
+
+BASE = "http://mlflow/api/2.0/mlflow/"
+HEADERS = {"content-type": "application/json"}
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(config, "SPOOL_FSYNC", False)
+    monkeypatch.setattr(config, "SPOOL_RETRY_INTERVAL", 0.01)
+    monkeypatch.setattr(spool, "spool_stats", {
+        "spooled_records": 0, "rejected_records": 0, "replayed_records": 0,
+        "failed_records": 0, "replay_records_per_second": 0.0, "last_error": None
+    })
+
+def tag(run_id, key, value="v"):
+    return json.dumps({"run_id": run_id, "key": key, "value": value}).encode()
+
+def record(seq, endpoint, body, url=None):
+    meta = {"method": "POST", "url": url or BASE + endpoint, "headers": HEADERS, "endpoint": endpoint}
+    return seq, meta, body
+
+def test_spool_file_round_trip(tmp_path):
+    path = str(tmp_path / "spool.bin")
+    spool_file = SpoolFile(path, 4096)
+    for index in range(3):
+        assert spool_file.append({"n": index}, b"body%d" % index)
+    assert [(seq, meta, body) for seq, meta, body in spool_file.peek(2)] == [
+        (0, {"n": 0}, b"body0"), (1, {"n": 1}, b"body1")
+    ]
+    # Only the front of the backlog is consumed, in order
+    done = {1}
+    assert spool_file.consume(done) == 0
+    done.add(0)
+    assert spool_file.consume(done) == 2
+    assert done == set()
+    spool_file.close()
+
+    reopened = SpoolFile(path, 4096)
+    assert reopened.records == 1
+    assert reopened.peek(10) == [(2, {"n": 2}, b"body2")]
+    assert reopened.append({"n": 3}, b"")
+    assert reopened.peek(10)[-1][0] == 3
+    reopened.close()
+
+def test_each_worker_gets_its_own_spool_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "spool.bin")
+    monkeypatch.setattr(config, "SPOOL_FILE", path)
+    first = spool._open()
+    with pytest.raises(BlockingIOError):
+        SpoolFile(path, 4096)
+    second = spool._open()
+    assert (first.path, second.path) == (path, path + ".1")
+    first.append({"n": 0}, b"left behind")
+    first.close()
+    # A replacement worker takes over the free file and its backlog
+    replacement = spool._open()
+    assert replacement.path == path
+    assert replacement.records == 1
+    second.close()
+    replacement.close()
+
+def test_torn_record_is_dropped_on_open(tmp_path):
+    path = str(tmp_path / "spool.bin")
+    spool_file = SpoolFile(path, 4096)
+    spool_file.append({"n": 0}, b"kept")
+    spool_file.append({"n": 1}, b"torn")
+    spool_file._mmap[spool_file._write - 1:spool_file._write] = b"X"
+    spool_file.close()
+
+    reopened = SpoolFile(path, 4096)
+    assert reopened.records == 1
+    assert reopened.peek(10) == [(0, {"n": 0}, b"kept")]
+    reopened.close()
+
+def test_full_spool_compacts_then_refuses(tmp_path):
+    spool_file = SpoolFile(str(tmp_path / "spool.bin"), 4096)
+    body = b"x" * 1000
+    while spool_file.append({}, body):
+        pass
+    count = spool_file.records
+    # Replaying the front makes room again by moving the backlog forward
+    seqs = {seq for seq, meta, body in spool_file.peek(2)}
+    spool_file.consume(seqs)
+    assert spool_file.append({}, body)
+    assert spool_file.compactions == 1
+    assert spool_file.records == count - 1
+    assert spool_file._read == HEADER.size
+    spool_file.close()
+
+def test_single_item_writes_are_merged_on_replay():
+    records = [
+        record(0, "runs/set-tag", tag("a", "t1")),
+        record(1, "runs/log-parameter", tag("a", "p1")),
+        record(2, "runs/update", b'{"run_id": "a", "status": "FINISHED"}'),
+        record(3, "runs/set-tag", tag("a", "t2")),
+    ]
+    requests = list(spool._merge_writes(records))
+    assert [[seq for seq, meta, body in covered] for covered, meta, body in requests] == [[0, 1], [2], [3]]
+    covered, meta, body = requests[0]
+    assert meta["url"] == BASE + "runs/log-batch"
+    assert json.loads(body) == {
+        "run_id": "a", "metrics": [], "params": [{"key": "p1", "value": "v"}],
+        "tags": [{"key": "t1", "value": "v"}]
+    }
+    # A lone write is replayed as it was sent
+    assert requests[2][1]["url"] == BASE + "runs/set-tag"
+
+class FakeServer:
+    """An MLflow server that can be down, and rejects writes with a bad key."""
+
+    def __init__(self):
+        self.available = False
+        self.received = []
+
+    async def send(self, method, url, headers=None, params=None, content=None, extensions=None):
+        if not self.available:
+            raise httpx.ConnectError("refused")
+        self.received.append((url[len(BASE):], json.loads(content)))
+        return httpx.Response(400 if b'"bad"' in content else 200)
+
+    async def read_response(self, response):
+        return b"{}"
+
+async def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError("timed out")
+
+def test_backlog_is_replayed_in_order_once_the_server_is_back(tmp_path, monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(upstream, "send", server.send)
+    monkeypatch.setattr(upstream, "read_response", server.read_response)
+    monkeypatch.setattr(config, "SPOOL_FILE", str(tmp_path / "spool.bin"))
+
+    async def scenario():
+        await spool.startup()
+        try:
+            for index in range(3):
+                assert await spool.append("POST", BASE + "runs/set-tag", HEADERS, tag("a", f"t{index}"), "runs/set-tag")
+            await spool.append("POST", BASE + "runs/update", HEADERS, b'{"run_id": "b", "status": "FINISHED"}', "runs/update")
+            await asyncio.sleep(0.03)
+            assert spool.has_backlog()
+            server.available = True
+            await wait_for(lambda: not spool.has_backlog())
+        finally:
+            await spool.shutdown()
+
+    asyncio.run(scenario())
+    assert sorted(server.received, key=lambda request: request[0]) == [
+        ("runs/log-batch", {"run_id": "a", "metrics": [], "params": [],
+                            "tags": [{"key": "t0", "value": "v"}, {"key": "t1", "value": "v"},
+                                     {"key": "t2", "value": "v"}]}),
+        ("runs/update", {"run_id": "b", "status": "FINISHED"})
+    ]
+    assert spool.spool_stats["replayed_records"] == 4
+
+def test_rejected_batch_is_replayed_one_by_one(tmp_path, monkeypatch):
+    server = FakeServer()
+    # Long enough for all three writes to be spooled before the next attempt
+    monkeypatch.setattr(config, "SPOOL_RETRY_INTERVAL", 0.1)
+    monkeypatch.setattr(upstream, "send", server.send)
+    monkeypatch.setattr(upstream, "read_response", server.read_response)
+    monkeypatch.setattr(config, "SPOOL_FILE", str(tmp_path / "spool.bin"))
+
+    async def scenario():
+        await spool.startup()
+        try:
+            for key in ("t0", "bad", "t2"):
+                await spool.append("POST", BASE + "runs/set-tag", HEADERS, tag("a", key), "runs/set-tag")
+            server.available = True
+            await wait_for(lambda: not spool.has_backlog())
+        finally:
+            await spool.shutdown()
+
+    asyncio.run(scenario())
+    assert [(endpoint, body.get("key")) for endpoint, body in server.received] == [
+        ("runs/log-batch", None), ("runs/set-tag", "t0"), ("runs/set-tag", "bad"), ("runs/set-tag", "t2")
+    ]
+    assert (spool.spool_stats["replayed_records"], spool.spool_stats["failed_records"]) == (2, 1)
+
+def test_backlog_survives_a_restart(tmp_path, monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(upstream, "send", server.send)
+    monkeypatch.setattr(upstream, "read_response", server.read_response)
+    monkeypatch.setattr(config, "SPOOL_FILE", str(tmp_path / "spool.bin"))
+
+    async def down():
+        await spool.startup()
+        await spool.append("POST", BASE + "runs/set-tag", HEADERS, tag("a", "t0"), "runs/set-tag")
+        await spool.shutdown()
+
+    async def up():
+        server.available = True
+        await spool.startup()
+        try:
+            await wait_for(lambda: not spool.has_backlog())
+        finally:
+            await spool.shutdown()
+
+    asyncio.run(down())
+    asyncio.run(up())
+    assert server.received == [("runs/set-tag", {"run_id": "a", "key": "t0", "value": "v"})]
+
+def test_appends_are_written_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SPOOL_FILE", str(tmp_path / "spool.bin"))
+    threads = []
+    original = SpoolFile.append
+
+    def append(self, meta, body):
+        threads.append(threading.current_thread())
+        return original(self, meta, body)
+
+    monkeypatch.setattr(SpoolFile, "append", append)
+
+    async def scenario():
+        await spool.startup()
+        try:
+            # Appended concurrently, but written one at a time in call order
+            await asyncio.gather(*(
+                spool.append("POST", BASE + "runs/set-tag", HEADERS, tag("a", f"t{index}"), "runs/set-tag")
+                for index in range(5)
+            ))
+            # Nothing is replayed while the server is down, so the backlog is intact
+            return [json.loads(body)["key"] for seq, meta, body in spool._spool.peek(10)]
+        finally:
+            await spool.shutdown()
+
+    server = FakeServer()
+    monkeypatch.setattr(upstream, "send", server.send)
+    assert asyncio.run(scenario()) == [f"t{index}" for index in range(5)]
+    assert threading.main_thread() not in threads
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import httpx
+import pytest
+import config
+import upstream
+import write_batcher
+from log_batch import PendingBatch, parse_write
+
+URL = "http://mlflow/api/2.0/mlflow/runs/log-batch"
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class FakeServer:
+    """Records the log-batch calls the batcher makes."""
+
+    def __init__(self):
+        self.bodies = []
+        self.status_code = 200
+        self.error = None
+        self.delay = 0
+
+    async def send(self, method, url, headers=None, params=None, content=None, extensions=None):
+        assert (method, url) == ("POST", URL)
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.bodies.append(json.loads(content))
+        return FakeResponse(self.status_code)
+
+    async def read_response(self, response):
+        return b'{"error_code": "INVALID_PARAMETER_VALUE"}' if response.status_code >= 400 else b"{}"
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(upstream, "send", server.send)
+    monkeypatch.setattr(upstream, "read_response", server.read_response)
+    monkeypatch.setattr(write_batcher, "_batches", {})
+    monkeypatch.setattr(write_batcher, "_flushes", {})
+    monkeypatch.setattr(write_batcher, "batch_stats", {
+        "accepted_items": 0, "flushed_batches": 0, "flushed_items": 0,
+        "failed_batches": 0, "failed_items": 0, "spooled_batches": 0, "last_error": None
+    })
+    monkeypatch.setattr(write_batcher, "_on_flushed", None)
+    return server
+
+def metric(run_id, key, value, step=0):
+    return json.dumps({"run_id": run_id, "key": key, "value": value, "timestamp": 1, "step": step}).encode()
+
+def param(run_id, key, value):
+    return json.dumps({"run_id": run_id, "key": key, "value": value}).encode()
+
+def test_parse_write_refuses_malformed_writes():
+    assert parse_write("runs/log-metric", b"not json") is None
+    assert parse_write("runs/log-metric", b"[]") is None
+    assert parse_write("runs/log-metric", b'{"run_id": "a", "key": "m", "value": 1}') is None
+    assert parse_write("runs/set-tag", b'{"run_id": "a", "key": "t"}') is None
+    assert parse_write("runs/set-tag", b'{"run_uuid": "a", "key": "t", "value": "v"}')["run_id"] == "a"
+
+def test_pending_batch_limits():
+    batch = PendingBatch(URL, {}, "a")
+    for index in range(99):
+        batch.add("runs/log-parameter", {"key": f"p{index}", "value": "v"})
+    assert not batch.is_full()
+    batch.add("runs/log-parameter", {"key": "p99", "value": "v"})
+    assert batch.is_full()
+    assert batch.accepts("runs/log-parameter", {"key": "p0", "value": "v"})
+    assert not batch.accepts("runs/log-parameter", {"key": "p0", "value": "changed"})
+
+def test_writes_to_one_run_become_one_log_batch(server):
+    async def scenario():
+        flushed = []
+        write_batcher._on_flushed = flushed.append
+        assert write_batcher.submit("runs/log-metric", URL, None, metric("a", "loss", 0.5, 1))
+        assert write_batcher.submit("runs/log-metric", URL, None, metric("a", "loss", 0.4, 2))
+        assert write_batcher.submit("runs/log-parameter", URL, None, param("a", "lr", "0.1"))
+        assert write_batcher.submit("runs/set-tag", URL, None, param("a", "stage", "train"))
+        assert write_batcher.has_pending()
+        await write_batcher.flush_run("a")
+        assert not write_batcher.has_pending()
+        return flushed
+
+    assert asyncio.run(scenario()) == ["a"]
+    assert server.bodies == [{
+        "run_id": "a",
+        "metrics": [
+            {"key": "loss", "value": 0.5, "timestamp": 1, "step": 1},
+            {"key": "loss", "value": 0.4, "timestamp": 1, "step": 2}
+        ],
+        "params": [{"key": "lr", "value": "0.1"}],
+        "tags": [{"key": "stage", "value": "train"}]
+    }]
+    assert write_batcher.batch_stats["flushed_items"] == 4
+
+def test_malformed_writes_are_left_to_the_server(server):
+    assert not write_batcher.submit("runs/log-metric", URL, None, b'{"run_id": "a"}')
+    assert not write_batcher.has_pending()
+
+def test_flush_run_only_sends_that_run(server):
+    async def scenario():
+        write_batcher.submit("runs/set-tag", URL, None, param("a", "t", "1"))
+        write_batcher.submit("runs/set-tag", URL, None, param("b", "t", "1"))
+        await write_batcher.flush_run("a")
+        assert [body["run_id"] for body in server.bodies] == ["a"]
+        assert write_batcher.get_batch_stats()["pending_batches"] == 1
+        await write_batcher.shutdown()
+
+    asyncio.run(scenario())
+    assert [body["run_id"] for body in server.bodies] == ["a", "b"]
+
+def test_changed_param_goes_into_the_next_batch_in_order(server):
+    async def scenario():
+        server.delay = 0.01
+        write_batcher.submit("runs/log-parameter", URL, None, param("a", "lr", "0.1"))
+        # Starts a second batch while the first is still being sent
+        write_batcher.submit("runs/log-parameter", URL, None, param("a", "lr", "0.2"))
+        await write_batcher.flush_run("a")
+
+    asyncio.run(scenario())
+    assert [body["params"] for body in server.bodies] == [
+        [{"key": "lr", "value": "0.1"}],
+        [{"key": "lr", "value": "0.2"}]
+    ]
+
+def test_full_batch_is_sent_at_once(server, monkeypatch):
+    monkeypatch.setattr(config, "WRITE_BATCH_MAX_ITEMS", 3)
+
+    async def scenario():
+        for step in range(4):
+            write_batcher.submit("runs/log-metric", URL, None, metric("a", "loss", step, step))
+        await asyncio.sleep(0.01)
+        assert len(server.bodies) == 1
+        await write_batcher.shutdown()
+
+    asyncio.run(scenario())
+    assert [len(body["metrics"]) for body in server.bodies] == [3, 1]
+
+def test_failed_flush_is_counted(server):
+    async def scenario():
+        server.status_code = 400
+        write_batcher.submit("runs/set-tag", URL, None, param("a", "t", "1"))
+        write_batcher.submit("runs/set-tag", URL, None, param("a", "u", "1"))
+        await write_batcher.flush_run("a")
+        server.status_code = 200
+        server.error = httpx.ConnectError("refused")
+        write_batcher.submit("runs/set-tag", URL, None, param("a", "t", "2"))
+        await write_batcher.flush_run("a")
+
+    asyncio.run(scenario())
+    stats = write_batcher.get_batch_stats()
+    assert (stats["failed_batches"], stats["failed_items"], stats["flushed_batches"]) == (2, 3, 0)
+    assert stats["last_error"]["run_id"] == "a"
+    assert "refused" in stats["last_error"]["error"]
+
+def test_periodic_flush(server, monkeypatch):
+    monkeypatch.setattr(config, "WRITE_BATCHING_ENABLED", True)
+    monkeypatch.setattr(config, "WRITE_BATCH_WINDOW", 0.01)
+
+    async def scenario():
+        await write_batcher.startup()
+        write_batcher.submit("runs/set-tag", URL, None, param("a", "t", "1"))
+        await asyncio.sleep(0.05)
+        assert len(server.bodies) == 1
+        await write_batcher.shutdown()
+
+    asyncio.run(scenario())
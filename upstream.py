@@ -0,0 +1,278 @@
+import asyncio
+import importlib.util
+import time
+import httpx
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlparse
+import config
+from utils import logger
+
+class UpstreamPool:
+    """Keep-alive connection pool for a single upstream origin."""
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.client = create_client()
+        self.active = 0
+        self.last_used = time.monotonic()
+
+# Pools keyed by upstream origin, least recently used first
+_pools: "OrderedDict[str, UpstreamPool]" = OrderedDict()
+_sweeper: Optional[asyncio.Task] = None
+_closing: set = set()
+
+pool_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "idle_closed": 0
+}
+
+def create_client():
+    """
+    Create an async HTTP client configured from config.py.
+
+    Returns:
+        httpx.AsyncClient: A pooled client with keep-alive connections
+    """
+    timeout = httpx.Timeout(
+        connect=config.UPSTREAM_CONNECT_TIMEOUT,
+        read=config.UPSTREAM_READ_TIMEOUT,
+        write=config.UPSTREAM_WRITE_TIMEOUT,
+        pool=config.UPSTREAM_POOL_TIMEOUT
+    )
+    limits = httpx.Limits(
+        max_connections=config.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=config.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.UPSTREAM_KEEPALIVE_EXPIRY
+    )
+    # HTTP/2 needs the h2 package, checked by check_http_version() at startup
+    http2 = config.UPSTREAM_HTTP_VERSION in ("2", "h2c")
+    http1 = config.UPSTREAM_HTTP_VERSION != "h2c"
+    # Redirects are passed back to the client untouched
+    return httpx.AsyncClient(
+        timeout=timeout, limits=limits, follow_redirects=False, http1=http1, http2=http2
+    )
+
+def get_origin(url):
+    """
+    Get the scheme://host:port origin of a URL.
+
+    Args:
+        url (str): A complete URL
+
+    Returns:
+        str: The origin the URL points at
+    """
+    parsed = urlparse(str(url))
+    return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+def _close_pool(pool):
+    """Close a pool's client in the background."""
+    task = asyncio.get_running_loop().create_task(pool.client.aclose())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+def _evict_pools():
+    """Close least recently used idle pools until the registry fits UPSTREAM_MAX_HOSTS."""
+    excess = len(_pools) - config.UPSTREAM_MAX_HOSTS
+    if excess <= 0:
+        return
+    # Pools with requests in flight are skipped and retried on the next miss
+    for origin in list(_pools):
+        if excess <= 0:
+            break
+        pool = _pools[origin]
+        if pool.active == 0:
+            del _pools[origin]
+            _close_pool(pool)
+            pool_stats["evictions"] += 1
+            excess -= 1
+
+def acquire(url):
+    """
+    Get the pool for a URL's origin and mark a request as in flight on it.
+
+    Args:
+        url (str): The complete target URL
+
+    Returns:
+        UpstreamPool: The pool to send the request through
+    """
+    origin = get_origin(url)
+    pool = _pools.get(origin)
+    if pool is None or pool.client.is_closed:
+        pool_stats["misses"] += 1
+        pool = UpstreamPool(origin)
+        _pools[origin] = pool
+        _evict_pools()
+    else:
+        pool_stats["hits"] += 1
+        _pools.move_to_end(origin)
+    pool.active += 1
+    pool.last_used = time.monotonic()
+    return pool
+
+def get_active(url):
+    """
+    Get the number of requests in flight to a URL's origin.
+
+    Args:
+        url (str): A URL on the upstream
+
+    Returns:
+        int: Requests sent through the origin's pool whose body is not yet consumed
+    """
+    pool = _pools.get(get_origin(url))
+    return pool.active if pool is not None else 0
+
+def release(url):
+    """
+    Mark a request to a URL's origin as finished.
+
+    Args:
+        url (str): The complete target URL
+    """
+    pool = _pools.get(get_origin(url))
+    if pool is not None and pool.active > 0:
+        pool.active -= 1
+        pool.last_used = time.monotonic()
+
+async def _sweep_idle_pools():
+    """Periodically close pools that have not been used for UPSTREAM_IDLE_TIMEOUT."""
+    interval = max(1.0, config.UPSTREAM_IDLE_TIMEOUT / 4)
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        for origin, pool in list(_pools.items()):
+            if pool.active == 0 and now - pool.last_used > config.UPSTREAM_IDLE_TIMEOUT:
+                del _pools[origin]
+                await pool.client.aclose()
+                pool_stats["idle_closed"] += 1
+                logger.debug(f"Closed idle upstream pool for {origin}")
+
+def check_http_version():
+    """
+    Check that UPSTREAM_HTTP_VERSION is valid and can be spoken.
+
+    Raises:
+        RuntimeError: If the version is unknown, or HTTP/2 is asked for
+            without the h2 package installed
+    """
+    if config.UPSTREAM_HTTP_VERSION not in ("1.1", "2", "h2c"):
+        raise RuntimeError(
+            f"UPSTREAM_HTTP_VERSION must be 1.1, 2 or h2c, not {config.UPSTREAM_HTTP_VERSION!r}"
+        )
+    if config.UPSTREAM_HTTP_VERSION != "1.1" and importlib.util.find_spec("h2") is None:
+        raise RuntimeError(
+            f"UPSTREAM_HTTP_VERSION={config.UPSTREAM_HTTP_VERSION} needs the h2 package; "
+            "install the http2 extra (pip install 'httpx[http2]')"
+        )
+
+async def startup():
+    """Check the upstream HTTP version and start the background sweeper for idle upstream pools."""
+    global _sweeper
+    check_http_version()
+    _sweeper = asyncio.get_running_loop().create_task(_sweep_idle_pools())
+
+async def shutdown():
+    """Stop the sweeper and close every upstream pool."""
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        _sweeper = None
+    while _pools:
+        _, pool = _pools.popitem()
+        await pool.client.aclose()
+
+def get_pool_stats():
+    """
+    Get pool registry statistics for /api/stats.
+
+    Returns:
+        dict: Hit/miss/eviction counts and per-host in-flight requests
+    """
+    return {
+        **pool_stats,
+        "hosts": {origin: {"active": pool.active} for origin, pool in _pools.items()}
+    }
+
+async def send(method, url, headers=None, params=None, content=None, extensions=None):
+    """
+    Send a request upstream without reading the response body.
+
+    The response must be consumed with iter_response() so the connection
+    is returned to its pool.
+
+    Args:
+        method (str): The HTTP method
+        url (str): The complete target URL
+        headers (dict, optional): Headers to forward
+        params (list, optional): Query parameters as (key, value) pairs
+        content (bytes or async iterator, optional): The request body
+        extensions (dict, optional): httpx request extensions, e.g. a trace callback
+
+    Returns:
+        httpx.Response: The upstream response with an open body stream
+    """
+    client = acquire(url).client
+    try:
+        upstream_request = client.build_request(
+            method, url, headers=headers, params=params, content=content, extensions=extensions
+        )
+        return await client.send(upstream_request, stream=True)
+    except BaseException:
+        release(url)
+        raise
+
+async def iter_response(response) -> AsyncIterator[bytes]:
+    """
+    Stream the raw upstream body and close the response when done.
+
+    The body is passed through undecoded, so the upstream Content-Encoding
+    header stays valid for the client.
+
+    Args:
+        response (httpx.Response): A response returned by send()
+
+    Yields:
+        bytes: Chunks of the raw response body
+    """
+    try:
+        async for chunk in response.aiter_raw(config.STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await response.aclose()
+        release(response.request.url)
+
+async def discard(response):
+    """
+    Close a response without reading its body and return its pool slot.
+
+    Args:
+        response (httpx.Response): A response returned by send() that will not be used
+    """
+    try:
+        await response.aclose()
+    finally:
+        release(response.request.url)
+
+async def read_response(response):
+    """
+    Read a whole, small response body and return the connection to its pool.
+
+    Unlike iter_response(), the body is decoded, so this is meant for
+    responses the proxy inspects itself rather than passes through.
+
+    Args:
+        response (httpx.Response): A response returned by send()
+
+    Returns:
+        bytes: The decoded response body
+    """
+    try:
+        return await response.aread()
+    finally:
+        await response.aclose()
+        release(response.request.url)
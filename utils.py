@@ -3,6 +3,8 @@ import logging
 from urllib.parse import urlparse, urljoin
 import time
 import config
+import routes
+import compression
 
 # Configure logging
 logging.basicConfig(
@@ -11,6 +13,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger('mlflow_proxy')
 
+# Exchange records already cover every upstream call, so skip httpx's own
+# per-request INFO lines
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
 def get_target_url(path, mlflow_server_url):
     """
     Constructs the target URL for proxying the request.
@@ -27,6 +33,52 @@ def get_target_url(path, mlflow_server_url):
     path = path.lstrip('/')
     return f"{server_url}/{path}"
 
+# Headers that apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailers',
+    'transfer-encoding',
+    'upgrade'
+}
+
+def filter_headers(headers, exclude=()):
+    """
+    Copy headers, dropping hop-by-hop headers and any extra names given.
+    
+    Args:
+        headers: The headers to copy (any mapping with items())
+        exclude (iterable, optional): Additional lowercase header names to drop
+        
+    Returns:
+        dict: The headers that can be forwarded
+    """
+    excluded = HOP_BY_HOP_HEADERS.union(exclude)
+    return {key: value for key, value in headers.items() if key.lower() not in excluded}
+
+def request_key(method, path, params, origin, headers):
+    """
+    Build a key identifying requests that get the same upstream response.
+    
+    Args:
+        method (str): The HTTP method
+        path (str): The request path
+        params (list): Query parameters as (key, value) pairs
+        origin (str): The upstream origin the request is sent to
+        headers: The request headers
+        
+    Returns:
+        tuple: The key; the credentials and accepted encodings are part of it,
+            so different users or encodings never share a response
+    """
+    return (
+        method, path.strip('/'), tuple(sorted(params)), origin,
+        headers.get('authorization'), headers.get('accept-encoding')
+    )
+
 def is_binary_content(content_type):
     """
     Check if the content is binary based on Content-Type header.
@@ -50,147 +102,212 @@ def is_binary_content(content_type):
     
     return any(binary_type in content_type for binary_type in binary_types)
 
-def format_body_for_logging(body, content_type):
+def format_body_for_logging(body, content_type, size=None):
     """
     Format the request/response body for logging.
     
     Args:
-        body (bytes): The body content
+        body (bytes): The body content, or a captured prefix of it
         content_type (str): The Content-Type header value
+        size (int, optional): The full body size if body is only a prefix
         
     Returns:
         str: The formatted body for logging
     """
     if not body:
         return "<empty body>"
+    
+    if size is None:
+        size = len(body)
         
     # If it's binary content, just log the type and size
     if is_binary_content(content_type):
-        return f"<binary data> [Content-Type: {content_type}, Size: {len(body)} bytes]"
+        return f"<binary data> [Content-Type: {content_type}, Size: {size} bytes]"
     
     # If it's too large, truncate it
-    if len(body) > config.MAX_LOG_BODY_SIZE:
-        return f"<truncated> [Size: {len(body)} bytes, showing first {config.MAX_LOG_BODY_SIZE} bytes]\n{body[:config.MAX_LOG_BODY_SIZE]}"
+    if size > config.MAX_LOG_BODY_SIZE:
+        prefix = body[:config.MAX_LOG_BODY_SIZE].decode('utf-8', errors='replace')
+        return f"<truncated> [Size: {size} bytes, showing first {config.MAX_LOG_BODY_SIZE} bytes]\n{prefix}"
     
-    # Try to parse JSON for better formatting
-    if content_type and 'application/json' in content_type:
-        try:
-            parsed = json.loads(body)
-            return json.dumps(parsed, indent=2)
-        except:
-            pass
-    
-    # Return as string
+    # Return as string; JSON bodies are kept as sent rather than re-serialized
     try:
         return body.decode('utf-8')
     except UnicodeDecodeError:
-        return f"<binary data> [Content-Type: {content_type}, Size: {len(body)} bytes]"
+        return f"<binary data> [Content-Type: {content_type}, Size: {size} bytes]"
+
+class BodyCapture:
+    """
+    Pass a body stream through while keeping its first bytes for logging.
+    
+    Only up to `limit` bytes are kept, so arbitrarily large bodies can be
+    logged without holding them in memory. If given, `on_complete` is called
+    with the capture once the stream ends or is closed early; `completed`
+    tells the two apart.
+    """
+
+    def __init__(self, stream, limit, on_complete=None):
+        self.stream = stream
+        self.limit = limit
+        self.on_complete = on_complete
+        self.size = 0
+        self.completed = False
+        self._chunks = []
+        self._captured = 0
+
+    @property
+    def captured(self):
+        """The captured prefix of the body."""
+        return b"".join(self._chunks)
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                self.size += len(chunk)
+                if self._captured < self.limit:
+                    kept = chunk[:self.limit - self._captured]
+                    self._chunks.append(kept)
+                    self._captured += len(kept)
+                yield chunk
+            self.completed = True
+        finally:
+            if self.on_complete is not None:
+                self.on_complete(self)
 
-def log_request(req, body=None):
+    async def read(self):
+        """Read the rest of the stream into memory, capturing its prefix as usual."""
+        return b"".join([chunk async for chunk in self])
+
+def get_header(headers, name):
     """
-    Log the details of an HTTP request.
+    Get a header value from either a plain dict or a case-insensitive mapping.
     
     Args:
-        req: The FastAPI request object
-        body (bytes, optional): The request body if already read
+        headers: The request headers
+        name (str): The lowercase header name
+        
+    Returns:
+        str: The header value, or None if it is not present
     """
-    if not config.LOG_REQUEST_HEADERS and not config.LOG_REQUEST_BODY:
-        return
+    if isinstance(headers, dict):
+        return headers.get(name) or headers.get(name.title())
+    return headers.get(name)
+
+def request_log_record(req):
+    """
+    Build the request part of a structured exchange log record.
     
+    Only references to the request data are collected here; bodies are
+    formatted later by the background log writer.
     
+    Args:
+        req: The FastAPI request object
+        
+    Returns:
+        dict: The request fields of the log record
+    """
+    record = {"timestamp": time.time()}
     
-    logger.info(f"==== INCOMING REQUEST ====")
-    # Log request method and URL
     if hasattr(req, 'method'):
-        logger.info(f"Method: {req.method}")
+        record["method"] = req.method
     
     if hasattr(req, 'url'):
-        logger.info(f"URL: {req.url}")
+        record["url"] = str(req.url)
     elif hasattr(req, 'path'):
-        logger.info(f"Path: {req.path}")
+        record["url"] = req.path
     
     # Log client information
-    if hasattr(req, 'client'):
-        logger.info(f"Client: {req.client.host}:{req.client.port}")
+    if getattr(req, 'client', None) is not None:
+        record["client"] = f"{req.client.host}:{req.client.port}"
     elif hasattr(req, 'remote_addr'):
-        logger.info(f"Client: {req.remote_addr}")
+        record["client"] = req.remote_addr
     
-    # Get the forwarded for header if present (useful for proxied requests)
-    forwarded_for = None
     if hasattr(req, 'headers'):
-        if isinstance(req.headers, dict):
-            forwarded_for = req.headers.get('X-Forwarded-For') or req.headers.get('x-forwarded-for')
-        elif hasattr(req.headers, 'get'):
-            forwarded_for = req.headers.get('X-Forwarded-For')
+        # Get the forwarded for header if present (useful for proxied requests)
+        forwarded_for = get_header(req.headers, 'x-forwarded-for')
+        if forwarded_for:
+            record["forwarded_for"] = forwarded_for
+        
+        user_agent = get_header(req.headers, 'user-agent')
+        if user_agent:
+            record["user_agent"] = user_agent
+        
+        if config.LOG_REQUEST_HEADERS:
+            record["request_headers"] = dict(req.headers.items())
+        
+        record["request_content_type"] = get_header(req.headers, 'content-type')
     
-    if forwarded_for:
-        logger.info(f"X-Forwarded-For: {forwarded_for}")
+    return record
+
+def add_request_body(record, body=None, body_size=None):
+    """
+    Attach the request body, or a captured prefix of it, to a log record.
     
-    # Log user agent
-    user_agent = None
-    if hasattr(req, 'headers'):
-        if isinstance(req.headers, dict):
-            user_agent = req.headers.get('User-Agent') or req.headers.get('user-agent')
-        elif hasattr(req.headers, 'get'):
-            user_agent = req.headers.get('User-Agent')
-    
-    if user_agent:
-        logger.info(f"User-Agent: {user_agent}")
-    
-    # Log request headers if configured
-    if config.LOG_REQUEST_HEADERS and hasattr(req, 'headers'):
-        logger.info("Headers:")
-        if isinstance(req.headers, dict):
-            for name, value in req.headers.items():
-                logger.info(f"  {name}: {value}")
-        elif hasattr(req.headers, 'items'):
-            for name, value in req.headers.items():
-                logger.info(f"  {name}: {value}")
-    
-    # Log request body if configured
+    Args:
+        record (dict): The log record
+        body (bytes, optional): The request body or its captured prefix
+        body_size (int, optional): The full body size if body is only a prefix
+    """
     if config.LOG_REQUEST_BODY and body:
-        content_type = None
-        if hasattr(req, 'headers'):
-            if isinstance(req.headers, dict):
-                content_type = req.headers.get('content-type') or req.headers.get('Content-Type')
-            elif hasattr(req.headers, 'get'):
-                content_type = req.headers.get('content-type')
-        
-        logger.info("Body:")
-        logger.info(format_body_for_logging(body, content_type))
-    
-    logger.info("==== END REQUEST ====")
+        record["request_body"] = body
+        record["request_size"] = body_size if body_size is not None else len(body)
 
-def log_response(resp, duration=None):
+def add_response(record, resp, duration=None, body=None, body_size=None):
     """
-    Log the details of an HTTP response.
+    Attach the response details to a log record.
     
     Args:
+        record (dict): The log record
         resp: The Response object
         duration (float, optional): The duration of the request in seconds
+        body (bytes, optional): The response body or its captured prefix
+        body_size (int, optional): The full body size if body is only a prefix
     """
-    if not config.LOG_RESPONSE_HEADERS and not config.LOG_RESPONSE_BODY:
-        return
-
-    logger.info(f"==== OUTGOING RESPONSE ====")
-    logger.info(f"Status: {resp.status_code}")
+    record["status"] = resp.status_code
     
     if duration is not None:
-        logger.info(f"Duration: {duration:.3f} seconds")
+        record["duration"] = round(duration, 6)
     
     if config.LOG_RESPONSE_HEADERS:
-        logger.info("Headers:")
-        for name, value in resp.headers.items():
-            logger.info(f"  {name}: {value}")
+        record["response_headers"] = dict(resp.headers.items())
     
     if config.LOG_RESPONSE_BODY:
-        content_type = resp.headers.get('Content-Type')
-        body = resp.content if hasattr(resp, 'content') else b''
-        
-        logger.info("Body:")
-        logger.info(format_body_for_logging(body, content_type))
+        record["response_content_type"] = resp.headers.get('Content-Type')
+        if resp.headers.get('Content-Encoding'):
+            record["response_content_encoding"] = resp.headers.get('Content-Encoding')
+        record["response_body"] = body or b''
+        record["response_size"] = body_size if body_size is not None else len(body or b'')
+
+def render_log_record(record):
+    """
+    Turn a log record into a JSON-serializable dict, formatting any bodies.
     
-    logger.info("==== END RESPONSE ====")
+    Args:
+        record (dict): The log record
+        
+    Returns:
+        dict: The record with bodies formatted as text
+    """
+    rendered = dict(record)
+    rendered["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record["timestamp"]))
+    content_type = rendered.pop("request_content_type", None)
+    if "request_body" in rendered:
+        rendered["request_body"] = format_body_for_logging(
+            rendered["request_body"], content_type, rendered.get("request_size")
+        )
+    content_type = rendered.pop("response_content_type", None)
+    content_encoding = rendered.pop("response_content_encoding", None)
+    if "response_body" in rendered:
+        body = rendered["response_body"]
+        size = rendered.get("response_size")
+        # Compressed bodies are logged as their decoded prefix
+        decoded = None
+        if content_encoding and body:
+            decoded = compression.decode_prefix(body, content_encoding, config.MAX_LOG_BODY_SIZE)
+        if decoded is not None:
+            body, size = decoded, None
+            rendered["response_encoding"] = content_encoding
+        rendered["response_body"] = format_body_for_logging(body, content_type, size)
+    return rendered
 
 def get_mlflow_request_type(path, method):
     """
@@ -203,44 +320,4 @@ def get_mlflow_request_type(path, method):
     Returns:
         str: Description of the MLflow request type
     """
-    # Tracking API endpoints
-    if '/api/2.0/mlflow' in path:
-        if '/runs/' in path:
-            if method == 'POST':
-                return "MLflow Tracking: Create Run"
-            elif method == 'GET':
-                return "MLflow Tracking: Get Run"
-            elif method == 'PATCH':
-                return "MLflow Tracking: Update Run"
-        elif '/metrics/' in path:
-            return "MLflow Tracking: Log Metrics"
-        elif '/params/' in path:
-            return "MLflow Tracking: Log Parameters"
-        elif '/tags/' in path:
-            return "MLflow Tracking: Log Tags"
-        elif '/artifacts/' in path:
-            if method == 'POST':
-                return "MLflow Tracking: Log Artifact"
-            else:
-                return "MLflow Tracking: Get Artifact"
-        elif '/experiments/' in path:
-            if method == 'POST':
-                return "MLflow Tracking: Create Experiment"
-            elif method == 'GET':
-                return "MLflow Tracking: Get Experiment"
-            elif method == 'PATCH':
-                return "MLflow Tracking: Update Experiment"
-        return "MLflow Tracking API"
-    
-    # Registry API endpoints
-    elif '/api/2.0/preview/mlflow/registered-models' in path:
-        if method == 'POST':
-            return "MLflow Registry: Create Model"
-        elif method == 'GET':
-            return "MLflow Registry: Get Model"
-        return "MLflow Registry API"
-    elif '/api/2.0/preview/mlflow/model-versions' in path:
-        return "MLflow Registry: Model Versions"
-    
-    # Fallback
-    return f"MLflow API: {method} {path}"
+    return routes.classify(path, method).name
@@ -0,0 +1,196 @@
+import asyncio
+import time
+from typing import Dict, Any, Optional
+import config
+import upstream
+import spool
+from log_batch import PendingBatch, parse_write
+from utils import logger
+
+# Open batches keyed by (log-batch URL, Authorization header, run_id)
+_batches: Dict[tuple, PendingBatch] = {}
+# The last flush of each batch key, so flushes of one run go out in order
+_flushes: Dict[tuple, asyncio.Task] = {}
+_flusher: Optional[asyncio.Task] = None
+# Called after every successful flush, e.g. to invalidate cached runs
+_on_flushed = None
+
+batch_stats: Dict[str, Any] = {
+    "accepted_items": 0,
+    "flushed_batches": 0,
+    "flushed_items": 0,
+    "failed_batches": 0,
+    "failed_items": 0,
+    "spooled_batches": 0,
+    "last_error": None
+}
+
+def is_enabled():
+    """
+    Check whether single-item writes should be batched.
+
+    Returns:
+        bool: True if WRITE_BATCHING_ENABLED is set
+    """
+    return config.WRITE_BATCHING_ENABLED
+
+def submit(endpoint, url, authorization, body):
+    """
+    Add a single-item write to the pending batch of its run.
+
+    Requests that do not look like valid single-item writes are refused,
+    so the caller can forward them and let the MLflow server answer.
+
+    Args:
+        endpoint (str): The route endpoint, one of BATCHABLE_ENDPOINTS
+        url (str): The runs/log-batch URL on the request's upstream
+        authorization (str, optional): The request's Authorization header
+        body (bytes): The request body
+
+    Returns:
+        bool: True if the write was accepted for batching
+    """
+    payload = parse_write(endpoint, body)
+    if payload is None:
+        return False
+
+    run_id = payload["run_id"]
+    batch_key = (url, authorization, run_id)
+    batch = _batches.get(batch_key)
+    if batch is not None and not batch.accepts(endpoint, payload):
+        _flush(batch_key)
+        batch = None
+    if batch is None:
+        headers = {"content-type": "application/json"}
+        if authorization:
+            headers["authorization"] = authorization
+        batch = _batches[batch_key] = PendingBatch(url, headers, run_id)
+    batch.add(endpoint, payload)
+    batch_stats["accepted_items"] += 1
+
+    if batch.is_full(config.WRITE_BATCH_MAX_ITEMS):
+        _flush(batch_key)
+    return True
+
+def has_pending():
+    """
+    Check whether any batched write has not been sent yet.
+
+    Returns:
+        bool: True if a batch is open or being flushed
+    """
+    return bool(_batches or _flushes)
+
+def _flush(batch_key):
+    """Take a batch out of the open batches and send it in the background."""
+    batch = _batches.pop(batch_key)
+    previous = _flushes.get(batch_key)
+    task = asyncio.get_running_loop().create_task(_send(batch, previous))
+    _flushes[batch_key] = task
+
+    def forget(done):
+        if _flushes.get(batch_key) is done:
+            del _flushes[batch_key]
+
+    task.add_done_callback(forget)
+    return task
+
+async def _send(batch, previous):
+    """
+    Send one batch to runs/log-batch, after the previous batch of the same run.
+
+    Args:
+        batch (PendingBatch): The batch to send
+        previous (asyncio.Task, optional): The run's previous flush
+    """
+    if previous is not None:
+        await asyncio.wait([previous])
+    size = batch.size
+    content = batch.to_json()
+    # Writes spooled during an outage must reach the server first
+    if spool.has_backlog() and await spool.append("POST", batch.url, batch.headers, content, "runs/log-batch"):
+        batch_stats["spooled_batches"] += 1
+        return
+    try:
+        response = await upstream.send("POST", batch.url, headers=batch.headers, content=content)
+        body = await upstream.read_response(response)
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code}: {body[:500].decode('utf-8', errors='replace')}")
+    except Exception as e:
+        if spool.is_enabled() and isinstance(e, spool.UNDELIVERED_ERRORS):
+            if await spool.append("POST", batch.url, batch.headers, content, "runs/log-batch"):
+                batch_stats["spooled_batches"] += 1
+                return
+        batch_stats["failed_batches"] += 1
+        batch_stats["failed_items"] += size
+        batch_stats["last_error"] = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "run_id": batch.run_id,
+            "items": size,
+            "error": str(e)
+        }
+        logger.error(f"Failed to flush {size} batched writes for run {batch.run_id}: {str(e)}")
+        return
+    batch_stats["flushed_batches"] += 1
+    batch_stats["flushed_items"] += size
+    if _on_flushed is not None:
+        _on_flushed(batch.run_id)
+
+async def flush_run(run_id):
+    """
+    Send the pending writes of a run and wait until they have been sent.
+
+    Used before forwarding any other call naming the run, so clients read
+    their own writes and later writes cannot overtake earlier ones.
+
+    Args:
+        run_id (str): The run ID
+    """
+    for batch_key in [key for key in _batches if key[2] == run_id]:
+        _flush(batch_key)
+    tasks = [task for key, task in _flushes.items() if key[2] == run_id]
+    if tasks:
+        await asyncio.wait(tasks)
+
+async def _flush_periodically():
+    """Flush every open batch each WRITE_BATCH_WINDOW seconds until cancelled."""
+    while True:
+        await asyncio.sleep(config.WRITE_BATCH_WINDOW)
+        for batch_key in list(_batches):
+            _flush(batch_key)
+
+async def startup(on_flushed=None):
+    """
+    Start the periodic flusher.
+
+    Args:
+        on_flushed (callable, optional): Called with the run ID after every successful flush
+    """
+    global _flusher, _on_flushed
+    _on_flushed = on_flushed
+    if is_enabled():
+        _flusher = asyncio.get_running_loop().create_task(_flush_periodically())
+
+async def shutdown():
+    """Stop the flusher and send every pending write before returning."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        _flusher = None
+    for batch_key in list(_batches):
+        _flush(batch_key)
+    if _flushes:
+        await asyncio.wait(list(_flushes.values()))
+
+def get_batch_stats():
+    """
+    Get write batching statistics for /api/stats.
+
+    Returns:
+        dict: Accepted, flushed and failed counts, the pending writes and the last flush error
+    """
+    return {
+        **batch_stats,
+        "pending_items": sum(batch.size for batch in _batches.values()),
+        "pending_batches": len(_batches)
+    }